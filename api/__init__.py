@@ -0,0 +1,4 @@
+"""API ДендроМонитор: обработчики запросов и общие модули"""
+
+# Допустимые состояния деревьев, от лучшего к худшему (те же ключи, что в js/map.js)
+STATUSES = ('excellent', 'good', 'satisfactory', 'poor', 'critical')
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""Аналитика по истории осмотров: /api/analytics/<отчет>
+
+История (tree_status без плановых записей) загружается в столбцовые
+массивы NumPy: дерево, день осмотра и уровень состояния (0 - excellent,
+4 - critical). Все отчеты считаются по массивам целиком, без циклов по
+деревьям. Готовые отчеты хранятся до следующего изменения истории
+(счетчик status_version, см. api/projections.py). После новых осмотров
+в массивы дочитываются только новые записи; полностью история
+перечитывается, только если записи истории или деревья изменялись
+или удалялись.
+
+    /api/analytics/degradation?group=species|district
+        скорость ухудшения: уровней состояния в год по породе или району
+    /api/analytics/time-to-critical?limit=50
+        наблюдаемое и прогнозное время до критического состояния
+    /api/analytics/drops?levels=2&months=6&limit=100
+        деревья, состояние которых упало на levels уровней за months месяцев
+
+Районов в базе нет, поэтому район - ячейка сетки кластеров на масштабе
+DISTRICT_ZOOM (около 3 x 5 км в широтах Москвы).
+Полный пересчет с замером времени: python -m api.analytics
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if __package__ in (None, ''):
+    # Запуск как скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import STATUSES
+from api.db import get_db_connection
+from api.projections import cluster_scale
+from api.request import Response
+
+# Уровень состояния: чем больше, тем хуже
+STATUS_LEVELS = {status: level for level, status in enumerate(STATUSES)}
+CRITICAL_LEVEL = STATUS_LEVELS['critical']
+
+DISTRICT_ZOOM = 11
+DAYS_PER_YEAR = 365.25
+DAYS_PER_MONTH = DAYS_PER_YEAR / 12
+
+EPOCH = datetime.date(1970, 1, 1)
+
+STATUS_VERSION_SQL = 'SELECT version, rewrites FROM status_version WHERE id = 1'
+
+# Граница загрузки: записи истории после нее дочитываются при следующем запросе
+LAST_STATUS_ID_SQL = 'SELECT MAX(id) FROM tree_status'
+
+# Уровень и день (от 1970-01-01) считает SQLite: в Python приходят только числа
+STATUS_LEVEL_SQL = 'CASE status ' + ' '.join(
+    f"WHEN '{status}' THEN {level}" for status, level in STATUS_LEVELS.items()
+) + ' END'
+
+# Порядок id: при равных датах осмотры сортируются в порядке записи
+HISTORY_SQL = f'''
+    SELECT tree_id,
+           CAST(julianday(date_recorded) - 2440587.5 AS INTEGER) AS day,
+           {STATUS_LEVEL_SQL} AS level
+    FROM tree_status
+    WHERE id > ? AND id <= ?
+      AND status IN ({', '.join(f"'{status}'" for status in STATUSES)})
+      AND COALESCE(is_future_plan, 0) = 0
+      AND julianday(date_recorded) IS NOT NULL
+    ORDER BY id
+'''
+
+TREES_SQL = 'SELECT id, species, latitude, longitude FROM trees WHERE id > ? ORDER BY id'
+
+HISTORY_DTYPE = [('tree_id', 'i8'), ('day', 'i4'), ('level', 'i1')]
+TREES_DTYPE = [('id', 'i8'), ('species', 'i4'), ('latitude', 'f8'), ('longitude', 'f8')]
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+def day_to_date(day):
+    """ISO-дата по номеру дня от 1970-01-01"""
+    return (EPOCH + datetime.timedelta(days=int(day))).isoformat()
+
+def group_median(codes, values, group_count):
+    """Медиана values в каждой группе codes (NaN для пустых групп)"""
+    order = np.lexsort((values, codes))
+    codes = codes[order]
+    values = values[order]
+    counts = np.bincount(codes, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+
+    medians = np.full(group_count, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians
+
+def rounded(value, digits=3):
+    """Число для JSON: NaN и бесконечность - null"""
+    value = float(value)
+    return round(value, digits) if np.isfinite(value) else None
+
+class HealthHistory:
+    """История осмотров в столбцовых массивах, отсортированная по дереву и дате
+
+    trees - деревья по возрастанию id; tree, day, level - номер дерева в trees,
+    день и уровень каждого осмотра. last_status_id - последняя прочитанная
+    запись tree_status.
+    """
+
+    def __init__(self, species_names, trees, tree, day, level, last_status_id):
+        self.species_names = species_names
+        self.trees = trees
+        self.tree_ids = trees['id']
+        self.tree_species = trees['species']
+        self.tree = tree
+        self.day = day
+        self.level = level
+        self.last_status_id = last_status_id
+
+        # Район дерева: ячейка сетки, пронумерованная от 0
+        scale = cluster_scale(DISTRICT_ZOOM)
+        cell_x = ((trees['longitude'] + 180) * scale).astype(np.int64)
+        cell_y = ((trees['latitude'] + 90) * scale).astype(np.int64)
+        cells, self.tree_district = np.unique(cell_x << 32 | cell_y, return_inverse=True)
+        self.district_cells = np.stack([cells >> 32, cells & 0xFFFFFFFF], axis=1)
+
+        # Первый и последний осмотр каждого дерева
+        boundary = self.tree[1:] != self.tree[:-1]
+        self.same_tree = ~boundary
+        if self.rows:
+            self.first = np.flatnonzero(np.r_[True, boundary])
+            self.last = np.flatnonzero(np.r_[boundary, True])
+        else:
+            self.first = self.last = np.empty(0, np.int64)
+
+    @property
+    def rows(self):
+        return len(self.tree)
+
+    def group_codes(self, group):
+        """Код группы каждого дерева и описания групп"""
+        if group == 'species':
+            return self.tree_species, [{'species': name} for name in self.species_names]
+
+        scale = cluster_scale(DISTRICT_ZOOM)
+        return self.tree_district, [
+            {
+                'district': {
+                    'zoom': DISTRICT_ZOOM,
+                    'cell_x': int(cell_x),
+                    'cell_y': int(cell_y),
+                    'latitude': round((cell_y + 0.5) / scale - 90, 5),
+                    'longitude': round((cell_x + 0.5) / scale - 180, 5),
+                }
+            }
+            for cell_x, cell_y in self.district_cells
+        ]
+
+    def transitions(self):
+        """Переходы между соседними осмотрами одного дерева: (дерево, изменение уровня, дней)"""
+        same = self.same_tree
+        tree = self.tree[1:][same]
+        change = (self.level[1:] - self.level[:-1])[same]
+        days = (self.day[1:] - self.day[:-1])[same]
+        return tree, change, days
+
+    def degradation_rates(self, group):
+        """Изменение уровня в год по группам: (коды деревьев, описания, массивы показателей)"""
+        tree_codes, groups = self.group_codes(group)
+        count = len(groups)
+        tree, change, days = self.transitions()
+        codes = tree_codes[tree]
+
+        years = np.bincount(codes, weights=days, minlength=count) / DAYS_PER_YEAR
+        net = np.bincount(codes, weights=change, minlength=count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(years > 0, net / years, np.nan)
+
+        metrics = {
+            'trees': np.bincount(tree_codes[self.tree[self.first]], minlength=count),
+            'inspections': np.bincount(tree_codes[self.tree], minlength=count),
+            'transitions': np.bincount(codes, minlength=count),
+            'worsened': np.bincount(codes, weights=change > 0, minlength=count),
+            'improved': np.bincount(codes, weights=change < 0, minlength=count),
+            'observed_years': years,
+            'levels_per_year': rate,
+        }
+        return tree_codes, groups, metrics
+
+    def degradation(self, group):
+        """Скорость ухудшения по породам или районам, от быстрой к медленной"""
+        _, groups, metrics = self.degradation_rates(group)
+        present = np.flatnonzero(metrics['trees'] > 0)
+        # Группы без переходов (NaN) в конце
+        rate = metrics['levels_per_year'][present]
+        present = present[np.argsort(np.nan_to_num(-rate, nan=np.inf), kind='stable')]
+
+        return [
+            dict(groups[code],
+                 trees=int(metrics['trees'][code]),
+                 inspections=int(metrics['inspections'][code]),
+                 transitions=int(metrics['transitions'][code]),
+                 worsened=int(metrics['worsened'][code]),
+                 improved=int(metrics['improved'][code]),
+                 observed_years=rounded(metrics['observed_years'][code], 1),
+                 levels_per_year=rounded(metrics['levels_per_year'][code]))
+            for code in present
+        ]
+
+    def time_to_critical(self, limit):
+        """Время до критического состояния
+
+        По породам: медиана наблюдаемого срока от первого осмотра до первого
+        критического и медиана прогноза для остальных деревьев. Прогноз
+        дерева: оставшиеся уровни, деленные на скорость ухудшения породы.
+        """
+        species, groups, metrics = self.degradation_rates('species')
+        count = len(groups)
+
+        # Наблюдаемый срок: первый критический осмотр после первого осмотра дерева
+        first_day = np.zeros(len(self.tree_ids), np.int64)
+        first_day[self.tree[self.first]] = self.day[self.first]
+        critical = np.flatnonzero(self.level == CRITICAL_LEVEL)
+        reached_trees, first_critical = np.unique(self.tree[critical], return_index=True)
+        observed_days = self.day[critical[first_critical]] - first_day[reached_trees]
+        reached_species = species[reached_trees]
+
+        # Прогноз по текущему (последнему) состоянию
+        current_tree = self.tree[self.last]
+        current_level = self.level[self.last]
+        current_day = self.day[self.last]
+        rate = metrics['levels_per_year'][species[current_tree]]
+        at_risk = (current_level < CRITICAL_LEVEL) & (rate > 0)
+        years_left = np.full(len(current_tree), np.inf)
+        years_left[at_risk] = (CRITICAL_LEVEL - current_level[at_risk]) / rate[at_risk]
+
+        forecast = np.flatnonzero(at_risk)
+        species_rows = np.flatnonzero(metrics['trees'] > 0)
+        observed_median = group_median(reached_species, observed_days.astype(np.float64), count)
+        forecast_median = group_median(species[current_tree[forecast]], years_left[forecast], count)
+        reached = np.bincount(reached_species, minlength=count)
+        critical_now = np.bincount(species[current_tree], weights=current_level == CRITICAL_LEVEL,
+                                   minlength=count)
+
+        soonest = forecast
+        if len(soonest) > limit:
+            soonest = soonest[np.argpartition(current_day[soonest] + years_left[soonest] * DAYS_PER_YEAR,
+                                              limit)[:limit]]
+        critical_day = current_day[soonest] + years_left[soonest] * DAYS_PER_YEAR
+        soonest = soonest[np.argsort(critical_day, kind='stable')]
+
+        return {
+            'species': [
+                dict(groups[code],
+                     trees=int(metrics['trees'][code]),
+                     critical_now=int(critical_now[code]),
+                     reached_critical=int(reached[code]),
+                     median_days_to_critical=rounded(observed_median[code], 1),
+                     levels_per_year=rounded(metrics['levels_per_year'][code]),
+                     median_forecast_years=rounded(forecast_median[code], 2))
+                for code in species_rows
+            ],
+            'trees': [
+                {
+                    'tree_id': int(self.tree_ids[current_tree[row]]),
+                    'species': self.species_names[species[current_tree[row]]],
+                    'status': STATUSES[current_level[row]],
+                    'last_inspection': day_to_date(current_day[row]),
+                    'years_to_critical': rounded(years_left[row], 2),
+                    'forecast_critical_date': day_to_date(current_day[row] + years_left[row] * DAYS_PER_YEAR),
+                }
+                for row in soonest
+            ],
+        }
+
+    def drops(self, levels, months, limit):
+        """Деревья, состояние которых ухудшилось на levels и более уровней за months месяцев
+
+        Для каждого осмотра ищется лучший уровень среди осмотров того же
+        дерева за предыдущие months месяцев (по префиксным суммам), для
+        дерева берется последний такой осмотр. Сначала самые свежие.
+        """
+        if levels > CRITICAL_LEVEL or not self.rows:
+            return []
+
+        # Ключ (дерево, день) возрастает вдоль массивов: начало окна - бинарный поиск
+        key = (self.tree.astype(np.int64) << 32) + self.day
+        window = int(round(months * DAYS_PER_MONTH))
+        start = np.searchsorted(key, key - window, side='left')
+        del key
+
+        # Лучший (наименьший) уровень в окне; проверяются только уровни,
+        # от которых возможно падение на levels
+        best = np.full(self.rows, CRITICAL_LEVEL + 1, np.int8)
+        for level in range(CRITICAL_LEVEL - levels + 1):
+            seen = np.concatenate(([0], np.cumsum(self.level <= level, dtype=np.int32)))
+            in_window = (seen[1:] - seen[start]) > 0
+            best[in_window & (best > level)] = level
+            del seen, in_window
+
+        dropped = np.flatnonzero(self.level - best >= levels)
+        if not len(dropped):
+            return []
+
+        # Последний осмотр с падением у каждого дерева
+        trees, last_index = np.unique(self.tree[dropped][::-1], return_index=True)
+        dropped = dropped[::-1][last_index]
+        dropped = dropped[np.lexsort((self.tree[dropped], -self.day[dropped]))][:limit]
+
+        return [
+            {
+                'tree_id': int(self.tree_ids[self.tree[row]]),
+                'species': self.species_names[self.tree_species[self.tree[row]]],
+                'from_status': STATUSES[best[row]],
+                'status': STATUSES[self.level[row]],
+                'levels': int(self.level[row] - best[row]),
+                'date_recorded': day_to_date(self.day[row]),
+            }
+            for row in dropped
+        ]
+
+def load_history(conn, base=None):
+    """Деревья и история осмотров из базы в массивы
+
+    С base дочитываются только деревья и записи истории, добавленные после
+    нее (id растут), и добавляются к ее массивам.
+    """
+    species_names = list(base.species_names) if base else []
+    species_index = {name: code for code, name in enumerate(species_names)}
+
+    def rows(sql, params):
+        # Кортежи вместо sqlite3.Row: np.fromiter читает их напрямую
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        return cursor.execute(sql, params)
+
+    def tree_rows():
+        for tree_id, species, latitude, longitude in rows(TREES_SQL, (after_tree,)):
+            code = species_index.get(species)
+            if code is None:
+                code = species_index[species] = len(species_names)
+                species_names.append(species)
+            yield tree_id, code, latitude, longitude
+
+    # Сначала граница истории, затем деревья: деревья всех прочитанных записей уже есть
+    after_status = base.last_status_id if base else 0
+    last_status = conn.execute(LAST_STATUS_ID_SQL).fetchone()[0] or 0
+    after_tree = int(base.tree_ids[-1]) if base and len(base.tree_ids) else 0
+    trees = np.fromiter(tree_rows(), dtype=TREES_DTYPE)
+    history = np.fromiter(rows(HISTORY_SQL, (after_status, last_status)), dtype=HISTORY_DTYPE)
+    if base:
+        trees = np.concatenate([base.trees, trees])
+
+    # Записи деревьев, которых уже нет, отбрасываются
+    tree = np.searchsorted(trees['id'], history['tree_id'])
+    known = np.zeros(len(tree), bool)
+    found = tree < len(trees)
+    known[found] = trees['id'][tree[found]] == history['tree_id'][found]
+    tree = tree[known].astype(np.int32)
+    day = history['day'][known]
+    level = history['level'][known]
+    if base:
+        tree = np.concatenate([base.tree, tree])
+        day = np.concatenate([base.day, day])
+        level = np.concatenate([base.level, level])
+
+    # Устойчивая сортировка сохраняет порядок записи при равных датах;
+    # после дочитывания массив почти упорядочен и сортируется быстро
+    order = np.argsort((tree.astype(np.int64) << 32) + day, kind='stable')
+    return HealthHistory(species_names, trees, tree[order], day[order], level[order], last_status)
+
+class AnalyticsCache:
+    """История в массивах и посчитанные отчеты до изменения status_version"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.rewrites = None
+        self.history = None
+        self.reports = {}
+        self.loads = 0
+        self.appends = 0
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+
+    def current_history(self, conn):
+        """История для текущей версии; обновляется один раз после записи"""
+        version, rewrites = conn.execute(STATUS_VERSION_SQL).fetchone()
+        # Один загружающий поток, остальные ждут его результат
+        with self.lock:
+            if version != self.version:
+                # Были только вставки: дочитываем новые записи
+                base = self.history if rewrites == self.rewrites else None
+                started = time.perf_counter()
+                self.history = load_history(conn, base)
+                self.load_time = time.perf_counter() - started
+                self.version = version
+                self.rewrites = rewrites
+                self.reports = {}
+                if base is None:
+                    self.loads += 1
+                else:
+                    self.appends += 1
+            return self.version, self.history
+
+    def report(self, name, params, compute):
+        """Отчет из кэша или посчитанный по текущей истории"""
+        conn = get_db_connection()
+        try:
+            version, history = self.current_history(conn)
+        finally:
+            conn.close()
+
+        key = (name,) + tuple(params)
+        with self.lock:
+            if self.version == version and key in self.reports:
+                self.hits += 1
+                return self.reports[key]
+
+        started = time.perf_counter()
+        result = compute(history, *params)
+        result = {
+            'version': version,
+            'compute_ms': round((time.perf_counter() - started) * 1000, 1),
+            'result': result,
+        }
+        with self.lock:
+            self.misses += 1
+            if self.version == version:
+                self.reports[key] = result
+        return result
+
+    def stats(self):
+        """Размер загруженной истории и попадания в кэш отчетов"""
+        with self.lock:
+            history = self.history
+            return {
+                'numpy': np is not None,
+                'version': self.version,
+                'rows': history.rows if history is not None else 0,
+                'trees': len(history.tree_ids) if history is not None else 0,
+                'loads': self.loads,
+                'appends': self.appends,
+                'last_load_ms': round(self.load_time * 1000, 1),
+                'reports': len(self.reports),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+analytics_cache = AnalyticsCache()
+
+def parse_int(request, name, default, minimum, maximum):
+    """Целый параметр запроса в допустимых пределах; ValueError с понятным текстом"""
+    value = request.param(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an integer')
+    if not minimum <= value <= maximum:
+        raise ValueError(f'{name} must be between {minimum} and {maximum}')
+    return value
+
+def degradation_report(request):
+    group = request.param('group', 'species')
+    if group not in ('species', 'district'):
+        raise ValueError('group must be species or district')
+    return 'degradation', (group,), HealthHistory.degradation
+
+def time_to_critical_report(request):
+    limit = parse_int(request, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    return 'time-to-critical', (limit,), HealthHistory.time_to_critical
+
+def drops_report(request):
+    levels = parse_int(request, 'levels', 2, 1, CRITICAL_LEVEL)
+    months = parse_int(request, 'months', 6, 1, 120)
+    limit = parse_int(request, 'limit', 100, 1, MAX_LIMIT)
+    return 'drops', (levels, months, limit), HealthHistory.drops
+
+# Отчеты: /api/analytics/<имя>
+ANALYTICS_REPORTS = {
+    'degradation': degradation_report,
+    'time-to-critical': time_to_critical_report,
+    'drops': drops_report,
+}
+
+def handle(request):
+    """Обработка запроса отчета аналитики"""
+    report = ANALYTICS_REPORTS.get(request.path.rstrip('/').rsplit('/', 1)[-1])
+    if report is None:
+        return Response({'error': 'Unknown analytics report'}, status=404)
+    if np is None:
+        return Response({'error': 'Analytics requires numpy (pip install numpy)'}, status=503)
+
+    try:
+        name, params, compute = report(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    return Response(analytics_cache.report(name, params, compute))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Полный пересчет аналитики по истории осмотров с замером времени')
+    parser.parse_args(argv)
+
+    if np is None:
+        print("❌ Для аналитики нужен numpy: pip install numpy")
+        sys.exit(1)
+
+    conn = get_db_connection()
+    try:
+        started = time.perf_counter()
+        history = load_history(conn)
+        loaded = time.perf_counter()
+    finally:
+        conn.close()
+
+    print(f"✅ Загружено {history.rows} осмотров {len(history.tree_ids)} деревьев за {loaded - started:.2f} с")
+    reports = [
+        ('по породам', lambda: history.degradation('species')),
+        ('по районам', lambda: history.degradation('district')),
+        ('время до критического', lambda: history.time_to_critical(DEFAULT_LIMIT)),
+        ('падение на 2 уровня за 6 месяцев', lambda: history.drops(2, 6, 100)),
+    ]
+    for title, compute in reports:
+        report_started = time.perf_counter()
+        compute()
+        print(f"   {title}: {time.perf_counter() - report_started:.2f} с")
+    print(f"✅ Всего {time.perf_counter() - started:.2f} с")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Кэш ответов API на чтение с ETag по версии данных
+
+Ключ кэша - путь и нормализованная строка запроса. Запись в кэше
+действительна, пока не изменилась версия данных (data_version, ее
+увеличивают триггеры на trees и tree_status), поэтому кэш не нужно
+сбрасывать вручную и он корректен при нескольких процессах. Ответы с
+комментариями зависят еще и от версии комментариев (comment_version):
+своего дерева или всех деревьев. ETag тоже строится из версии: ответ
+304 отдается без обращения к данным и без сериализации.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from api.db import get_db_connection
+from api.projections import ALL_COMMENTS
+from api.request import Response
+
+RESPONSE_CACHE_BYTES = int(os.environ.get('DENDRO_RESPONSE_CACHE_MB', 64)) * 1024 * 1024
+
+# Браузер хранит ответ, но каждый раз перепроверяет его по ETag
+API_CACHE_CONTROL = 'no-cache'
+
+DATA_VERSION_SQL = 'SELECT version FROM data_version WHERE id = 1'
+
+# Версия проверенных комментариев дерева (ALL_COMMENTS - всех деревьев)
+COMMENT_VERSION_SQL = '''
+    SELECT COALESCE((SELECT version FROM comment_version WHERE tree_id = ?), 0)
+'''
+
+DATA_COMMENT_VERSION_SQL = '''
+    SELECT (SELECT version FROM data_version WHERE id = 1),
+           COALESCE((SELECT version FROM comment_version WHERE tree_id = ?), 0)
+'''
+
+def get_data_version():
+    """Текущая версия данных"""
+    conn = get_db_connection()
+    try:
+        return conn.execute(DATA_VERSION_SQL).fetchone()[0]
+    finally:
+        conn.close()
+
+def get_comment_version(tree_id=ALL_COMMENTS):
+    """Версия комментариев дерева: меняется только при изменении его проверенных комментариев"""
+    conn = get_db_connection()
+    try:
+        return conn.execute(COMMENT_VERSION_SQL, (tree_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def get_data_comment_version(tree_id=ALL_COMMENTS):
+    """Версия ответа, который зависит и от данных, и от комментариев дерева (или всех)"""
+    conn = get_db_connection()
+    try:
+        data_version, comment_version = conn.execute(DATA_COMMENT_VERSION_SQL, (tree_id,)).fetchone()
+    finally:
+        conn.close()
+    return f'{data_version}.{comment_version}'
+
+def cache_key(request):
+    """Путь и параметры в порядке, не зависящем от клиента"""
+    params = sorted((name, value) for name, values in request.query.items() for value in values)
+    return f'{request.path.rstrip("/")}?{urlencode(params)}'
+
+def make_etag(key, version):
+    """Сильный ETag: ответ по одному ключу меняется только вместе с версией данных"""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+class ResponseCache:
+    """LRU кэш закодированных ответов с ограничением по объему"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, response):
+        body = response.body()
+        if len(body) > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (version, body, response.content_type)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted_body, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted_body)
+                self.evictions += 1
+
+    def count_not_modified(self):
+        with self.lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+
+def cached(handler, version=None):
+    """Обертка обработчика GET-запросов: кэш ответов, ETag и 304 Not Modified
+
+    version(request) - версия данных ответа, по умолчанию data_version.
+    """
+    get_version = version or (lambda request: get_data_version())
+
+    def cached_handler(request):
+        if request.method != 'GET':
+            return handler(request)
+
+        key = cache_key(request)
+        version = get_version(request)
+        etag = make_etag(key, version)
+        headers = {'ETag': etag, 'Cache-Control': API_CACHE_CONTROL}
+
+        # Слабое сравнение: сжатый ответ отдается со слабым ETag (W/"...")
+        if_none_match = request.header('If-None-Match', '')
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if etag in tags or '*' in tags:
+            response_cache.count_not_modified()
+            return Response(status=304, raw=b'', headers=headers)
+
+        entry = response_cache.get(key, version)
+        if entry is not None:
+            _, body, content_type = entry
+            return Response(raw=body, content_type=content_type, headers=headers)
+
+        response = handler(request)
+        if response.status == 200:
+            if response.stream is None:
+                # Потоковые ответы не кэшируются: это сводило бы на нет экономию памяти
+                response_cache.put(key, version, response)
+            response.headers.update(headers)
+        return response
+
+    return cached_handler
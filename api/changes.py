@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Изменения данных после версии клиента: /api/changes?since=<версия>
+
+Журнал change_log (см. api/projections.py) ведут триггеры: добавление,
+изменение и удаление деревьев и осмотров, проверка, изменение и снятие
+проверки комментариев. Клиент сначала узнает текущую версию
+(/api/changes без since), затем загружает данные целиком и дальше
+запрашивает только изменения:
+
+    {"version": 120, "more": false,
+     "trees": [...], "statuses": [...], "comments": [...],
+     "deleted": {"trees": [...], "statuses": [...], "comments": [...]}}
+
+Строки деревьев - как в /api/trees, в том числе деревья, у которых
+появились осмотры. Если клиент отстал больше, чем хранит журнал, ответ
+410 с текущей версией: данные нужно загрузить заново.
+
+/api/changes/stream?since=<версия> - те же изменения потоком Server-Sent
+Events (событие changes, id события - версия), при переподключении
+EventSource продолжает с заголовка Last-Event-ID.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.cache import get_data_comment_version
+from api.db import get_db_connection
+from api.request import Response, run_cgi
+
+# Последняя выданная версия и самая старая версия в журнале
+CHANGE_VERSIONS_SQL = '''
+    SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0),
+           (SELECT MIN(version) FROM change_log)
+'''
+
+CHANGES_SQL = '''
+    SELECT version, entity, entity_id, tree_id, deleted
+    FROM change_log
+    WHERE version > ?
+    ORDER BY version
+    LIMIT ?
+'''
+
+# Деревья из списка id (JSON-массив) в том же виде, что и в /api/trees
+CHANGED_TREES_SQL = '''
+    SELECT t.*, cs.status, cs.notes as status_notes
+    FROM trees t
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    WHERE t.id IN (SELECT value FROM json_each(?))
+'''
+
+CHANGED_STATUSES_SQL = '''
+    SELECT * FROM tree_status
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+CHANGED_COMMENTS_SQL = '''
+    SELECT * FROM comments
+    WHERE id IN (SELECT value FROM json_each(?)) AND is_reviewed = 1
+'''
+
+# Записей журнала в одном ответе; остальные - следующим запросом с новой версией
+CHANGES_LIMIT = 1000
+
+ENTITY_GROUPS = {'tree': 'trees', 'status': 'statuses', 'comment': 'comments'}
+
+# Поток событий занимает рабочий поток сервера, поэтому одновременных потоков
+# не больше MAX_STREAMS, и каждый закрывается через STREAM_SECONDS (EventSource
+# переподключается сам). Лишнему клиенту отвечаем паузой retry и закрытием.
+# Поток открывает только панель специалиста, публичная карта опрашивает /api/changes
+MAX_STREAMS = int(os.environ.get('DENDRO_MAX_STREAMS', 2))
+STREAM_SECONDS = 300
+STREAM_POLL_SECONDS = 1.0
+STREAM_HEARTBEAT_SECONDS = 5
+STREAM_RETRY_MS = 3000
+STREAM_BUSY_RETRY_MS = 30000
+
+SSE_CONTENT_TYPE = 'text/event-stream; charset=utf-8'
+
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+streams_stopping = threading.Event()
+
+class ChangesExpired(Exception):
+    """Журнал уже не содержит изменений после версии клиента"""
+
+    def __init__(self, version):
+        super().__init__('change log no longer covers this version, reload the data')
+        self.version = version
+
+def current_version():
+    """Последняя версия журнала"""
+    conn = get_db_connection()
+    try:
+        return conn.execute(CHANGE_VERSIONS_SQL).fetchone()[0]
+    finally:
+        conn.close()
+
+def get_changes(since, limit=CHANGES_LIMIT):
+    """Изменения после версии since: строки, удаления и новая версия"""
+    conn = get_db_connection()
+    try:
+        # Журнал и строки читаются в одной транзакции: из одного состояния базы
+        conn.execute('BEGIN')
+        try:
+            version, oldest = conn.execute(CHANGE_VERSIONS_SQL).fetchone()
+            if since > version or (oldest is not None and since < oldest - 1):
+                raise ChangesExpired(version)
+
+            # Лишняя запись показывает, что за страницей есть еще изменения
+            entries = conn.execute(CHANGES_SQL, (since, limit + 1)).fetchall() if since < version else []
+            more = len(entries) > limit
+            entries = entries[:limit]
+
+            # Последняя запись о сущности определяет, изменена она или удалена
+            latest = {}
+            tree_ids = set()
+            for entry in entries:
+                latest[(entry['entity'], entry['entity_id'])] = entry['deleted']
+                if entry['entity'] == 'status' and entry['tree_id'] is not None:
+                    tree_ids.add(entry['tree_id'])
+
+            changed = {group: [] for group in ENTITY_GROUPS.values()}
+            deleted = {group: [] for group in ENTITY_GROUPS.values()}
+            for (entity, entity_id), is_deleted in latest.items():
+                (deleted if is_deleted else changed)[ENTITY_GROUPS[entity]].append(entity_id)
+
+            # Новые осмотры меняют текущее состояние дерева
+            tree_ids.update(changed['trees'])
+            tree_ids.difference_update(deleted['trees'])
+
+            # Строка могла быть удалена позже этой страницы журнала: ее удаление придет следующей
+            rows = {
+                'trees': conn.execute(CHANGED_TREES_SQL, (json.dumps(sorted(tree_ids)),)).fetchall(),
+                'statuses': conn.execute(CHANGED_STATUSES_SQL, (json.dumps(changed['statuses']),)).fetchall(),
+                'comments': conn.execute(CHANGED_COMMENTS_SQL, (json.dumps(changed['comments']),)).fetchall(),
+            }
+        finally:
+            conn.rollback()
+    finally:
+        conn.close()
+
+    result = {
+        'since': since,
+        'version': entries[-1]['version'] if more else version,
+        'more': more,
+    }
+    result.update({group: [dict(row) for row in group_rows] for group, group_rows in rows.items()})
+    result['deleted'] = {group: sorted(ids) for group, ids in deleted.items()}
+    return result
+
+def has_changes(changes):
+    return any(changes[group] or changes['deleted'][group] for group in ENTITY_GROUPS.values())
+
+def sse_event(data, event=None, event_id=None):
+    """Событие Server-Sent Events в байтах"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+def stream_changes(since):
+    """Поток событий: изменения по мере появления, комментарий-пинг в паузах"""
+    if not stream_slots.acquire(blocking=False):
+        yield f'retry: {STREAM_BUSY_RETRY_MS}\n\n'.encode('utf-8')
+        return
+
+    try:
+        yield f'retry: {STREAM_RETRY_MS}\n\n'.encode('utf-8')
+        deadline = time.monotonic() + STREAM_SECONDS
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline and not streams_stopping.is_set():
+            try:
+                changes = get_changes(since) if current_version() != since else None
+            except ChangesExpired as e:
+                yield sse_event({'version': e.version}, event='reset', event_id=e.version)
+                return
+
+            if changes is not None:
+                since = changes['version']
+                if has_changes(changes):
+                    yield sse_event(changes, event='changes', event_id=since)
+                    last_sent = time.monotonic()
+                if changes['more']:
+                    continue
+            if time.monotonic() - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                # Комментарий не виден клиенту, но обнаруживает закрытое соединение
+                yield b': ping\n\n'
+                last_sent = time.monotonic()
+            streams_stopping.wait(STREAM_POLL_SECONDS)
+    finally:
+        stream_slots.release()
+
+def stop_streams():
+    """Завершение потоков событий при остановке сервера"""
+    streams_stopping.set()
+
+def parse_version(value):
+    if not value.isdigit():
+        raise ValueError('since must be a non-negative integer version')
+    return int(value)
+
+def cache_version(request):
+    """Версия для кэша ответов: журнал пополняют и проверенные комментарии"""
+    return get_data_comment_version()
+
+def handle(request):
+    """Обработка запроса: /api/changes?since= и /api/changes/stream?since="""
+    since = request.param('since')
+
+    if request.path.rstrip('/').endswith('/stream'):
+        # EventSource переподключается по тому же адресу и передает id последнего события
+        since = request.header('Last-Event-ID') or since
+        try:
+            since = parse_version(since) if since else current_version()
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(stream=stream_changes(since), content_type=SSE_CONTENT_TYPE,
+                        headers={'Cache-Control': 'no-cache'})
+
+    if not since:
+        return Response({'version': current_version()})
+    try:
+        return Response(get_changes(parse_version(since)))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    except ChangesExpired as e:
+        return Response({'error': str(e), 'version': e.version}, status=410)
+
+if __name__ == '__main__':
+    run_cgi(handle)
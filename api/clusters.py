@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.db import get_db_connection
+from api.projections import CLUSTER_MAX_ZOOM, CLUSTER_STATUS_COLUMNS, cluster_cell
+from api.request import Response, parse_bbox, run_cgi
+
+# Непустые ячейки уровня масштаба в диапазоне ячеек области карты
+CLUSTERS_SQL = '''
+    SELECT * FROM tree_clusters
+    WHERE zoom = ?
+      AND cell_x BETWEEN ? AND ?
+      AND cell_y BETWEEN ? AND ?
+      AND tree_count > 0
+'''
+
+def get_clusters(bbox, zoom):
+    """Кластеры деревьев в области карты из заранее посчитанных агрегатов"""
+    zoom = max(0, min(zoom, CLUSTER_MAX_ZOOM))
+    min_lon, min_lat, max_lon, max_lat = bbox
+    min_x, min_y = cluster_cell(zoom, min_lat, min_lon)
+    max_x, max_y = cluster_cell(zoom, max_lat, max_lon)
+
+    conn = get_db_connection()
+    
+    cells = conn.execute(CLUSTERS_SQL, (zoom, min_x, max_x, min_y, max_y)).fetchall()
+    
+    conn.close()
+    
+    clusters = []
+    for cell in cells:
+        clusters.append({
+            'latitude': cell['lat_sum'] / cell['tree_count'],
+            'longitude': cell['lon_sum'] / cell['tree_count'],
+            'count': cell['tree_count'],
+            'statuses': {status: cell[status] for status in CLUSTER_STATUS_COLUMNS},
+        })
+    
+    return {
+        'zoom': zoom,
+        'total': sum(cluster['count'] for cluster in clusters),
+        'clusters': clusters
+    }
+
+def handle(request):
+    """Обработка запроса кластеров: /api/trees/clusters?bbox=...&zoom=..."""
+    try:
+        bbox = parse_bbox(request.param('bbox', ''))
+        zoom = int(request.param('zoom', ''))
+    except ValueError:
+        return Response({'error': 'bbox and zoom parameters required'}, status=400)
+    
+    return Response(get_clusters(bbox, zoom))
+
+if __name__ == '__main__':
+    run_cgi(handle)
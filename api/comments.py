@@ -1,90 +1,110 @@
 #!/usr/bin/env python3
-import sqlite3
-import json
 import os
 import sys
-from urllib.parse import parse_qs
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'database.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.cache import get_comment_version
+from api.db import get_db_connection
+from api.pagination import DEFAULT_PAGE_SIZE, decode_cursor, is_paginated, page, parse_page_size
+from api.request import Response, run_cgi
+from api.write_queue import comment_writes
+
+# Проверенные комментарии дерева, новые первыми
+COMMENTS_SQL = '''
+    SELECT * FROM comments 
+    WHERE tree_id = ? AND is_reviewed = 1
+    ORDER BY created_at DESC, id DESC
+'''
+
+INSERT_COMMENT_SQL = '''
+    INSERT INTO comments (tree_id, user_name, text, contact_email)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Первая страница комментариев дерева
+COMMENTS_FIRST_PAGE_SQL = COMMENTS_SQL + '''
+    LIMIT ?
+'''
+
+# Следующая страница: комментарии старше последнего показанного (created_at, id)
+COMMENTS_PAGE_SQL = '''
+    SELECT * FROM comments
+    WHERE tree_id = ? AND is_reviewed = 1
+      AND (created_at, id) < (?, ?)
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+'''
 
 def add_comment(tree_id, user_name, text, contact_email):
-    """Добавление нового комментария"""
-    conn = get_db_connection()
-    
+    """Добавление нового комментария через очередь групповой фиксации"""
     try:
-        conn.execute('''
-            INSERT INTO comments (tree_id, user_name, text, contact_email)
-            VALUES (?, ?, ?, ?)
-        ''', (tree_id, user_name, text, contact_email))
-        
-        conn.commit()
-        comment_id = conn.lastrowid
-        conn.close()
-        
+        comment_id = comment_writes.submit(INSERT_COMMENT_SQL, (tree_id, user_name, text, contact_email))
         return {'success': True, 'comment_id': comment_id}
         
     except Exception as e:
-        conn.close()
         return {'success': False, 'error': str(e)}
 
 def get_comments(tree_id):
     """Получение комментариев для дерева"""
     conn = get_db_connection()
     
-    comments = conn.execute('''
-        SELECT * FROM comments 
-        WHERE tree_id = ? AND is_reviewed = 1
-        ORDER BY created_at DESC
-    ''', (tree_id,)).fetchall()
+    comments = conn.execute(COMMENTS_SQL, (tree_id,)).fetchall()
     
     conn.close()
     return [dict(comment) for comment in comments]
 
-def main():
-    """Основная функция обработки запросов"""
-    # Установка заголовков
-    print("Content-Type: application/json; charset=utf-8")
-    print("Access-Control-Allow-Origin: *")
-    print("Access-Control-Allow-Methods: GET, POST, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type")
-    print()
-    
+def get_comments_page(tree_id, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Страница комментариев дерева и курсор следующей"""
+    conn = get_db_connection()
     try:
-        if os.environ.get('REQUEST_METHOD') == 'POST':
-            # Чтение данных POST запроса
-            content_length = int(os.environ.get('CONTENT_LENGTH', 0))
-            post_data = sys.stdin.read(content_length)
-            data = json.loads(post_data)
-            
-            # Добавление комментария
-            result = add_comment(
-                data.get('tree_id'),
-                data.get('user_name', ''),
-                data.get('text'),
-                data.get('contact_email', '')
-            )
-            
-            print(json.dumps(result, ensure_ascii=False))
-            
+        if cursor:
+            created_at, comment_id = decode_cursor(cursor, 2)
+            rows = conn.execute(COMMENTS_PAGE_SQL, (tree_id, created_at, comment_id, page_size + 1)).fetchall()
         else:
-            # GET запрос - получение комментариев
-            import cgi
-            field_storage = cgi.FieldStorage()
-            tree_id = field_storage.getvalue('tree_id')
-            
-            if tree_id:
-                comments = get_comments(int(tree_id))
-                print(json.dumps(comments, ensure_ascii=False))
-            else:
-                print(json.dumps({'error': 'tree_id parameter required'}, ensure_ascii=False))
-                
-    except Exception as e:
-        print(json.dumps({'success': False, 'error': str(e)}, ensure_ascii=False))
+            rows = conn.execute(COMMENTS_FIRST_PAGE_SQL, (tree_id, page_size + 1)).fetchall()
+    finally:
+        conn.close()
+
+    comments, next_cursor = page(rows, page_size, lambda comment: [comment['created_at'], comment['id']])
+    return {'comments': comments, 'next': next_cursor}
+
+def cache_version(request):
+    """Версия для кэша ответов: комментарии дерева меняются только вместе с его версией"""
+    tree_id = request.param('tree_id')
+    return get_comment_version(int(tree_id)) if tree_id and tree_id.isdigit() else get_comment_version()
+
+def handle(request):
+    """Обработка запросов к комментариям"""
+    if request.method == 'POST':
+        data = request.json() or {}
+
+        # Добавление комментария
+        return Response(add_comment(
+            data.get('tree_id'),
+            data.get('user_name', ''),
+            data.get('text'),
+            data.get('contact_email', '')
+        ))
+
+    # GET запрос - получение комментариев
+    tree_id = request.param('tree_id')
+    if not tree_id:
+        return Response({'error': 'tree_id parameter required'}, status=400)
+
+    if is_paginated(request):
+        try:
+            return Response(get_comments_page(int(tree_id), request.param('cursor'), parse_page_size(request)))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+    return Response(get_comments(int(tree_id)))
+
+def main():
+    """Основная функция обработки запросов"""
+    run_cgi(handle)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Сжатие ответов API по заголовку Accept-Encoding
+
+gzip есть всегда (zlib), brotli - если установлен пакет brotli.
+Потоковые ответы сжимаются по частям, без сборки всего тела в памяти.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Короткие ответы не сжимаем: выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/geo+json')
+
+def supported_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def choose_encoding(accept_encoding):
+    """Кодировка ответа для заголовка Accept-Encoding или None (без сжатия)"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    for encoding in supported_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+def is_compressible(content_type):
+    """Сжимаются только текстовые JSON-ответы (тайлы и данные API)"""
+    return content_type.split(';')[0].strip() in COMPRESSIBLE_TYPES
+
+def make_compressor(encoding):
+    """Объект с методами compress(data) и flush()"""
+    if encoding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == 'br':
+        return BrotliCompressor()
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+class BrotliCompressor:
+    """Интерфейс zlib.compressobj поверх brotli.Compressor"""
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+def compress(body, encoding):
+    """Сжатие тела ответа целиком"""
+    compressor = make_compressor(encoding)
+    return compressor.compress(body) + compressor.flush()
+
+def compress_chunks(chunks, encoding):
+    """Сжатие потока частей тела; пустые части пропускаются
+
+    Пустая часть в chunked-передаче означала бы конец тела.
+    """
+    compressor = make_compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
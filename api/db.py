@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import sqlite3
+import os
+import threading
+import time
+
+# Путь к базе данных можно переопределить через DENDRO_DB (бенчмарки, тестовые копии)
+DB_PATH = os.environ.get(
+    'DENDRO_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'database.db')
+)
+
+# Настройки, которые применяются один раз при открытии подключения
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 10000',
+    'PRAGMA cache_size = -65536',        # 64 МБ страничного кэша
+    'PRAGMA mmap_size = 268435456',      # 256 МБ отображения файла в память
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Размер кэша подготовленных выражений на подключение
+STATEMENT_CACHE_SIZE = 256
+
+class PooledConnection(sqlite3.Connection):
+    """Подключение из пула: close() возвращает его в пул, а не закрывает"""
+
+    pool = None
+    # Учет времени запросов: функция (sql, секунды) или None (см. api/metrics.py)
+    query_timer = None
+    # Журнал медленных запросов, пока он включен (см. api/slow_queries.py)
+    query_tracer = None
+
+    def execute(self, sql, parameters=()):
+        if self.query_tracer is not None:
+            return self.query_tracer.execute(self, sql, parameters)
+        if self.query_timer is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.query_timer(sql, time.perf_counter() - started)
+
+    def close(self):
+        # Недочитанные курсоры журнала медленных запросов: запрос закончен вместе с работой с подключением
+        for cursor in self.__dict__.pop('traced_cursors', ()):
+            cursor.finish()
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def dispose(self):
+        """Настоящее закрытие подключения"""
+        super().close()
+
+class ConnectionPool:
+    """Пул заранее настроенных подключений к SQLite
+
+    Подключения открываются по требованию, но не более max_size, и
+    живут до остановки сервера. Рабочий поток держит не больше одного
+    подключения за запрос, поэтому при max_size, равном числу потоков,
+    у каждого потока фактически есть свое подключение.
+    """
+
+    def __init__(self, db_path, max_size=8, wait_timeout=10.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.idle = []
+        self.open_count = 0
+        self.condition = threading.Condition()
+
+        # Счетчики для подбора размера пула
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def connect(self):
+        """Открытие нового подключения с настройками производительности"""
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=10,
+            factory=PooledConnection,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        """Выдача подключения: свободное, новое или после ожидания"""
+        with self.condition:
+            self.checkouts += 1
+
+            if not self.idle and self.open_count >= self.max_size:
+                self.waits += 1
+                started = time.perf_counter()
+                ready = self.condition.wait_for(lambda: self.idle, timeout=self.wait_timeout)
+                self.wait_time += time.perf_counter() - started
+                if not ready:
+                    raise sqlite3.OperationalError('connection pool exhausted')
+
+            if self.idle:
+                # Последнее возвращенное подключение: его страницы еще в кэше
+                return self.idle.pop()
+
+            self.open_count += 1
+
+        try:
+            return self.connect()
+        except Exception:
+            with self.condition:
+                self.open_count -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, conn):
+        """Возврат подключения в пул"""
+        if conn.in_transaction:
+            # Незавершенная транзакция не должна достаться следующему запросу
+            conn.rollback()
+
+        with self.condition:
+            if conn in self.idle:
+                # Повторный close() того же подключения
+                return
+            self.idle.append(conn)
+            self.condition.notify()
+
+    def close_all(self):
+        """Закрытие всех свободных подключений"""
+        with self.condition:
+            for conn in self.idle:
+                conn.dispose()
+            self.open_count -= len(self.idle)
+            self.idle = []
+
+    def stats(self):
+        """Статистика пула"""
+        with self.condition:
+            return {
+                'max_size': self.max_size,
+                'open': self.open_count,
+                'idle': len(self.idle),
+                'in_use': self.open_count - len(self.idle),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time_ms': round(self.wait_time * 1000, 3),
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure_pool(max_size):
+    """Задание размера пула (вызывается сервером при запуске)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(DB_PATH, max_size=max_size)
+    return _pool
+
+def get_pool():
+    """Пул подключений текущего процесса"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+def get_db_connection():
+    """Получение подключения к базе данных из пула"""
+    return get_pool().acquire()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.analytics import analytics_cache
+from api.cache import response_cache
+from api.db import get_pool
+from api.request import Response, run_cgi
+from api.slow_queries import handle_debug as slow_queries
+from api.snapshot import tree_snapshot
+from api.tiles import tile_cache
+from api.write_queue import write_queue_stats
+
+# Разделы служебной информации: /api/debug/<раздел>
+DEBUG_SECTIONS = {
+    'pool': lambda request: get_pool().stats(),
+    'tiles': lambda request: tile_cache.stats(),
+    'cache': lambda request: response_cache.stats(),
+    'writes': lambda request: write_queue_stats(),
+    'analytics': lambda request: analytics_cache.stats(),
+    'snapshot': lambda request: tree_snapshot.stats(),
+    'slow-queries': slow_queries,
+}
+
+def handle(request):
+    """Служебная информация о работе сервера"""
+    section = DEBUG_SECTIONS.get(request.path.rstrip('/').rsplit('/', 1)[-1])
+    if section is None:
+        return Response({'error': 'Unknown debug endpoint'}, status=404)
+
+    try:
+        return Response(section(request))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+if __name__ == '__main__':
+    run_cgi(handle)
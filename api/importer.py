@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""Массовый импорт деревьев из CSV и GeoJSON
+
+Файл читается потоком, строки проверяются и вставляются пачками по
+BATCH_SIZE в одной транзакции (executemany для деревьев и их начальных
+состояний). Вместе с пачкой в той же транзакции сохраняются прогресс
+задания (import_jobs) и ошибки строк (import_errors), поэтому после
+сбоя импорт того же файла продолжается с первой незакоммиченной строки.
+Запуск из корня проекта:
+    python -m api.importer survey.csv
+    python -m api.importer trees.geojson --batch-size 10000
+    python -m api.importer survey.csv --job 3       # продолжить задание 3
+"""
+import argparse
+import codecs
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import date
+
+if __package__ in (None, ''):
+    # Запуск как скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import STATUSES
+from api.db import get_db_connection
+from api.migrations import init_database
+from api.request import Response
+from api.tiles import invalidate_points
+
+BATCH_SIZE = 5000
+
+# Сколько ошибок отдавать в отчете (все ошибки остаются в import_errors)
+ERROR_REPORT_LIMIT = 100
+
+READ_CHUNK_SIZE = 1 << 16
+
+# Названия колонок в выгрузках обследований -> поле дерева
+FIELD_ALIASES = {
+    'latitude': ('latitude', 'lat', 'широта'),
+    'longitude': ('longitude', 'lon', 'lng', 'долгота'),
+    'species': ('species', 'порода', 'вид'),
+    'address': ('address', 'адрес'),
+    'diameter': ('diameter', 'диаметр'),
+    'height': ('height', 'высота'),
+    'status': ('status', 'состояние'),
+    'notes': ('notes', 'примечание', 'заметки'),
+    'date_recorded': ('date_recorded', 'date', 'дата'),
+}
+
+INSERT_TREES_SQL = '''
+    INSERT INTO trees (id, latitude, longitude, species, address, diameter, height)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_STATUSES_SQL = '''
+    INSERT INTO tree_status (tree_id, status, notes, date_recorded)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Следующий id дерева: AUTOINCREMENT не выдает id меньше уже выданных
+NEXT_TREE_ID_SQL = '''
+    SELECT MAX(
+        COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'trees'), 0),
+        COALESCE((SELECT MAX(id) FROM trees), 0)
+    ) + 1
+'''
+
+# Незавершенное задание для того же файла
+UNFINISHED_JOB_SQL = '''
+    SELECT * FROM import_jobs
+    WHERE fingerprint = ? AND status != 'done'
+    ORDER BY id DESC
+    LIMIT 1
+'''
+
+# Завершенное задание для того же файла
+DONE_JOB_SQL = '''
+    SELECT id FROM import_jobs
+    WHERE fingerprint = ? AND status = 'done'
+    LIMIT 1
+'''
+
+IMPORT_JOB_SQL = '''
+    SELECT * FROM import_jobs WHERE id = ?
+'''
+
+IMPORT_ERRORS_SQL = '''
+    SELECT row_number, error, data FROM import_errors
+    WHERE job_id = ?
+    ORDER BY row_number
+    LIMIT ?
+'''
+
+def file_fingerprint(stream):
+    """Отпечаток содержимого файла: по нему находится задание для продолжения"""
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def parse_number(value):
+    """Число из ячейки; допускается десятичная запятая"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).strip().replace(',', '.'))
+
+def parse_text(value):
+    """Строка из ячейки без пробелов по краям"""
+    return '' if value is None else str(value).strip()
+
+def iter_csv(stream):
+    """Строки CSV как словари; разделитель (, ; табуляция) определяется по началу файла"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    sample = text.read(READ_CHUNK_SIZE)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    # Прочитанный образец возвращается в начало потока строк
+    lines = _prepend(sample, text)
+    yield from csv.DictReader(lines, dialect=dialect)
+
+def _prepend(sample, text):
+    """Поток строк: сначала прочитанный образец, затем остаток файла"""
+    rest = io.StringIO(sample)
+    line = rest.readline()
+    while line:
+        if not line.endswith('\n'):
+            # Строка оборвалась на границе образца
+            line += text.readline()
+        yield line
+        line = rest.readline()
+    yield from text
+
+def csv_record(row):
+    """Поля дерева из строки CSV по названиям колонок"""
+    columns = {(name or '').strip().lower(): value for name, value in row.items()}
+    record = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if alias in columns:
+                record[field] = columns[alias]
+                break
+    return record
+
+# Начало массива объектов FeatureCollection
+FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+
+def iter_geojson(stream):
+    """Объекты Feature из FeatureCollection или GeoJSON Lines без чтения файла целиком
+
+    Для FeatureCollection массив features ищется по ключу и разбирается
+    по одному объекту; остальные ключи коллекции не читаются.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    eof = False
+
+    def read_more():
+        nonlocal buffer, eof
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer += text_decoder.decode(chunk, final=eof)
+
+    while not eof and not buffer.strip():
+        read_more()
+    buffer = buffer.lstrip()
+    if not buffer:
+        return
+
+    if '"FeatureCollection"' in buffer[:1024]:
+        match = FEATURES_START.search(buffer)
+        while match is None and not eof:
+            read_more()
+            match = FEATURES_START.search(buffer)
+        if match is None:
+            raise ValueError('GeoJSON: features array not found')
+        buffer = buffer[match.end():]
+        end_char, separators = ']', ' \t\r\n,'
+    else:
+        # GeoJSON Lines / RFC 8142: по объекту на строку
+        end_char, separators = None, ' \t\r\n\x1e'
+
+    pos = 0
+    while True:
+        while True:
+            while pos < len(buffer) and buffer[pos] in separators:
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = '', 0
+            read_more()
+
+        if pos >= len(buffer):
+            if end_char:
+                raise ValueError('GeoJSON: unexpected end of file')
+            return
+        if buffer[pos] == end_char:
+            return
+
+        try:
+            feature, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError('GeoJSON: invalid feature JSON')
+            # Объект не поместился в буфер: дочитываем
+            buffer, pos = buffer[pos:], 0
+            read_more()
+            continue
+        yield feature
+
+def feature_record(feature):
+    """Поля дерева из объекта Feature с геометрией Point"""
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        raise ValueError('not a GeoJSON Feature')
+    geometry = feature.get('geometry') or {}
+    if geometry.get('type') != 'Point':
+        raise ValueError('geometry must be a Point')
+    longitude, latitude = geometry.get('coordinates', [None, None])[:2]
+
+    properties = csv_record(feature.get('properties') or {})
+    properties['latitude'] = latitude
+    properties['longitude'] = longitude
+    return properties
+
+# Формат: (чтение объектов из потока, преобразование объекта в поля дерева)
+FORMATS = {
+    'csv': (iter_csv, csv_record),
+    'geojson': (iter_geojson, feature_record),
+}
+
+def detect_format(name):
+    """Формат по расширению файла"""
+    extension = os.path.splitext(name or '')[1].lower()
+    if extension in ('.geojson', '.json', '.geojsonl', '.geojsons'):
+        return 'geojson'
+    return 'csv'
+
+def validate_tree(record):
+    """Проверенные значения дерева и состояния; ValueError с причиной"""
+    latitude = parse_number(record.get('latitude'))
+    longitude = parse_number(record.get('longitude'))
+    if latitude is None or longitude is None:
+        raise ValueError('latitude and longitude are required')
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError('coordinates out of range')
+
+    species = parse_text(record.get('species'))
+    if not species:
+        raise ValueError('species is required')
+
+    diameter = parse_number(record.get('diameter'))
+    height = parse_number(record.get('height'))
+    if (diameter is not None and diameter < 0) or (height is not None and height < 0):
+        raise ValueError('diameter and height must not be negative')
+
+    status = parse_text(record.get('status')).lower() or None
+    if status is not None and status not in STATUSES:
+        raise ValueError(f'status must be one of: {", ".join(STATUSES)}')
+
+    address = parse_text(record.get('address')) or None
+    notes = parse_text(record.get('notes'))
+    date_recorded = parse_text(record.get('date_recorded')) or date.today().isoformat()
+    try:
+        # Дата хранится как YYYY-MM-DD: иначе сортировка истории по строке неверна
+        date_recorded = date.fromisoformat(date_recorded).isoformat()
+    except ValueError:
+        raise ValueError('date_recorded must be YYYY-MM-DD')
+
+    return (latitude, longitude, species, address, diameter, height), (status, notes, date_recorded)
+
+def create_job(conn, source, file_format, fingerprint):
+    """Новое задание импорта"""
+    cursor = conn.execute(
+        'INSERT INTO import_jobs (source, format, fingerprint) VALUES (?, ?, ?)',
+        (source, file_format, fingerprint)
+    )
+    conn.commit()
+    return conn.execute(IMPORT_JOB_SQL, (cursor.lastrowid,)).fetchone()
+
+def find_job(conn, fingerprint, job_id=None, force=False):
+    """Задание для продолжения: указанное или последнее незавершенное для файла
+
+    Повторный импорт уже загруженного файла создал бы дубликаты деревьев,
+    поэтому он выполняется только с force=True.
+    """
+    if job_id is not None:
+        job = conn.execute(IMPORT_JOB_SQL, (job_id,)).fetchone()
+        if job is None:
+            raise ValueError(f'import job {job_id} not found')
+        if job['fingerprint'] != fingerprint:
+            raise ValueError(f'import job {job_id} was started for a different file')
+        return job
+
+    if not force:
+        done = conn.execute(DONE_JOB_SQL, (fingerprint,)).fetchone()
+        if done is not None:
+            raise ValueError(f'file was already imported by job {done["id"]}')
+    return conn.execute(UNFINISHED_JOB_SQL, (fingerprint,)).fetchone()
+
+def write_batch(conn, job_id, rows_done, trees, statuses, errors):
+    """Пачка деревьев, их состояний, ошибок и прогресса задания в одной транзакции"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # id выдаются заранее: executemany не возвращает lastrowid для каждой строки
+        first_id = conn.execute(NEXT_TREE_ID_SQL).fetchone()[0]
+        conn.executemany(INSERT_TREES_SQL, (
+            (first_id + index,) + tree for index, tree in enumerate(trees)
+        ))
+        conn.executemany(INSERT_STATUSES_SQL, (
+            (first_id + index,) + status for index, status in statuses
+        ))
+        conn.executemany(
+            'INSERT OR REPLACE INTO import_errors (job_id, row_number, error, data) VALUES (?, ?, ?, ?)',
+            ((job_id,) + error for error in errors)
+        )
+        conn.execute('''
+            UPDATE import_jobs
+            SET rows_done = ?, rows_inserted = rows_inserted + ?, rows_failed = rows_failed + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (rows_done, len(trees), len(errors), job_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def import_trees(stream, file_format, source=None, job_id=None, batch_size=BATCH_SIZE, progress=None,
+                 force=False):
+    """Импорт деревьев из двоичного потока; возвращает итог задания
+
+    Если для этого файла есть незавершенное задание (или передан job_id),
+    уже обработанные строки пропускаются. progress(job) вызывается после
+    каждой пачки.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f'unsupported format: {file_format}')
+    iter_items, to_record = FORMATS[file_format]
+
+    fingerprint = file_fingerprint(stream)
+    conn = get_db_connection()
+    try:
+        job = find_job(conn, fingerprint, job_id, force) or create_job(conn, source, file_format, fingerprint)
+        job_id = job['id']
+        skip = job['rows_done']
+        conn.execute("UPDATE import_jobs SET status = 'running', error = NULL WHERE id = ?", (job_id,))
+        conn.commit()
+
+        started = time.perf_counter()
+        rows_done = skip
+        processed = 0
+        trees, statuses, errors, points = [], [], [], []
+
+        def flush():
+            write_batch(conn, job_id, rows_done, trees, statuses, errors)
+            invalidate_points(points)
+            for batch in (trees, statuses, errors, points):
+                batch.clear()
+            if progress is not None:
+                progress(import_summary(conn, job_id, processed, time.perf_counter() - started))
+
+        try:
+            for row_number, item in enumerate(iter_items(stream), start=1):
+                if row_number <= skip:
+                    continue
+
+                try:
+                    tree, status = validate_tree(to_record(item))
+                except (ValueError, TypeError) as e:
+                    errors.append((row_number, str(e), json.dumps(item, ensure_ascii=False, default=str)))
+                else:
+                    if status[0] is not None:
+                        statuses.append((len(trees), status))
+                    trees.append(tree)
+                    points.append(tree[:2])
+
+                rows_done = row_number
+                processed += 1
+                if len(trees) + len(errors) >= batch_size:
+                    flush()
+
+            flush()
+        except Exception as e:
+            conn.execute("UPDATE import_jobs SET status = 'failed', error = ? WHERE id = ?", (str(e), job_id))
+            conn.commit()
+            raise
+
+        conn.execute("UPDATE import_jobs SET status = 'done', updated_at = CURRENT_TIMESTAMP WHERE id = ?", (job_id,))
+        conn.commit()
+        return import_summary(conn, job_id, processed, time.perf_counter() - started)
+    finally:
+        conn.close()
+
+def import_summary(conn, job_id, processed=0, elapsed=0.0):
+    """Состояние задания, скорость текущего запуска и первые ошибки"""
+    job = conn.execute(IMPORT_JOB_SQL, (job_id,)).fetchone()
+    errors = conn.execute(IMPORT_ERRORS_SQL, (job_id, ERROR_REPORT_LIMIT)).fetchall()
+    return {
+        'job_id': job_id,
+        'source': job['source'],
+        'format': job['format'],
+        'status': job['status'],
+        'error': job['error'],
+        'rows_done': job['rows_done'],
+        'rows_inserted': job['rows_inserted'],
+        'rows_failed': job['rows_failed'],
+        'rows_processed': processed,
+        'elapsed_sec': round(elapsed, 3),
+        'rows_per_sec': round(processed / elapsed) if elapsed > 0 else None,
+        'errors': [dict(error) for error in errors],
+    }
+
+def get_import_job(job_id):
+    """Состояние задания импорта"""
+    conn = get_db_connection()
+    try:
+        if conn.execute(IMPORT_JOB_SQL, (job_id,)).fetchone() is None:
+            return None
+        return import_summary(conn, job_id)
+    finally:
+        conn.close()
+
+def handle(request):
+    """Импорт: POST /api/import?format=csv|geojson[&job_id=N][&force=1] с файлом в теле,
+    GET /api/import?job_id=N - прогресс и ошибки задания"""
+    try:
+        job_id = int(request.param('job_id')) if request.param('job_id') else None
+    except ValueError:
+        return Response({'error': 'job_id must be an integer'}, status=400)
+
+    if request.method != 'POST':
+        if job_id is None:
+            return Response({'error': 'job_id parameter required'}, status=400)
+        job = get_import_job(job_id)
+        if job is None:
+            return Response({'error': 'Import job not found'}, status=404)
+        return Response(job)
+
+    if not request.body:
+        return Response({'success': False, 'error': 'No data received'}, status=400)
+
+    file_format = request.param('format') or (
+        'geojson' if 'json' in request.header('Content-Type', '') else 'csv'
+    )
+    try:
+        summary = import_trees(io.BytesIO(request.body), file_format,
+                               source=request.param('source', 'upload'), job_id=job_id,
+                               force=request.param('force') == '1')
+    except ValueError as e:
+        return Response({'success': False, 'error': str(e)}, status=400)
+
+    return Response(dict(summary, success=True))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Массовый импорт деревьев ДендроМонитор')
+    parser.add_argument('path', help='файл CSV или GeoJSON')
+    parser.add_argument('--format', choices=sorted(FORMATS), help='формат файла (по умолчанию по расширению)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='строк в одной транзакции')
+    parser.add_argument('--job', type=int, help='продолжить задание с этим номером')
+    parser.add_argument('--force', action='store_true', help='импортировать файл, который уже был загружен')
+    parser.add_argument('--errors', help='записать все ошибки строк в CSV-файл')
+    args = parser.parse_args(argv)
+
+    init_database()
+
+    def progress(summary):
+        print(f"   {summary['rows_done']} строк, добавлено {summary['rows_inserted']}, "
+              f"ошибок {summary['rows_failed']}, {summary['rows_per_sec'] or 0} строк/с", flush=True)
+
+    file_format = args.format or detect_format(args.path)
+    print(f"📥 Импорт {args.path} ({file_format})")
+    try:
+        with open(args.path, 'rb') as source:
+            summary = import_trees(source, file_format, source=os.path.abspath(args.path),
+                                   job_id=args.job, batch_size=args.batch_size, progress=progress,
+                                   force=args.force)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    print(f"✅ Задание {summary['job_id']}: добавлено {summary['rows_inserted']}, "
+          f"ошибок {summary['rows_failed']}, {summary['rows_processed']} строк за "
+          f"{summary['elapsed_sec']} с ({summary['rows_per_sec'] or 0} строк/с)")
+
+    for error in summary['errors'][:10]:
+        print(f"   строка {error['row_number']}: {error['error']}")
+
+    if args.errors:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(IMPORT_ERRORS_SQL, (summary['job_id'], -1)).fetchall()
+        finally:
+            conn.close()
+        with open(args.errors, 'w', newline='', encoding='utf-8') as report:
+            writer = csv.writer(report)
+            writer.writerow(['row_number', 'error', 'data'])
+            writer.writerows(tuple(row) for row in rows)
+        print(f"📄 Отчет об ошибках: {args.errors} ({len(rows)} строк)")
+
+if __name__ == '__main__':
+    main()
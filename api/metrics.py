@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Метрики сервера в текстовом формате Prometheus: GET /metrics
+
+Сервер считает запросы и время ответа по маршрутам (/api/trees и
+карточка дерева /api/trees?id= отдельно, статические файлы - static),
+размер тел ответов, время запросов к SQLite по именам из
+api/query_plans.py, время API-скриптов в режиме CGI и попадания в кэши.
+
+Время запроса к SQLite - время execute: подготовка и выполнение до
+первой строки. Для запросов с сортировкой, агрегатами и поиском это
+почти все время; чтение следующих строк потоковых ответов входит во
+время ответа маршрута. Запросы без имени учитываются как other.
+
+Гистограммы хранят счетчики корзин, накопительные суммы считаются
+только при выдаче /metrics, поэтому учет запроса - поиск корзины и
+одно взятие блокировки. DENDRO_METRICS=0 отключает учет.
+"""
+import bisect
+import os
+import sys
+import threading
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.analytics import analytics_cache
+from api.cache import response_cache
+from api.db import PooledConnection, get_pool
+from api.request import Response, run_cgi
+from api.tiles import tile_cache
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм времени, секунды
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Имя метрики: (тип, описание, имена меток)
+METRICS = {
+    'dendro_http_requests_total': ('counter', 'HTTP requests by route, method and status', ('route', 'method', 'status')),
+    'dendro_http_request_duration_seconds': ('histogram', 'HTTP request duration', ('route',)),
+    'dendro_http_response_bytes_total': ('counter', 'HTTP response body bytes', ('route',)),
+    'dendro_http_rejected_total': ('counter', 'Connections rejected with 503 because the queue was full', ()),
+    'dendro_db_query_duration_seconds': ('histogram', 'SQLite execute time by query name', ('query',)),
+    'dendro_subprocess_duration_seconds': ('histogram', 'CGI script execution time', ('script',)),
+    'dendro_cache_hits_total': ('counter', 'Cache hits', ('cache',)),
+    'dendro_cache_misses_total': ('counter', 'Cache misses', ('cache',)),
+    'dendro_cache_hit_ratio': ('gauge', 'Cache hits divided by lookups since start', ('cache',)),
+    'dendro_db_pool_connections': ('gauge', 'SQLite pool connections by state', ('state',)),
+    'dendro_db_pool_waits_total': ('counter', 'Pool checkouts that had to wait for a connection', ()),
+}
+
+# Метки запросов к SQLite по тексту SQL (заполняет name_queries)
+QUERY_LABELS = {}
+OTHER_LABELS = ('other',)
+
+class Histogram:
+    """Счетчики корзин (не накопительные), сумма и число наблюдений"""
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * (size + 1)
+        self.sum = 0.0
+
+class MetricsRegistry:
+    """Счетчики и гистограммы процесса с метками"""
+
+    def __init__(self, buckets=DURATION_BUCKETS, enabled=True):
+        self.buckets = buckets
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # (имя, значения меток) -> число или Histogram
+        self.counters = {}
+        self.histograms = {}
+
+    def observe_locked(self, name, labels, seconds):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram(len(self.buckets))
+        histogram.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram.sum += seconds
+
+    def observe(self, name, labels, seconds):
+        """Наблюдение гистограммы"""
+        if self.enabled:
+            with self.lock:
+                self.observe_locked(name, labels, seconds)
+
+    def inc(self, name, labels=(), value=1):
+        """Увеличение счетчика"""
+        if self.enabled:
+            with self.lock:
+                self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def record_request(self, route, method, status, seconds, size):
+        """Учет обработанного HTTP-запроса под одной блокировкой"""
+        if not self.enabled:
+            return
+        with self.lock:
+            key = ('dendro_http_requests_total', (route, method, status))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            key = ('dendro_http_response_bytes_total', (route,))
+            self.counters[key] = self.counters.get(key, 0) + size
+            self.observe_locked('dendro_http_request_duration_seconds', (route,), seconds)
+
+    def observe_query(self, sql, seconds):
+        """Время запроса к SQLite (вызывается подключениями пула на каждый execute)"""
+        key = ('dendro_db_query_duration_seconds', QUERY_LABELS.get(sql, OTHER_LABELS))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(len(self.buckets))
+            histogram.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram.sum += seconds
+
+    def snapshot(self):
+        """Копия счетчиков и гистограмм для выдачи"""
+        with self.lock:
+            histograms = {key: (list(histogram.counts), histogram.sum)
+                          for key, histogram in self.histograms.items()}
+            return dict(self.counters), histograms
+
+    def render(self, gauges=None):
+        """Текст в формате Prometheus; gauges - значения, собранные при выдаче"""
+        counters, histograms = self.snapshot()
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append((labels, value))
+        for key, value in (gauges or {}).items():
+            samples.setdefault(key[0], []).append((key[1], value))
+
+        lines = []
+        for name, (kind, description, label_names) in METRICS.items():
+            series = sorted((labels, value) for (metric, labels), value in histograms.items() if metric == name) \
+                if kind == 'histogram' else sorted(samples.get(name, []))
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in series:
+                label_pairs = list(zip(label_names, labels))
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(label_pairs)} {format_value(value)}')
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{format_labels(label_pairs + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(label_pairs)} {format_value(total)}')
+                lines.append(f'{name}_count{format_labels(label_pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def format_value(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+registry = MetricsRegistry(enabled=os.environ.get('DENDRO_METRICS', '1') != '0')
+
+def name_queries(queries):
+    """Имена запросов из {имя: (sql, параметры, ...)} (api/query_plans.py)
+
+    Один и тот же текст SQL под несколькими именами получает первое.
+    """
+    for name, (sql, *_) in queries.items():
+        QUERY_LABELS.setdefault(sql, (name,))
+
+def enable_query_timing():
+    """Учет времени запросов во всех подключениях пула"""
+    if registry.enabled:
+        PooledConnection.query_timer = staticmethod(registry.observe_query)
+
+def cache_gauges():
+    """Попадания в кэши и состояние пула подключений на момент выдачи"""
+    gauges = {}
+    caches = {
+        'response': response_cache.stats(),
+        'analytics': analytics_cache.stats(),
+    }
+    tiles = tile_cache.stats()
+    caches['tiles'] = {'hits': tiles['hits'] + tiles['disk_hits'], 'misses': tiles['misses']}
+
+    for cache, stats in caches.items():
+        gauges[('dendro_cache_hits_total', (cache,))] = stats['hits']
+        gauges[('dendro_cache_misses_total', (cache,))] = stats['misses']
+        lookups = stats['hits'] + stats['misses']
+        if lookups:
+            gauges[('dendro_cache_hit_ratio', (cache,))] = stats['hits'] / lookups
+
+    pool = get_pool().stats()
+    gauges[('dendro_db_pool_connections', ('in_use',))] = pool['in_use']
+    gauges[('dendro_db_pool_connections', ('idle',))] = pool['idle']
+    gauges[('dendro_db_pool_waits_total', ())] = pool['waits']
+    return gauges
+
+def handle(request):
+    """Выдача метрик: GET /metrics"""
+    return Response(raw=registry.render(cache_gauges()).encode('utf-8'), content_type=PROMETHEUS_CONTENT_TYPE)
+
+if __name__ == '__main__':
+    run_cgi(handle)
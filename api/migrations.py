@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Версионные миграции схемы базы данных
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция
+выполняется один раз в своей транзакции, после чего версия увеличивается.
+Запуск из корня проекта:
+    python -m api.migrations            # применить миграции
+    python -m api.migrations --check    # проверить планы запросов API
+"""
+import argparse
+import os
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.db import get_db_connection
+from api.projections import (
+    create_current_status, rebuild_current_status,
+    create_tree_rtree, rebuild_tree_rtree,
+    create_tree_clusters, rebuild_tree_clusters,
+    create_data_version,
+    create_search_index, rebuild_search_index, delete_orphan_search_documents,
+    create_tree_stats, rebuild_tree_stats,
+    create_status_version,
+    create_change_log,
+    create_comment_version,
+)
+
+def migration_0001_base_schema(conn):
+    """Базовые таблицы (в старых базах уже существуют)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS trees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            species TEXT NOT NULL,
+            address TEXT,
+            diameter REAL,
+            height REAL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tree_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tree_id INTEGER,
+            status TEXT NOT NULL,
+            notes TEXT,
+            date_recorded DATE DEFAULT CURRENT_DATE,
+            is_future_plan BOOLEAN DEFAULT 0,
+            FOREIGN KEY (tree_id) REFERENCES trees (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tree_id INTEGER,
+            user_name TEXT,
+            text TEXT NOT NULL,
+            contact_email TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_reviewed BOOLEAN DEFAULT 0,
+            FOREIGN KEY (tree_id) REFERENCES trees (id)
+        )
+    ''')
+
+def migration_0002_hot_query_indexes(conn):
+    """Индексы для истории состояний и комментариев"""
+    # История дерева и выбор последнего состояния
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tree_status_tree_date
+        ON tree_status (tree_id, date_recorded, id)
+    ''')
+
+    # Проверенные комментарии дерева по дате
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_comments_tree_reviewed_created
+        ON comments (tree_id, is_reviewed, created_at)
+    ''')
+
+    # Очередь непроверенных комментариев: малая часть таблицы
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_comments_unreviewed
+        ON comments (created_at, id)
+        WHERE is_reviewed = 0
+    ''')
+
+def migration_0003_current_status(conn):
+    """Текущее состояние деревьев, поддерживаемое триггерами"""
+    create_current_status(conn)
+    rebuild_current_status(conn)
+
+def migration_0004_tree_rtree(conn):
+    """Пространственный индекс R*Tree для запросов по области карты"""
+    create_tree_rtree(conn)
+    rebuild_tree_rtree(conn)
+
+def migration_0005_tree_clusters(conn):
+    """Агрегаты кластеров по сетке для каждого уровня масштаба"""
+    create_tree_clusters(conn)
+    rebuild_tree_clusters(conn)
+
+def migration_0006_data_version(conn):
+    """Счетчик версии данных для ETag и кэша ответов"""
+    create_data_version(conn)
+
+def migration_0007_import_jobs(conn):
+    """Журнал массового импорта: прогресс для продолжения и ошибки по строкам"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT,
+            format TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            rows_inserted INTEGER NOT NULL DEFAULT 0,
+            rows_failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_import_jobs_fingerprint
+        ON import_jobs (fingerprint, id)
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_errors (
+            job_id INTEGER NOT NULL,
+            row_number INTEGER NOT NULL,
+            error TEXT NOT NULL,
+            data TEXT,
+            PRIMARY KEY (job_id, row_number),
+            FOREIGN KEY (job_id) REFERENCES import_jobs (id)
+        )
+    ''')
+
+def migration_0008_search_index(conn):
+    """Полнотекстовый поиск по адресам, заметкам и комментариям"""
+    create_search_index(conn)
+    rebuild_search_index(conn)
+
+def migration_0009_tree_stats(conn):
+    """Счетчики деревьев по породе и состоянию для /api/stats"""
+    create_tree_stats(conn)
+    rebuild_tree_stats(conn)
+
+def migration_0010_status_version(conn):
+    """Счетчик версии истории осмотров для кэша аналитики"""
+    create_status_version(conn)
+
+def migration_0011_change_log(conn):
+    """Журнал изменений для /api/changes и потока событий"""
+    create_change_log(conn)
+
+def migration_0012_comment_version(conn):
+    """Версии комментариев по деревьям: модерация сбрасывает кэш только затронутых деревьев"""
+    create_comment_version(conn)
+
+def migration_0013_search_tree_documents(conn):
+    """Заметки и комментарии удаленных деревьев не остаются в поисковом индексе
+
+    Триггеры вставки пересоздаются с проверкой, что дерево существует.
+    """
+    for table in ('tree_status', 'comments'):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_insert_search')
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_update_search')
+    create_search_index(conn)
+    delete_orphan_search_documents(conn)
+
+# Порядок важен: версия схемы равна числу примененных миграций
+MIGRATIONS = [
+    migration_0001_base_schema,
+    migration_0002_hot_query_indexes,
+    migration_0003_current_status,
+    migration_0004_tree_rtree,
+    migration_0005_tree_clusters,
+    migration_0006_data_version,
+    migration_0007_import_jobs,
+    migration_0008_search_index,
+    migration_0009_tree_stats,
+    migration_0010_status_version,
+    migration_0011_change_log,
+    migration_0012_comment_version,
+    migration_0013_search_tree_documents,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    """Текущая версия схемы базы"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Применение недостающих миграций, возвращает список примененных"""
+    applied = []
+
+    while get_schema_version(conn) < SCHEMA_VERSION:
+        # IMMEDIATE: параллельно запущенный процесс дождется и увидит новую версию
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                break
+
+            migration = MIGRATIONS[version]
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+            applied.append(migration.__name__)
+        except Exception:
+            conn.rollback()
+            raise
+
+    return applied
+
+def seed_database(conn):
+    """Добавление тестовых данных, если таблицы пустые"""
+    cursor = conn.execute('SELECT COUNT(*) FROM trees')
+    if cursor.fetchone()[0] > 0:
+        return False
+
+    # Тестовые деревья
+    test_trees = [
+        (55.7558, 37.6176, 'Дуб', 'Красная площадь, 1', 85.5, 25.0),
+        (55.7520, 37.6175, 'Береза', 'ул. Тверская, 10', 45.2, 18.5),
+        (55.7500, 37.6200, 'Сосна', 'Парк Горького, центральная аллея', 92.1, 30.2),
+        (55.7490, 37.6150, 'Клен', 'ул. Большая Дмитровка, 15', 32.8, 12.3),
+        (55.7475, 37.6225, 'Липа', 'Чистопрудный бульвар', 68.7, 22.1)
+    ]
+
+    tree_ids = []
+    for tree in test_trees:
+        cursor = conn.execute(
+            'INSERT INTO trees (latitude, longitude, species, address, diameter, height) VALUES (?, ?, ?, ?, ?, ?)',
+            tree
+        )
+        tree_ids.append(cursor.lastrowid)
+
+    # Тестовые статусы
+    test_statuses = [
+        ('excellent', 'Дерево в отличном состоянии'),
+        ('good', 'Небольшие повреждения коры'),
+        ('satisfactory', 'Требуется санитарная обрезка'),
+        ('poor', 'Признаки заболевания'),
+        ('critical', 'Сильное повреждение ствола')
+    ]
+
+    for tree_id, (status, notes) in zip(tree_ids, test_statuses):
+        conn.execute(
+            'INSERT INTO tree_status (tree_id, status, notes) VALUES (?, ?, ?)',
+            (tree_id, status, notes)
+        )
+
+    # Тестовые комментарии
+    test_comments = [
+        ('Иван Петров', 'Заметил, что у дерева появились сухие ветки на верхушке', 'ivan@example.com'),
+        ('Мария Сидорова', 'Дерево выглядит здоровым, но есть повреждения коры внизу', 'maria@example.com'),
+        ('Аноним', 'Около дерева появились грибы, возможно, это признак болезни', '')
+    ]
+
+    for tree_id, comment in zip(tree_ids, test_comments):
+        conn.execute(
+            'INSERT INTO comments (tree_id, user_name, text, contact_email, is_reviewed) VALUES (?, ?, ?, ?, 1)',
+            (tree_id,) + comment
+        )
+
+    conn.commit()
+    return True
+
+def init_database(conn=None):
+    """Приведение схемы к текущей версии и заполнение пустой базы"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+
+    try:
+        migrate(conn)
+        seed_database(conn)
+    finally:
+        if own_connection:
+            conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Миграции базы данных ДендроМонитор')
+    parser.add_argument('--check', action='store_true',
+                        help='проверить через EXPLAIN QUERY PLAN, что запросы API используют индексы')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        from api.query_plans import check_query_plans
+        failures = check_query_plans()
+        sys.exit(1 if failures else 0)
+
+    conn = get_db_connection()
+    try:
+        before = get_schema_version(conn)
+        applied = migrate(conn)
+        seeded = seed_database(conn)
+    finally:
+        conn.close()
+
+    print(f"✅ Версия схемы: {before} → {before + len(applied)}")
+    for name in applied:
+        print(f"   применена {name}")
+    if seeded:
+        print("✅ Добавлены тестовые данные")
+
+if __name__ == '__main__':
+    main()
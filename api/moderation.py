@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Модерация комментариев: /api/moderation/pending, /approve, /reject
+
+Очередь - непроверенные комментарии от старых к новым, страницы по
+ключу (created_at, id) из частичного индекса idx_comments_unreviewed
+(в нем только комментарии с is_reviewed = 0). Одобрение и отклонение
+принимают список id и выполняются одной транзакцией. Одобренный
+комментарий появляется в комментариях дерева, поиске и журнале
+изменений; кэш ответов сбрасывается только для комментариев затронутых
+деревьев (версии comment_version, см. api/projections.py). Отклоненный
+комментарий удаляется.
+"""
+import json
+import os
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.db import get_db_connection
+from api.pagination import DEFAULT_PAGE_SIZE, decode_cursor, page, parse_page_size
+from api.request import Response, run_cgi
+
+# Первая страница очереди: самые старые непроверенные комментарии
+PENDING_FIRST_PAGE_SQL = '''
+    SELECT c.*, t.species, t.address
+    FROM comments c
+    LEFT JOIN trees t ON t.id = c.tree_id
+    WHERE c.is_reviewed = 0
+    ORDER BY c.created_at, c.id
+    LIMIT ?
+'''
+
+# Следующая страница: комментарии после последнего показанного (created_at, id)
+PENDING_PAGE_SQL = '''
+    SELECT c.*, t.species, t.address
+    FROM comments c
+    LEFT JOIN trees t ON t.id = c.tree_id
+    WHERE c.is_reviewed = 0
+      AND (c.created_at, c.id) > (?, ?)
+    ORDER BY c.created_at, c.id
+    LIMIT ?
+'''
+
+# Длина очереди: читается только частичный индекс (без подсказки планировщик
+# выбирает индекс по всем комментариям)
+PENDING_COUNT_SQL = '''
+    SELECT COUNT(*) FROM comments INDEXED BY idx_comments_unreviewed
+    WHERE is_reviewed = 0
+'''
+
+# Только непроверенные: повторное одобрение или отклонение проверенного не действует
+APPROVE_SQL = '''
+    UPDATE comments SET is_reviewed = 1
+    WHERE id IN (SELECT value FROM json_each(?)) AND is_reviewed = 0
+    RETURNING id, tree_id
+'''
+
+REJECT_SQL = '''
+    DELETE FROM comments
+    WHERE id IN (SELECT value FROM json_each(?)) AND is_reviewed = 0
+    RETURNING id, tree_id
+'''
+
+# Действие: (запрос, поле ответа с обработанными id)
+MODERATION_ACTIONS = {'approve': (APPROVE_SQL, 'approved'), 'reject': (REJECT_SQL, 'rejected')}
+
+# Больше id за один запрос не принимаем
+MAX_BATCH_SIZE = 1000
+
+def get_pending(cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Страница очереди модерации, курсор следующей и длина очереди"""
+    conn = get_db_connection()
+    try:
+        if cursor:
+            created_at, comment_id = decode_cursor(cursor, 2)
+            rows = conn.execute(PENDING_PAGE_SQL, (created_at, comment_id, page_size + 1)).fetchall()
+        else:
+            rows = conn.execute(PENDING_FIRST_PAGE_SQL, (page_size + 1,)).fetchall()
+        total = conn.execute(PENDING_COUNT_SQL).fetchone()[0]
+    finally:
+        conn.close()
+
+    comments, next_cursor = page(rows, page_size, lambda comment: [comment['created_at'], comment['id']])
+    return {'comments': comments, 'next': next_cursor, 'total': total}
+
+def parse_ids(data):
+    """Список id комментариев из {"ids": [...]}"""
+    ids = (data or {}).get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids:
+        raise ValueError('ids must be a non-empty list of comment ids')
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} ids per request')
+    if not all(isinstance(comment_id, int) and not isinstance(comment_id, bool) for comment_id in ids):
+        raise ValueError('ids must be integers')
+    return sorted(set(ids))
+
+def moderate(action, ids):
+    """Одобрение или отклонение комментариев одной транзакцией
+
+    Возвращает обработанные id, id, которых нет в очереди (уже проверены
+    или не существуют), и деревья, чьи комментарии изменились.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(MODERATION_ACTIONS[action][0], (json.dumps(ids),)).fetchall()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+    done = sorted(row['id'] for row in rows)
+    return {
+        'success': True,
+        MODERATION_ACTIONS[action][1]: done,
+        'not_pending': sorted(set(ids) - set(done)),
+        'tree_ids': sorted({row['tree_id'] for row in rows if row['tree_id'] is not None}),
+    }
+
+def handle(request):
+    """Обработка запросов модерации
+
+    GET /api/moderation/pending?page_size=&cursor= - очередь непроверенных комментариев
+    POST /api/moderation/approve, /api/moderation/reject с {"ids": [1, 2, ...]}
+    """
+    action = request.path.rstrip('/').rsplit('/', 1)[-1]
+
+    if action == 'pending':
+        try:
+            return Response(get_pending(request.param('cursor'), parse_page_size(request)))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+    if action not in MODERATION_ACTIONS:
+        return Response({'error': 'Unknown moderation endpoint'}, status=404)
+    if request.method != 'POST':
+        return Response({'error': 'POST required'}, status=405)
+
+    try:
+        ids = parse_ids(request.json())
+    except ValueError as e:
+        return Response({'success': False, 'error': str(e)}, status=400)
+    return Response(moderate(action, ids))
+
+if __name__ == '__main__':
+    run_cgi(handle)
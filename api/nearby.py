@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Ближайшие деревья: /api/trees/nearby?lat=55.75&lon=37.61&radius=50
+
+Запросы обслуживает снимок деревьев в памяти (см. api/snapshot.py):
+координаты, порода и текущее состояние в массивах по id дерева, id
+деревьев по ячейкам сетки. Снимок загружается при запуске сервера и перед
+запросом догоняет базу (пока он перестраивается после изменения или
+удаления деревьев, ответ дают прежние столбцы).
+
+    radius=50           все деревья в радиусе 50 м
+    k=10                10 ближайших (в радиусе radius, по умолчанию MAX_RADIUS)
+    status=poor,critical  только деревья в этих состояниях
+Расстояния - по формуле гаверсинусов, в метрах.
+"""
+import heapq
+import math
+import os
+import sys
+import time
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.request import Response, run_cgi
+from api.snapshot import CELL_DEGREES, STATUS_CODES, UNKNOWN_STATUS, cell_of, tree_snapshot
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+MAX_RADIUS = 5000
+MAX_K = 1000
+# Без k возвращается не больше MAX_RESULTS ближайших деревьев в радиусе
+MAX_RESULTS = 1000
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Расстояние между точками в метрах"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+def within(snapshot, latitude, longitude, radius, statuses, limit):
+    """Деревья в радиусе по возрастанию расстояния: список (метры, id)"""
+    lat_span = radius / METERS_PER_DEGREE
+    lon_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(latitude) + lat_span, 89.9))),
+                                                 1e-6))
+    min_x, min_y = cell_of(latitude - lat_span, longitude - lon_span)
+    max_x, max_y = cell_of(latitude + lat_span, longitude + lon_span)
+
+    found = []
+    for cell_y in range(min_y, max_y + 1):
+        for tree_id in snapshot.row_trees(cell_y, min_x, max_x):
+            if statuses is not None and snapshot.status[tree_id] not in statuses:
+                continue
+            distance = haversine(latitude, longitude, snapshot.latitude[tree_id], snapshot.longitude[tree_id])
+            if distance <= radius:
+                found.append((distance, tree_id))
+    return heapq.nsmallest(limit, found)
+
+def nearest(snapshot, latitude, longitude, k, radius, statuses):
+    """k ближайших деревьев не дальше radius: список (метры, id)
+
+    Ячейки просматриваются кольцами вокруг ячейки точки. Дерево в кольце r
+    не ближе r - 1 ячеек, поэтому поиск останавливается, когда эта граница
+    больше расстояния до k-го найденного дерева.
+    """
+    center_x, center_y = cell_of(latitude, longitude)
+    best = []  # куча (-метры, id) размера не больше k
+    ring = 0
+    while True:
+        # Ширина ячейки в метрах меньше всего на самой дальней от экватора широте кольца
+        far_latitude = min(abs(latitude) + (ring + 1) * CELL_DEGREES, 89.9)
+        cell_meters = CELL_DEGREES * METERS_PER_DEGREE * math.cos(math.radians(far_latitude))
+        bound = max(ring - 1, 0) * cell_meters
+        if bound > radius or (len(best) == k and bound > -best[0][0]):
+            break
+
+        if ring == 0:
+            cells = [(center_x, center_y)]
+        else:
+            cells = [(center_x + dx, center_y + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+            cells += [(center_x + dx, center_y + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+
+        for cell_x, cell_y in cells:
+            for tree_id in snapshot.cell_trees(cell_x, cell_y, statuses):
+                distance = haversine(latitude, longitude, snapshot.latitude[tree_id], snapshot.longitude[tree_id])
+                if distance > radius:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, tree_id))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, tree_id))
+        ring += 1
+
+    return sorted((-distance, tree_id) for distance, tree_id in best)
+
+def nearby_trees(latitude, longitude, radius=None, k=None, statuses=None):
+    """Ближайшие деревья как словари ответа"""
+    # Пока снимок перестраивается, ответ дают прежние столбцы; ждем только первую загрузку
+    tree_snapshot.refresh(wait=not tree_snapshot.ready)
+
+    started = time.perf_counter()
+    with tree_snapshot.lock:
+        snapshot = tree_snapshot.data
+        if k is None:
+            found = within(snapshot, latitude, longitude, radius, statuses, MAX_RESULTS)
+        else:
+            found = nearest(snapshot, latitude, longitude, k, MAX_RADIUS if radius is None else radius, statuses)
+
+        trees = [dict(snapshot.row(tree_id), distance_m=round(distance, 1)) for distance, tree_id in found]
+        tree_snapshot.record_read('nearby', time.perf_counter() - started)
+    return trees
+
+def parse_float(request, name, minimum, maximum, required=True):
+    """Число из параметра запроса в допустимых пределах"""
+    value = request.param(name)
+    if value is None:
+        if required:
+            raise ValueError(f'{name} parameter required')
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+    if not minimum <= value <= maximum:
+        raise ValueError(f'{name} must be between {minimum} and {maximum}')
+    return value
+
+def parse_statuses(value):
+    """Коды состояний из status=poor,critical (unknown - деревья без осмотров)"""
+    if not value:
+        return None
+    codes = set()
+    for status in value.split(','):
+        status = status.strip()
+        if status == 'unknown':
+            codes.add(UNKNOWN_STATUS)
+        elif status in STATUS_CODES:
+            codes.add(STATUS_CODES[status])
+        else:
+            raise ValueError(f'unknown status: {status}')
+    return codes
+
+def handle(request):
+    """Обработка запроса: /api/trees/nearby?lat=&lon=&radius=&k=&status="""
+    try:
+        latitude = parse_float(request, 'lat', -90, 90)
+        longitude = parse_float(request, 'lon', -180, 180)
+        radius = parse_float(request, 'radius', 0, MAX_RADIUS, required=False)
+        k = request.param('k')
+        if k is not None:
+            if not k.isdigit() or not 1 <= int(k) <= MAX_K:
+                raise ValueError(f'k must be between 1 and {MAX_K}')
+            k = int(k)
+        if radius is None and k is None:
+            raise ValueError('radius or k parameter required')
+        statuses = parse_statuses(request.param('status'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    trees = nearby_trees(latitude, longitude, radius, k, statuses)
+    return Response({'count': len(trees), 'trees': trees})
+
+if __name__ == '__main__':
+    run_cgi(handle)
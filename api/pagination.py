@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Постраничная выдача по ключу (keyset pagination)
+
+Следующая страница начинается после последней строки предыдущей:
+условие по ключу сортировки вместо OFFSET, поэтому стоимость запроса
+страницы не зависит от ее номера. Курсор - значения ключа последней
+строки, закодированные в непрозрачную для клиента строку.
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def is_paginated(request):
+    """Клиент запросил постраничную выдачу"""
+    return request.param('page_size') is not None or request.param('cursor') is not None
+
+def parse_page_size(request):
+    """Размер страницы из параметра page_size в пределах MAX_PAGE_SIZE"""
+    value = request.param('page_size')
+    if not value:
+        return DEFAULT_PAGE_SIZE
+
+    page_size = int(value)
+    if page_size < 1:
+        raise ValueError('page_size must be positive')
+    return min(page_size, MAX_PAGE_SIZE)
+
+def encode_cursor(values):
+    """Курсор из значений ключа последней строки страницы"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, size):
+    """Значения ключа из курсора; ValueError для поврежденного курсора"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('invalid cursor')
+    return values
+
+def page(rows, page_size, key):
+    """Строки страницы и курсор следующей (None на последней странице)
+
+    Запрос выбирает page_size + 1 строк: лишняя строка означает, что
+    следующая страница существует.
+    """
+    items = [dict(row) for row in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size:
+        next_cursor = encode_cursor(key(items[-1]))
+    return items, next_cursor
@@ -0,0 +1,739 @@
+#!/usr/bin/env python3
+"""Производные данные, которые поддерживаются триггерами при записи
+
+tree_current_status - последнее состояние каждого дерева, чтобы список
+деревьев не выбирал его подзапросом по истории для каждой строки.
+trees_rtree - пространственный индекс R*Tree по координатам деревьев для
+запросов по области карты (bbox).
+tree_clusters - число деревьев, сумма координат и разбивка по состояниям
+в ячейках сетки для каждого уровня масштаба карты (кластеры маркеров).
+data_version - счетчик изменений деревьев и осмотров для ETag и кэша ответов.
+comment_version - версии проверенных комментариев каждого дерева и всех
+вместе: модерация сбрасывает кэш комментариев только затронутых деревьев.
+status_version - счетчик изменений истории осмотров для кэша аналитики.
+tree_stats - число деревьев по породе и текущему состоянию для /api/stats.
+search_index - полнотекстовый индекс FTS5 по породе и адресу деревьев,
+заметкам осмотров и проверенным комментариям.
+change_log - журнал изменений деревьев, осмотров и проверенных комментариев
+для /api/changes (последние CHANGE_LOG_KEEP записей).
+Пересборка для уже заполненной базы:
+    python -m api.projections --rebuild
+"""
+import argparse
+import os
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import STATUSES
+from api.db import get_db_connection
+
+# Последняя запись истории дерева: тот же порядок, что и в исходном подзапросе
+LATEST_STATUS_SQL = '''
+    SELECT tree_id, id, status, notes, date_recorded
+    FROM tree_status
+    WHERE tree_id = {tree_id}
+    ORDER BY date_recorded DESC, id DESC
+    LIMIT 1
+'''
+
+CURRENT_STATUS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS tree_current_status (
+        tree_id INTEGER PRIMARY KEY,
+        status_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        notes TEXT,
+        date_recorded DATE
+    )
+    ''',
+    # Новая запись становится текущей, если она не старше текущей
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_tree_status_insert_current
+    AFTER INSERT ON tree_status
+    BEGIN
+        INSERT INTO tree_current_status (tree_id, status_id, status, notes, date_recorded)
+        VALUES (NEW.tree_id, NEW.id, NEW.status, NEW.notes, NEW.date_recorded)
+        ON CONFLICT (tree_id) DO UPDATE SET
+            status_id = excluded.status_id,
+            status = excluded.status,
+            notes = excluded.notes,
+            date_recorded = excluded.date_recorded
+        WHERE (excluded.date_recorded, excluded.status_id)
+              >= (tree_current_status.date_recorded, tree_current_status.status_id);
+    END
+    ''',
+    # Исправление и удаление записей истории: текущее состояние выбирается заново
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tree_status_update_current
+    AFTER UPDATE ON tree_status
+    BEGIN
+        DELETE FROM tree_current_status WHERE tree_id IN (OLD.tree_id, NEW.tree_id);
+        INSERT INTO tree_current_status (tree_id, status_id, status, notes, date_recorded)
+        {LATEST_STATUS_SQL.format(tree_id='OLD.tree_id')};
+        INSERT OR IGNORE INTO tree_current_status (tree_id, status_id, status, notes, date_recorded)
+        {LATEST_STATUS_SQL.format(tree_id='NEW.tree_id')};
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tree_status_delete_current
+    AFTER DELETE ON tree_status
+    BEGIN
+        DELETE FROM tree_current_status WHERE tree_id = OLD.tree_id;
+        INSERT INTO tree_current_status (tree_id, status_id, status, notes, date_recorded)
+        {LATEST_STATUS_SQL.format(tree_id='OLD.tree_id')};
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_trees_delete_current
+    AFTER DELETE ON trees
+    BEGIN
+        DELETE FROM tree_current_status WHERE tree_id = OLD.id;
+    END
+    ''',
+]
+
+def create_current_status(conn):
+    """Таблица текущего состояния и триггеры, которые ее поддерживают"""
+    for statement in CURRENT_STATUS_SCHEMA:
+        conn.execute(statement)
+
+def rebuild_current_status(conn):
+    """Полная пересборка текущего состояния по истории, возвращает число деревьев"""
+    conn.execute('DELETE FROM tree_current_status')
+    conn.execute('''
+        INSERT INTO tree_current_status (tree_id, status_id, status, notes, date_recorded)
+        SELECT ts.tree_id, ts.id, ts.status, ts.notes, ts.date_recorded
+        FROM trees t
+        JOIN tree_status ts ON ts.tree_id = t.id
+        WHERE ts.id = (
+            SELECT id FROM tree_status
+            WHERE tree_id = ts.tree_id
+            ORDER BY date_recorded DESC, id DESC
+            LIMIT 1
+        )
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM tree_current_status').fetchone()[0]
+
+TREE_RTREE_SCHEMA = [
+    # Точка хранится как вырожденный прямоугольник
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS trees_rtree USING rtree(
+        id,
+        min_lon, max_lon,
+        min_lat, max_lat
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_trees_insert_rtree
+    AFTER INSERT ON trees
+    BEGIN
+        INSERT INTO trees_rtree (id, min_lon, max_lon, min_lat, max_lat)
+        VALUES (NEW.id, NEW.longitude, NEW.longitude, NEW.latitude, NEW.latitude);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_trees_update_rtree
+    AFTER UPDATE OF id, latitude, longitude ON trees
+    BEGIN
+        DELETE FROM trees_rtree WHERE id = OLD.id;
+        INSERT INTO trees_rtree (id, min_lon, max_lon, min_lat, max_lat)
+        VALUES (NEW.id, NEW.longitude, NEW.longitude, NEW.latitude, NEW.latitude);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_trees_delete_rtree
+    AFTER DELETE ON trees
+    BEGIN
+        DELETE FROM trees_rtree WHERE id = OLD.id;
+    END
+    ''',
+]
+
+def create_tree_rtree(conn):
+    """R*Tree по координатам деревьев и триггеры синхронизации"""
+    for statement in TREE_RTREE_SCHEMA:
+        conn.execute(statement)
+
+def rebuild_tree_rtree(conn):
+    """Полная пересборка R*Tree по таблице trees, возвращает число деревьев"""
+    conn.execute('DELETE FROM trees_rtree')
+    conn.execute('''
+        INSERT INTO trees_rtree (id, min_lon, max_lon, min_lat, max_lat)
+        SELECT id, longitude, longitude, latitude, latitude FROM trees
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM trees_rtree').fetchone()[0]
+
+# Кластеры считаются для масштабов 0..CLUSTER_MAX_ZOOM, дальше карта показывает деревья.
+# Ячейка - квадрат в градусах, CLUSTER_CELLS_PER_TILE ячеек на сторону тайла карты.
+CLUSTER_MAX_ZOOM = 15
+CLUSTER_CELLS_PER_TILE = 4
+
+def cluster_scale(zoom):
+    """Число ячеек на градус для уровня масштаба"""
+    return float(2 ** zoom * CLUSTER_CELLS_PER_TILE) / 360
+
+def cluster_cell(zoom, latitude, longitude):
+    """Ячейка сетки точки (так же, как CAST в SQL: сдвиг делает значения неотрицательными)"""
+    scale = cluster_scale(zoom)
+    return int((longitude + 180) * scale), int((latitude + 90) * scale)
+
+CLUSTER_STATUS_COLUMNS = STATUSES + ('unknown',)
+
+def cluster_delta_sql(source, latitude, longitude, count, status_terms):
+    """Upsert, прибавляющий изменение дерева ко всем уровням масштаба
+
+    source - пара (FROM, WHERE) с таблицей cluster_zooms z; status_terms - пары (SQL-выражение состояния, +1 или -1); состояние
+    не из списка STATUSES (в том числе NULL) считается как unknown.
+    """
+    known = ', '.join(f"'{status}'" for status in STATUSES)
+    status_values = []
+    for column in CLUSTER_STATUS_COLUMNS:
+        parts = []
+        for expression, sign in status_terms:
+            if column == 'unknown':
+                condition = f'{expression} IN ({known})'
+                parts.append(f'(CASE WHEN {condition} THEN 0 ELSE {sign} END)')
+            else:
+                parts.append(f"(CASE WHEN {expression} = '{column}' THEN {sign} ELSE 0 END)")
+        status_values.append(' + '.join(parts) or '0')
+
+    columns = ('tree_count', 'lat_sum', 'lon_sum') + CLUSTER_STATUS_COLUMNS
+    return f'''
+        INSERT INTO tree_clusters (zoom, cell_x, cell_y, {', '.join(columns)})
+        SELECT z.zoom,
+               CAST(({longitude} + 180) * z.scale AS INTEGER),
+               CAST(({latitude} + 90) * z.scale AS INTEGER),
+               {count}, {count} * {latitude}, {count} * {longitude},
+               {', '.join(status_values)}
+        FROM {source[0]}
+        WHERE {source[1]}
+        ON CONFLICT (zoom, cell_x, cell_y) DO UPDATE SET
+            {', '.join(f'{column} = {column} + excluded.{column}' for column in columns)}
+    '''
+
+def create_tree_clusters(conn):
+    """Таблицы кластеров и триггеры, которые обновляют их при записи"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cluster_zooms (
+            zoom INTEGER PRIMARY KEY,
+            scale REAL NOT NULL
+        )
+    ''')
+    conn.execute('DELETE FROM cluster_zooms')
+    conn.executemany(
+        'INSERT INTO cluster_zooms (zoom, scale) VALUES (?, ?)',
+        [(zoom, cluster_scale(zoom)) for zoom in range(CLUSTER_MAX_ZOOM + 1)]
+    )
+
+    status_columns = ',\n'.join(
+        f'            {column} INTEGER NOT NULL DEFAULT 0' for column in CLUSTER_STATUS_COLUMNS
+    )
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS tree_clusters (
+            zoom INTEGER NOT NULL,
+            cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL,
+            tree_count INTEGER NOT NULL DEFAULT 0,
+            lat_sum REAL NOT NULL DEFAULT 0,
+            lon_sum REAL NOT NULL DEFAULT 0,
+{status_columns},
+            PRIMARY KEY (zoom, cell_x, cell_y)
+        ) WITHOUT ROWID
+    ''')
+
+    current = '(SELECT status FROM tree_current_status WHERE tree_id = {tree_id})'
+    zooms = ('cluster_zooms z', 'true')
+
+    def zooms_with_tree(tree_id):
+        return ('cluster_zooms z, trees t', f't.id = {tree_id}')
+
+    triggers = {
+        # Новое дерево еще без состояния
+        'trg_trees_insert_clusters': (
+            'AFTER INSERT ON trees',
+            cluster_delta_sql(zooms, 'NEW.latitude', 'NEW.longitude', 1, [('NULL', 1)]),
+        ),
+        # BEFORE: текущее состояние удаляемого дерева еще доступно
+        'trg_trees_delete_clusters': (
+            'BEFORE DELETE ON trees',
+            cluster_delta_sql(zooms, 'OLD.latitude', 'OLD.longitude', -1,
+                              [(current.format(tree_id='OLD.id'), -1)]),
+        ),
+        'trg_trees_move_clusters': (
+            'AFTER UPDATE OF latitude, longitude ON trees',
+            cluster_delta_sql(zooms, 'OLD.latitude', 'OLD.longitude', -1,
+                              [(current.format(tree_id='NEW.id'), -1)]) + ';\n' +
+            cluster_delta_sql(zooms, 'NEW.latitude', 'NEW.longitude', 1,
+                              [(current.format(tree_id='NEW.id'), 1)]),
+        ),
+        # Смена текущего состояния переносит дерево между колонками состояний
+        'trg_current_status_insert_clusters': (
+            'AFTER INSERT ON tree_current_status',
+            cluster_delta_sql(zooms_with_tree('NEW.tree_id'),
+                              't.latitude', 't.longitude', 0, [('NULL', -1), ('NEW.status', 1)]),
+        ),
+        'trg_current_status_update_clusters': (
+            'AFTER UPDATE OF status ON tree_current_status WHEN OLD.status IS NOT NEW.status',
+            cluster_delta_sql(zooms_with_tree('NEW.tree_id'),
+                              't.latitude', 't.longitude', 0, [('OLD.status', -1), ('NEW.status', 1)]),
+        ),
+        'trg_current_status_delete_clusters': (
+            'AFTER DELETE ON tree_current_status',
+            cluster_delta_sql(zooms_with_tree('OLD.tree_id'),
+                              't.latitude', 't.longitude', 0, [('OLD.status', -1), ('NULL', 1)]),
+        ),
+    }
+
+    for name, (event, body) in triggers.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            BEGIN
+                {body};
+            END
+        ''')
+
+def rebuild_tree_clusters(conn):
+    """Полная пересборка кластеров по деревьям и их текущему состоянию"""
+    known = ', '.join(f"'{status}'" for status in STATUSES)
+    status_sums = ', '.join(
+        f"SUM(CASE WHEN cs.status = '{status}' THEN 1 ELSE 0 END)" for status in STATUSES
+    )
+
+    conn.execute('DELETE FROM tree_clusters')
+    conn.execute(f'''
+        INSERT INTO tree_clusters (zoom, cell_x, cell_y, tree_count, lat_sum, lon_sum,
+                                   {', '.join(CLUSTER_STATUS_COLUMNS)})
+        SELECT z.zoom,
+               CAST((t.longitude + 180) * z.scale AS INTEGER) AS cell_x,
+               CAST((t.latitude + 90) * z.scale AS INTEGER) AS cell_y,
+               COUNT(*), SUM(t.latitude), SUM(t.longitude),
+               {status_sums},
+               SUM(CASE WHEN cs.status IN ({known}) THEN 0 ELSE 1 END)
+        FROM cluster_zooms z, trees t
+        LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+        GROUP BY z.zoom, cell_x, cell_y
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM tree_clusters').fetchone()[0]
+
+# Состояние дерева без осмотров в статистике
+STATS_NO_STATUS = 'unknown'
+
+def stats_delta_sql(source, species, status, delta):
+    """Upsert, прибавляющий delta к счетчику (порода, состояние)
+
+    source - пара (FROM, WHERE) или None для значений из NEW/OLD.
+    """
+    source_from, source_where = source or ('', 'true')
+    return f'''
+        INSERT INTO tree_stats (species, status, tree_count)
+        SELECT {species}, COALESCE({status}, '{STATS_NO_STATUS}'), {delta}
+        {'FROM ' + source_from if source_from else ''}
+        WHERE {source_where}
+        ON CONFLICT (species, status) DO UPDATE SET
+            tree_count = tree_count + excluded.tree_count
+    '''
+
+def create_tree_stats(conn):
+    """Счетчики деревьев по породе и состоянию и триггеры, которые их обновляют"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tree_stats (
+            species TEXT NOT NULL,
+            status TEXT NOT NULL,
+            tree_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (species, status)
+        ) WITHOUT ROWID
+    ''')
+
+    current = '(SELECT status FROM tree_current_status WHERE tree_id = {tree_id})'
+
+    def with_tree(tree_id):
+        # Если дерево уже удалено, строк нет: его вычел триггер удаления дерева
+        return ('trees t', f't.id = {tree_id}')
+
+    triggers = {
+        # Новое дерево еще без состояния
+        'trg_trees_insert_stats': (
+            'AFTER INSERT ON trees',
+            stats_delta_sql(None, 'NEW.species', 'NULL', 1),
+        ),
+        # BEFORE: текущее состояние удаляемого дерева еще доступно
+        'trg_trees_delete_stats': (
+            'BEFORE DELETE ON trees',
+            stats_delta_sql(None, 'OLD.species', current.format(tree_id='OLD.id'), -1),
+        ),
+        'trg_trees_species_stats': (
+            'AFTER UPDATE OF species ON trees WHEN OLD.species IS NOT NEW.species',
+            stats_delta_sql(None, 'OLD.species', current.format(tree_id='NEW.id'), -1) + ';\n' +
+            stats_delta_sql(None, 'NEW.species', current.format(tree_id='NEW.id'), 1),
+        ),
+        'trg_current_status_insert_stats': (
+            'AFTER INSERT ON tree_current_status',
+            stats_delta_sql(with_tree('NEW.tree_id'), 't.species', 'NULL', -1) + ';\n' +
+            stats_delta_sql(with_tree('NEW.tree_id'), 't.species', 'NEW.status', 1),
+        ),
+        'trg_current_status_update_stats': (
+            'AFTER UPDATE OF status ON tree_current_status WHEN OLD.status IS NOT NEW.status',
+            stats_delta_sql(with_tree('NEW.tree_id'), 't.species', 'OLD.status', -1) + ';\n' +
+            stats_delta_sql(with_tree('NEW.tree_id'), 't.species', 'NEW.status', 1),
+        ),
+        'trg_current_status_delete_stats': (
+            'AFTER DELETE ON tree_current_status',
+            stats_delta_sql(with_tree('OLD.tree_id'), 't.species', 'OLD.status', -1) + ';\n' +
+            stats_delta_sql(with_tree('OLD.tree_id'), 't.species', 'NULL', 1),
+        ),
+    }
+
+    for name, (event, body) in triggers.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            BEGIN
+                {body};
+            END
+        ''')
+
+# Счетчики, посчитанные заново по деревьям и их текущему состоянию
+TREE_STATS_SQL = f'''
+    SELECT t.species, COALESCE(cs.status, '{STATS_NO_STATUS}') AS status, COUNT(*) AS tree_count
+    FROM trees t
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    GROUP BY t.species, 2
+'''
+
+def rebuild_tree_stats(conn):
+    """Полная пересборка счетчиков статистики, возвращает число пар (порода, состояние)"""
+    conn.execute('DELETE FROM tree_stats')
+    conn.execute(f'INSERT INTO tree_stats (species, status, tree_count) {TREE_STATS_SQL}')
+    return conn.execute('SELECT COUNT(*) FROM tree_stats').fetchone()[0]
+
+def check_tree_stats(conn):
+    """Расхождения счетчиков с пересчетом: список (порода, состояние, в счетчике, на самом деле)"""
+    stored = {
+        (species, status): count
+        for species, status, count in conn.execute('SELECT species, status, tree_count FROM tree_stats')
+        if count
+    }
+    actual = {(species, status): count for species, status, count in conn.execute(TREE_STATS_SQL)}
+    return [
+        (species, status, stored.get((species, status), 0), actual.get((species, status), 0))
+        for species, status in sorted(stored.keys() | actual.keys())
+        if stored.get((species, status), 0) != actual.get((species, status), 0)
+    ]
+
+# Таблицы, любое изменение которых меняет ответы API на чтение; комментарии
+# версионируются по деревьям (comment_version)
+VERSIONED_TABLES = ('trees', 'tree_status')
+
+def create_data_version(conn):
+    """Счетчик версии данных и триггеры, увеличивающие его при каждой записи"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 1)')
+
+    for table in VERSIONED_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+# Строка comment_version со счетчиком всех комментариев; версия дерева -
+# значение этого счетчика при последнем изменении его комментариев
+ALL_COMMENTS = 0
+
+# Изменения, видимые читателям: комментарий проверен до или после записи
+COMMENT_VERSION_TRIGGERS = {
+    'trg_comments_insert_comment_version': ('AFTER INSERT ON comments', 'NEW.is_reviewed = 1', ('NEW',)),
+    'trg_comments_update_comment_version': ('AFTER UPDATE ON comments', 'OLD.is_reviewed = 1 OR NEW.is_reviewed = 1',
+                                            ('OLD', 'NEW')),
+    'trg_comments_delete_comment_version': ('AFTER DELETE ON comments', 'OLD.is_reviewed = 1', ('OLD',)),
+}
+
+def comment_version_bump_sql(tree_id):
+    """Новая версия комментариев дерева (счетчик всех комментариев уже увеличен)"""
+    return f'''
+        INSERT INTO comment_version (tree_id, version)
+        SELECT {tree_id}, version FROM comment_version WHERE tree_id = {ALL_COMMENTS}
+        ON CONFLICT (tree_id) DO UPDATE SET version = excluded.version
+    '''
+
+def create_comment_version(conn):
+    """Версии комментариев по деревьям и триггеры, увеличивающие их"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS comment_version (
+            tree_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute(f'INSERT OR IGNORE INTO comment_version (tree_id, version) VALUES ({ALL_COMMENTS}, 1)')
+
+    for name, (event, condition, rows) in COMMENT_VERSION_TRIGGERS.items():
+        bumps = ';\n'.join(comment_version_bump_sql(f'{row}.tree_id') for row in rows)
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event} WHEN {condition}
+            BEGIN
+                UPDATE comment_version SET version = version + 1 WHERE tree_id = {ALL_COMMENTS};
+                {bumps};
+            END
+        ''')
+
+    # Комментарии больше не меняют общую версию данных
+    for event in ('insert', 'update', 'delete'):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_comments_{event}_version')
+
+# Изменения, после которых аналитика по истории осмотров считается заново:
+# записи истории, а также порода, координаты (район) и удаление дерева.
+# Новые записи только увеличивают version (их можно дочитать), остальные
+# изменения увеличивают и rewrites (историю нужно перечитать целиком)
+STATUS_VERSION_TRIGGERS = {
+    'trg_tree_status_insert_status_version': ('AFTER INSERT ON tree_status', False),
+    'trg_tree_status_update_status_version': ('AFTER UPDATE ON tree_status', True),
+    'trg_tree_status_delete_status_version': ('AFTER DELETE ON tree_status', True),
+    'trg_trees_update_status_version': ('AFTER UPDATE OF id, species, latitude, longitude ON trees', True),
+    'trg_trees_delete_status_version': ('AFTER DELETE ON trees', True),
+}
+
+def create_status_version(conn):
+    """Счетчики версии истории осмотров и триггеры, увеличивающие их"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS status_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            rewrites INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO status_version (id, version, rewrites) VALUES (1, 1, 1)')
+
+    for name, (event, rewrite) in STATUS_VERSION_TRIGGERS.items():
+        rewrites = ', rewrites = rewrites + 1' if rewrite else ''
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            BEGIN
+                UPDATE status_version SET version = version + 1{rewrites} WHERE id = 1;
+            END
+        ''')
+
+# Документы поискового индекса: rowid = id источника * SEARCH_KIND_COUNT + код вида,
+# поэтому документ удаляется и обновляется по rowid без поиска
+SEARCH_KINDS = {'tree': 1, 'status': 2, 'comment': 3}
+SEARCH_KIND_COUNT = 4
+
+# Документ заметки или комментария есть только у существующего дерева: у tree_status
+# и comments нет каскадного удаления, а поиск соединяет найденное с trees
+SEARCH_TREE_EXISTS = 'EXISTS (SELECT 1 FROM trees WHERE id = {row}.tree_id)'
+
+# Текст документа и условие индексации для каждого вида (row - NEW/OLD или псевдоним таблицы)
+SEARCH_SOURCES = {
+    'tree': ('trees', "{row}.species || ' ' || COALESCE({row}.address, '')", '1', '{row}.id'),
+    'status': ('tree_status', '{row}.notes', "COALESCE({row}.notes, '') != '' AND " + SEARCH_TREE_EXISTS,
+               '{row}.tree_id'),
+    'comment': ('comments', '{row}.text', '{row}.is_reviewed = 1 AND ' + SEARCH_TREE_EXISTS, '{row}.tree_id'),
+}
+
+# Виды документов, которые принадлежат дереву и удаляются вместе с ним
+SEARCH_TREE_DOCUMENT_KINDS = ('status', 'comment')
+
+def search_rowid_sql(kind, row):
+    return f'{row}.id * {SEARCH_KIND_COUNT} + {SEARCH_KINDS[kind]}'
+
+def search_insert_sql(kind, row, from_table=False):
+    """Вставка документов в индекс из строки источника (NEW в триггере)
+    или из всей таблицы источника (from_table=True, row - псевдоним)"""
+    table, body, condition, tree_id = SEARCH_SOURCES[kind]
+    source = f'FROM {table} {row}' if from_table else ''
+    return f'''
+        INSERT INTO search_index (rowid, kind, tree_id, body)
+        SELECT {search_rowid_sql(kind, row)}, '{kind}', {tree_id.format(row=row)}, {body.format(row=row)}
+        {source}
+        WHERE {condition.format(row=row)}
+    '''
+
+def create_search_index(conn):
+    """Таблица FTS5 и триггеры, которые поддерживают ее при записи"""
+    # unicode61 приводит кириллицу к нижнему регистру и убирает диакритику (ё -> е);
+    # префиксные индексы ускоряют запросы вида "гриб*"
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            kind UNINDEXED,
+            tree_id UNINDEXED,
+            body,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4'
+        )
+    ''')
+
+    for kind, (table, _, _, _) in SEARCH_SOURCES.items():
+        delete_old = f'DELETE FROM search_index WHERE rowid = {search_rowid_sql(kind, "OLD")}'
+        triggers = {
+            f'trg_{table}_insert_search': ('AFTER INSERT', search_insert_sql(kind, 'NEW')),
+            f'trg_{table}_update_search': ('AFTER UPDATE', delete_old + ';\n' + search_insert_sql(kind, 'NEW')),
+            f'trg_{table}_delete_search': ('AFTER DELETE', delete_old),
+        }
+        for name, (event, body) in triggers.items():
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name}
+                {event} ON {table}
+                BEGIN
+                    {body};
+                END
+            ''')
+
+    # Удаление дерева удаляет из индекса его заметки и комментарии
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trees_delete_search_documents
+        AFTER DELETE ON trees
+        BEGIN
+            DELETE FROM search_index WHERE rowid IN (
+                {tree_documents_sql('{tree_id} = OLD.id')}
+            );
+        END
+    ''')
+
+def tree_documents_sql(condition):
+    """rowid документов заметок и комментариев деревьев по условию на tree_id источника"""
+    return '\n        UNION ALL\n'.join(
+        f'SELECT {search_rowid_sql(kind, "src")} FROM {SEARCH_SOURCES[kind][0]} src '
+        f'WHERE {condition.format(tree_id="src.tree_id")}'
+        for kind in SEARCH_TREE_DOCUMENT_KINDS
+    )
+
+def delete_orphan_search_documents(conn):
+    """Удаление из индекса заметок и комментариев уже удаленных деревьев, возвращает их число"""
+    return conn.execute(f'''
+        DELETE FROM search_index WHERE rowid IN (
+            {tree_documents_sql('NOT EXISTS (SELECT 1 FROM trees WHERE id = {tree_id})')}
+        )
+    ''').rowcount
+
+def rebuild_search_index(conn):
+    """Полная пересборка поискового индекса, возвращает число документов"""
+    conn.execute('DELETE FROM search_index')
+    for kind in SEARCH_SOURCES:
+        conn.execute(search_insert_sql(kind, 'src', from_table=True))
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    return conn.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]
+
+# Журнал изменений: сколько последних записей хранится. Клиент, отставший
+# больше чем на CHANGE_LOG_KEEP изменений, загружает данные заново
+CHANGE_LOG_KEEP = 100000
+
+# Записи журнала: (событие, условие WHEN, сущность, строка NEW/OLD, признак удаления).
+# Комментарий публикуется только после проверки, поэтому непроверенные не попадают в журнал,
+# а снятие проверки записывается как удаление
+CHANGE_LOG_TRIGGERS = {
+    'trg_trees_insert_change': ('AFTER INSERT ON trees', None, 'tree', 'NEW', '0'),
+    'trg_trees_update_change': ('AFTER UPDATE ON trees', None, 'tree', 'NEW', '0'),
+    'trg_trees_delete_change': ('AFTER DELETE ON trees', None, 'tree', 'OLD', '1'),
+    'trg_tree_status_insert_change': ('AFTER INSERT ON tree_status', None, 'status', 'NEW', '0'),
+    'trg_tree_status_update_change': ('AFTER UPDATE ON tree_status', None, 'status', 'NEW', '0'),
+    'trg_tree_status_delete_change': ('AFTER DELETE ON tree_status', None, 'status', 'OLD', '1'),
+    'trg_comments_insert_change': ('AFTER INSERT ON comments', 'NEW.is_reviewed = 1', 'comment', 'NEW', '0'),
+    'trg_comments_update_change': ('AFTER UPDATE ON comments', 'OLD.is_reviewed = 1 OR NEW.is_reviewed = 1',
+                                   'comment', 'NEW', 'NEW.is_reviewed != 1'),
+    'trg_comments_delete_change': ('AFTER DELETE ON comments', 'OLD.is_reviewed = 1', 'comment', 'OLD', '1'),
+}
+
+def create_change_log(conn):
+    """Журнал изменений и триггеры, которые пишут в него и отбрасывают старые записи"""
+    # AUTOINCREMENT: версия не переиспользуется и после удаления последних записей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            tree_id INTEGER,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    for name, (event, condition, entity, row, deleted) in CHANGE_LOG_TRIGGERS.items():
+        tree_id = f'{row}.id' if entity == 'tree' else f'{row}.tree_id'
+        when = f'WHEN {condition}' if condition else ''
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event} {when}
+            BEGIN
+                INSERT INTO change_log (entity, entity_id, tree_id, deleted)
+                VALUES ('{entity}', {row}.id, {tree_id}, {deleted});
+            END
+        ''')
+
+    # Уплотнение: каждая новая запись вытесняет самую старую сверх CHANGE_LOG_KEEP (поиск по rowid)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_change_log_trim
+        AFTER INSERT ON change_log
+        BEGIN
+            DELETE FROM change_log WHERE version <= NEW.version - {CHANGE_LOG_KEEP};
+        END
+    ''')
+
+def bump_versions(conn):
+    """Новые версии данных и истории осмотров после пересборки
+
+    Пересборка пишет в производные таблицы без триггеров версий: без сдвига
+    кэш ответов, тайлы, снимок и аналитика продолжили бы отдавать старое.
+    """
+    conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+    conn.execute('UPDATE status_version SET version = version + 1, rewrites = rewrites + 1 WHERE id = 1')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Производные данные ДендроМонитор')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='пересобрать производные данные: текущее состояние, R*Tree, кластеры, '
+                             'статистику и поисковый индекс')
+    parser.add_argument('--check-stats', action='store_true',
+                        help='сравнить счетчики статистики с пересчетом по деревьям')
+    args = parser.parse_args(argv)
+
+    if args.check_stats:
+        conn = get_db_connection()
+        try:
+            mismatches = check_tree_stats(conn)
+        finally:
+            conn.close()
+
+        for species, status, stored, actual in mismatches:
+            print(f"❌ {species} / {status}: в счетчике {stored}, деревьев {actual}")
+        if mismatches:
+            print("   исправление: python -m api.projections --rebuild")
+            sys.exit(1)
+        print("✅ Счетчики статистики совпадают с деревьями")
+        return
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    conn = get_db_connection()
+    try:
+        current_count = rebuild_current_status(conn)
+        rtree_count = rebuild_tree_rtree(conn)
+        cluster_count = rebuild_tree_clusters(conn)
+        stats_count = rebuild_tree_stats(conn)
+        search_count = rebuild_search_index(conn)
+        bump_versions(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"✅ Текущее состояние пересобрано: {current_count} деревьев")
+    print(f"✅ R*Tree пересобран: {rtree_count} деревьев")
+    print(f"✅ Кластеры пересобраны: {cluster_count} ячеек")
+    print(f"✅ Статистика пересобрана: {stats_count} пар порода/состояние")
+    print(f"✅ Поисковый индекс пересобран: {search_count} документов")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Проверка планов запросов API через EXPLAIN QUERY PLAN
+
+Каждый запрос API выполняется с EXPLAIN QUERY PLAN на пустой базе с
+примененными миграциями. Запрос не проходит проверку, если он читает
+таблицу целиком (SCAN) там, где это не оговорено, или сортирует
+результат во временном B-дереве вместо чтения индекса по порядку.
+Запуск: python -m api.migrations --check
+"""
+import sqlite3
+
+from api import add_tree, analytics, cache, changes, clusters, comments, importer, moderation, search, snapshot, stats, status, trees
+from api.migrations import migrate
+
+# Имя запроса: (SQL, параметры, псевдонимы таблиц, которые разрешено читать целиком;
+# 'TEMP B-TREE' разрешает сортировку вне индекса, если она ограничена по размеру)
+API_QUERIES = {
+    'trees.list': (trees.TREE_LIST_SQL, (), {'t'}),
+    'trees.bbox': (trees.TREE_BBOX_SQL, {
+        'min_lon': 37.6, 'min_lat': 55.7, 'max_lon': 37.7, 'max_lat': 55.8, 'limit': -1,
+    }, set()),
+    'clusters.cells': (clusters.CLUSTERS_SQL, (12, 0, 100, 0, 100), set()),
+    'trees.compact_list': (trees.TREE_COMPACT_LIST_SQL, (), {'t'}),
+    'trees.compact_bbox': (trees.TREE_COMPACT_BBOX_SQL, {
+        'min_lon': 37.6, 'min_lat': 55.7, 'max_lon': 37.7, 'max_lat': 55.8, 'limit': -1,
+    }, set()),
+    'trees.page': (trees.TREE_PAGE_SQL, (0, 51), set()),
+    'trees.detail': (trees.TREE_SQL, (1,), set()),
+    'trees.status_history': (trees.STATUS_HISTORY_SQL, (1,), set()),
+    'comments.by_tree': (comments.COMMENTS_SQL, (1,), set()),
+    'comments.first_page': (comments.COMMENTS_FIRST_PAGE_SQL, (1, 51), set()),
+    'comments.page': (comments.COMMENTS_PAGE_SQL, (1, '2024-01-01 00:00:00', 10, 51), set()),
+    'add_tree.added_tree': (add_tree.ADDED_TREE_SQL, (1,), set()),
+    'status.current': (status.CURRENT_STATUS_SQL, (1,), set()),
+    'status.existing_trees': (status.EXISTING_TREES_SQL, ('[1, 2]',), {'json_each'}),
+    'status.current_batch': (status.CURRENT_STATUSES_SQL, ('[1, 2]',), {'json_each'}),
+    'importer.next_tree_id': (importer.NEXT_TREE_ID_SQL, (), {'sqlite_sequence'}),
+    'importer.unfinished_job': (importer.UNFINISHED_JOB_SQL, ('0' * 40,), set()),
+    'importer.done_job': (importer.DONE_JOB_SQL, ('0' * 40,), set()),
+    'importer.job': (importer.IMPORT_JOB_SQL, (1,), set()),
+    'importer.errors': (importer.IMPORT_ERRORS_SQL, (1, 100), set()),
+    'cache.data_version': (cache.DATA_VERSION_SQL, (), set()),
+    'cache.comment_version': (cache.COMMENT_VERSION_SQL, (1,), set()),
+    'cache.data_comment_version': (cache.DATA_COMMENT_VERSION_SQL, (1,), set()),
+    # Частичный индекс содержит только очередь: его просмотр не читает проверенные комментарии
+    'moderation.first_page': (moderation.PENDING_FIRST_PAGE_SQL, (51,), {'c'}),
+    'moderation.page': (moderation.PENDING_PAGE_SQL, ('2024-01-01 00:00:00', 10, 51), set()),
+    'moderation.count': (moderation.PENDING_COUNT_SQL, (), {'comments'}),
+    'moderation.approve': (moderation.APPROVE_SQL, ('[1, 2]',), {'json_each'}),
+    'moderation.reject': (moderation.REJECT_SQL, ('[1, 2]',), {'json_each'}),
+    # Вся таблица счетчиков - это и есть ответ, она не больше числа пар порода/состояние
+    'stats.counters': (stats.STATS_SQL, (), {'tree_stats'}),
+    # Аналитика читает историю целиком (при дочитывании - по диапазону id)
+    'analytics.status_version': (analytics.STATUS_VERSION_SQL, (), set()),
+    'analytics.last_status_id': (analytics.LAST_STATUS_ID_SQL, (), set()),
+    'analytics.trees': (analytics.TREES_SQL, (0,), set()),
+    'analytics.history': (analytics.HISTORY_SQL, (0, 100), set()),
+    'snapshot.version': (snapshot.SNAPSHOT_VERSION_SQL, (), set()),
+    'snapshot.last_ids': (snapshot.LAST_IDS_SQL, (), set()),
+    'snapshot.trees': (snapshot.SNAPSHOT_TREES_SQL, (0, 100), set()),
+    'snapshot.changed_statuses': (snapshot.CHANGED_STATUSES_SQL, (0, 100), {'TEMP B-TREE'}),
+    'changes.versions': (changes.CHANGE_VERSIONS_SQL, (), {'sqlite_sequence'}),
+    'changes.log': (changes.CHANGES_SQL, (0, 1000), set()),
+    'changes.trees': (changes.CHANGED_TREES_SQL, ('[1, 2]',), {'json_each'}),
+    'changes.statuses': (changes.CHANGED_STATUSES_SQL, ('[1, 2]',), {'json_each'}),
+    'changes.comments': (changes.CHANGED_COMMENTS_SQL, ('[1, 2]',), {'json_each'}),
+    'search.count': (search.SEARCH_COUNT_SQL, {'query': '"дуб"*', 'kind': None, 'limit': 5001}, {'(subquery-1)'}),
+    # Сортировка по bm25 только при числе совпадений до search.RANKED_MAX_MATCHES
+    'search.ranked': (search.SEARCH_RANKED_SQL, {
+        'query': '"дуб"*', 'kind': None, 'after_score': None, 'after_id': None, 'limit': 21,
+    }, {'top', 'TEMP B-TREE'}),
+    'search.recent': (search.SEARCH_RECENT_SQL, {
+        'query': '"дуб"*', 'kind': None, 'after_id': None, 'limit': 21,
+    }, {'hits', 'TEMP B-TREE'}),
+}
+
+def explain(conn, sql, params):
+    """Строки плана запроса"""
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+def plan_problems(plan, allowed_scans):
+    """Шаги плана, которые не используют индекс"""
+    problems = []
+    for step in plan:
+        if step.startswith('SCAN ') and step != 'SCAN CONSTANT ROW':
+            table = step.split()[1]
+            # Виртуальная таблица (R*Tree, FTS5) с ограничениями - это поиск по ее индексу
+            if 'VIRTUAL TABLE INDEX' in step and step.rsplit(':', 1)[-1]:
+                continue
+            if table not in allowed_scans:
+                problems.append(step)
+        elif step.startswith('USE TEMP B-TREE') and 'TEMP B-TREE' not in allowed_scans:
+            problems.append(step)
+    return problems
+
+def check_query_plans(verbose=True):
+    """Проверка всех запросов API, возвращает словарь {имя: проблемные шаги}"""
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+
+    failures = {}
+    for name, (sql, params, allowed_scans) in API_QUERIES.items():
+        plan = explain(conn, sql, params)
+        problems = plan_problems(plan, allowed_scans)
+        if problems:
+            failures[name] = problems
+
+        if verbose:
+            print(f"{'❌' if problems else '✅'} {name}")
+            for step in plan:
+                print(f"     {step}")
+
+    conn.close()
+    return failures
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+from urllib.parse import parse_qs
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag',
+}
+
+class Request:
+    """Запрос к API: метод, параметры строки запроса, тело и заголовки"""
+
+    def __init__(self, method, path, query=None, body=b'', headers=None):
+        self.method = method
+        self.path = path
+        self.query = query or {}
+        self.body = body
+        self.headers = headers or {}
+
+    def param(self, name, default=None):
+        """Первое значение параметра строки запроса"""
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def header(self, name, default=None):
+        """Заголовок запроса без учета регистра имени"""
+        name = name.lower()
+        for key, value in self.headers.items():
+            if key.lower() == name:
+                return value
+        return default
+
+    def json(self):
+        """Тело запроса, разобранное как JSON"""
+        if not self.body:
+            return None
+        return json.loads(self.body)
+
+    @classmethod
+    def from_cgi(cls):
+        """Сборка запроса из переменных окружения CGI и stdin"""
+        content_length = int(os.environ.get('CONTENT_LENGTH') or 0)
+        body = sys.stdin.buffer.read(content_length) if content_length > 0 else b''
+        return cls(
+            method=os.environ.get('REQUEST_METHOD', 'GET'),
+            path=os.environ.get('SCRIPT_NAME', ''),
+            query=parse_qs(os.environ.get('QUERY_STRING', '')),
+            body=body,
+            headers={'Content-Type': os.environ.get('CONTENT_TYPE', '')},
+        )
+
+def parse_bbox(value):
+    """Разбор bbox=minLon,minLat,maxLon,maxLat в кортеж чисел"""
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must be minLon,minLat,maxLon,maxLat')
+
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError('bbox minimum must not exceed maximum')
+    return min_lon, min_lat, max_lon, max_lat
+
+class Response:
+    """Ответ API: данные для сериализации в JSON, код и дополнительные заголовки
+
+    Уже закодированное тело (например, из кэша) передается в raw, а
+    большое тело, которое кодируется по частям, - итератором байтов в stream.
+    """
+
+    def __init__(self, data=None, status=200, headers=None, raw=None, content_type=JSON_CONTENT_TYPE,
+                 stream=None):
+        self.data = data
+        self.status = status
+        self.headers = headers or {}
+        self.raw = raw
+        self.content_type = content_type
+        self.stream = stream
+
+    def body(self):
+        if self.stream is not None:
+            return b''.join(self.chunks())
+        if self.raw is not None:
+            return self.raw
+        return json.dumps(self.data, ensure_ascii=False).encode('utf-8')
+
+    def chunks(self):
+        """Тело ответа по частям (одной частью, если ответ не потоковый)"""
+        if self.stream is None:
+            yield self.body()
+            return
+        try:
+            yield from self.stream
+        finally:
+            # Генератор держит подключение к базе: закрываем и при обрыве передачи
+            close = getattr(self.stream, 'close', None)
+            if close is not None:
+                close()
+
+# Число строк, которые кодируются в JSON за один вызов json.dumps
+JSON_STREAM_BATCH = 500
+
+def json_array_stream(rows, batch_size=JSON_STREAM_BATCH):
+    """Кодирование последовательности словарей в JSON-массив по частям
+
+    В памяти одновременно находится только одна пачка строк, поэтому
+    объем памяти не зависит от длины результата.
+    """
+    yield b'['
+    separator = b''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield separator + json.dumps(batch, ensure_ascii=False)[1:-1].encode('utf-8')
+            separator = b', '
+            batch = []
+    if batch:
+        yield separator + json.dumps(batch, ensure_ascii=False)[1:-1].encode('utf-8')
+    yield b']'
+
+def run_cgi(handler):
+    """Выполнение обработчика в режиме CGI-скрипта (запасной путь через subprocess)"""
+    try:
+        response = handler(Request.from_cgi())
+    except Exception as e:
+        response = Response({'success': False, 'error': str(e)})
+
+    # Установка заголовков
+    if response.status != 200:
+        print(f"Status: {response.status}")
+    print(f"Content-Type: {response.content_type}")
+    for name, value in list(CORS_HEADERS.items()) + list(response.headers.items()):
+        print(f"{name}: {value}")
+    print()
+    sys.stdout.flush()
+    for chunk in response.chunks():
+        sys.stdout.buffer.write(chunk)
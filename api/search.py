@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Полнотекстовый поиск: /api/search?q=Тверская
+
+Ищет по породе и адресу деревьев, заметкам осмотров и проверенным
+комментариям (индекс search_index, см. api/projections.py). Слова запроса
+ищутся по префиксу, у длинных русских слов отбрасывается окончание,
+поэтому "грибы" находит "грибов", а "обрезка" - "обрезку".
+"""
+import os
+import re
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.cache import get_data_comment_version
+from api.db import get_db_connection
+from api.pagination import DEFAULT_PAGE_SIZE, decode_cursor, page, parse_page_size
+from api.projections import SEARCH_KINDS
+from api.request import Response, run_cgi
+
+# Дерево и текущее состояние для найденных документов
+SEARCH_RESULT_SQL = '''
+    WITH hits AS ({hits})
+    SELECT hits.doc_id, hits.score, hits.kind, hits.tree_id, hits.snippet,
+           t.species, t.address, t.latitude, t.longitude, cs.status
+    FROM hits
+    JOIN trees t ON t.id = hits.tree_id
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    ORDER BY {order}
+'''
+
+SEARCH_SNIPPET = "snippet(search_index, 2, '[', ']', '…', 12)"
+
+# По релевантности (bm25: меньше - лучше), при равенстве по rowid. Сниппет
+# считается после выбора страницы: документ страницы ищется повторно по rowid
+# (CROSS JOIN сохраняет этот порядок соединения)
+SEARCH_RANKED_SQL = SEARCH_RESULT_SQL.format(hits=f'''
+    SELECT top.doc_id, top.score, s.kind, s.tree_id, {SEARCH_SNIPPET} AS snippet
+    FROM (
+        SELECT rowid AS doc_id, bm25(search_index) AS score
+        FROM search_index
+        WHERE search_index MATCH :query
+          AND (:kind IS NULL OR kind = :kind)
+          AND (:after_score IS NULL OR (bm25(search_index), rowid) > (:after_score, :after_id))
+        ORDER BY score, doc_id
+        LIMIT :limit
+    ) AS top
+    CROSS JOIN search_index s ON s.rowid = top.doc_id
+    WHERE s.search_index MATCH :query
+''', order='hits.score, hits.doc_id')
+
+# Новые документы первыми: это порядок хранения FTS5, поэтому сортировки нет
+# и сниппет считается только для строк страницы
+SEARCH_RECENT_SQL = SEARCH_RESULT_SQL.format(hits=f'''
+    SELECT rowid AS doc_id, NULL AS score, kind, tree_id, {SEARCH_SNIPPET} AS snippet
+    FROM search_index
+    WHERE search_index MATCH :query
+      AND (:kind IS NULL OR kind = :kind)
+      AND (:after_id IS NULL OR rowid < :after_id)
+    ORDER BY rowid DESC
+    LIMIT :limit
+''', order='hits.doc_id DESC')
+
+# Число совпадений, но не больше :limit
+SEARCH_COUNT_SQL = '''
+    SELECT COUNT(*) FROM (
+        SELECT 1 FROM search_index
+        WHERE search_index MATCH :query
+          AND (:kind IS NULL OR kind = :kind)
+        LIMIT :limit
+    )
+'''
+
+# bm25 читает размер каждого найденного документа: при большем числе совпадений
+# (частые слова) результаты сортируются по новизне, иначе запрос не уложится в ~20 мс
+RANKED_MAX_MATCHES = 5000
+
+WORD_RE = re.compile(r'\w+')
+
+# Больше слов в запросе не учитываем
+MAX_TERMS = 8
+
+# Окончания русских слов, которые отбрасываются перед поиском по префиксу
+RUSSIAN_ENDING_CHARS = 'аеёийоуыьэюя'
+CYRILLIC_RE = re.compile('[а-яё]')
+
+def term_prefix(word):
+    """Основа слова для поиска по префиксу: до двух гласных/й/ь с конца длинного русского слова"""
+    if len(word) >= 5 and CYRILLIC_RE.search(word):
+        for _ in range(2):
+            if len(word) > 4 and word[-1] in RUSSIAN_ENDING_CHARS:
+                word = word[:-1]
+    return word
+
+def fts_query(text):
+    """Запрос FTS5 из строки пользователя: все слова по префиксу (И)
+
+    Слова берутся в кавычки, поэтому операторы FTS5 в строке не действуют.
+    """
+    words = WORD_RE.findall((text or '').lower())[:MAX_TERMS]
+    return ' '.join(f'"{term_prefix(word)}"*' for word in words)
+
+def search(text, kind=None, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Страница результатов поиска и курсор следующей"""
+    query = fts_query(text)
+    if not query:
+        raise ValueError('q parameter required')
+    if kind is not None and kind not in SEARCH_KINDS:
+        raise ValueError(f'kind must be one of: {", ".join(SEARCH_KINDS)}')
+
+    conn = get_db_connection()
+    try:
+        params = {'query': query, 'kind': kind, 'limit': page_size + 1}
+        if cursor:
+            # Курсор определяет порядок: (оценка, rowid) или только rowid
+            try:
+                values = decode_cursor(cursor, 2)
+                ranked = True
+            except ValueError:
+                values = decode_cursor(cursor, 1)
+                ranked = False
+        else:
+            values = None
+            matches = conn.execute(SEARCH_COUNT_SQL, dict(params, limit=RANKED_MAX_MATCHES + 1)).fetchone()[0]
+            ranked = matches <= RANKED_MAX_MATCHES
+
+        if ranked:
+            after_score, after_id = values or (None, None)
+            rows = conn.execute(SEARCH_RANKED_SQL, dict(params, after_score=after_score, after_id=after_id)).fetchall()
+        else:
+            rows = conn.execute(SEARCH_RECENT_SQL, dict(params, after_id=values[0] if values else None)).fetchall()
+    finally:
+        conn.close()
+
+    if ranked:
+        results, next_cursor = page(rows, page_size, lambda result: [result['score'], result['doc_id']])
+        for result in results:
+            result['score'] = round(result['score'], 4)
+    else:
+        results, next_cursor = page(rows, page_size, lambda result: [result['doc_id']])
+
+    return {
+        'query': query,
+        'order': 'relevance' if ranked else 'recent',
+        'results': results,
+        'next': next_cursor,
+    }
+
+def cache_version(request):
+    """Версия для кэша ответов: в поиске участвуют проверенные комментарии всех деревьев"""
+    return get_data_comment_version()
+
+def handle(request):
+    """Обработка поискового запроса: /api/search?q=...&kind=tree|status|comment&page_size=&cursor="""
+    try:
+        return Response(search(
+            request.param('q'),
+            request.param('kind'),
+            request.param('cursor'),
+            parse_page_size(request),
+        ))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+if __name__ == '__main__':
+    run_cgi(handle)
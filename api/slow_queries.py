@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Журнал медленных запросов к SQLite с планами EXPLAIN QUERY PLAN
+
+Пока журнал включен, каждый execute подключений пула возвращает
+курсор-трассировщик: он считает время выполнения и чтения строк и
+число строк. Запрос дольше порога пишется в stderr строкой JSON с SQL,
+параметрами, временем, числом строк и планом, а в памяти остаются
+последние SLOW_EVENTS_KEEP медленных запросов. /api/debug/slow-queries
+сводит их по форме запроса (SQL без литералов и с одним ? вместо
+списков) и показывает худшие по суммарному времени.
+
+Включение без перезапуска:
+    POST /api/debug/slow-queries {"enabled": true, "threshold_ms": 50}
+при запуске - server.py --slow-query-ms 50 (DENDRO_SLOW_QUERY_MS).
+Выключенный журнал ничего не стоит: execute идет мимо трассировки.
+В режиме нескольких процессов журнал у каждого процесса свой.
+"""
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.db import PooledConnection
+from api.metrics import OTHER_LABELS, QUERY_LABELS
+
+DEFAULT_THRESHOLD_MS = 100
+# Медленных запросов в памяти и худших форм в ответе по умолчанию
+SLOW_EVENTS_KEEP = 1000
+DEFAULT_TOP = 20
+# Планов в кэше (план одной формы запроса снимается один раз)
+PLAN_CACHE_SIZE = 256
+# Незавершенных курсоров на подключение: более старые завершаются с уже прочитанными строками
+OPEN_CURSORS_KEEP = 8
+# Длина строкового параметра и число элементов списка в журнале
+PARAM_TEXT_LIMIT = 200
+PARAM_ITEMS_LIMIT = 20
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+WHITESPACE = re.compile(r'\s+')
+
+def query_shape(sql):
+    """Форма запроса: литералы заменены на ?, списки ? свернуты, пробелы сжаты"""
+    shape = STRING_LITERAL.sub('?', sql)
+    shape = NUMBER_LITERAL.sub('?', shape)
+    shape = PLACEHOLDER_LIST.sub('?', shape)
+    return WHITESPACE.sub(' ', shape).strip()
+
+def loggable(value):
+    """Параметр в журнале: длинные строки и списки обрезаются, байты заменяются длиной"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, str) and len(value) > PARAM_TEXT_LIMIT:
+        return value[:PARAM_TEXT_LIMIT] + '…'
+    if isinstance(value, dict):
+        return {key: loggable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [loggable(item) for item in value[:PARAM_ITEMS_LIMIT]]
+        if len(value) > PARAM_ITEMS_LIMIT:
+            items.append(f'… {len(value) - PARAM_ITEMS_LIMIT} more')
+        return items
+    return value
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор, который считает время и строки своего запроса"""
+
+    trace = None
+
+    def start(self, log, sql, parameters):
+        self.trace = [log, sql, parameters, 0.0, 0]
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self.trace[3] += time.perf_counter() - started
+        return self
+
+    def account(self, started, rows):
+        trace = self.trace
+        if trace is not None:
+            trace[3] += time.perf_counter() - started
+            trace[4] += rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self.account(started, row is not None)
+        if row is None:
+            self.finish()
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.account(started, len(rows))
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self.account(started, len(rows))
+        self.finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.account(started, 0)
+            self.finish()
+            raise
+        self.account(started, 1)
+        return row
+
+    def finish(self):
+        """Запрос завершен (или курсор больше не читают): передача в журнал"""
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            log, sql, parameters, elapsed, rows = trace
+            log.observe(self.connection, sql, parameters, elapsed, rows)
+
+class SlowQueryLog:
+    """Порог, последние медленные запросы и кэш планов"""
+
+    def __init__(self, threshold_ms=DEFAULT_THRESHOLD_MS, keep=SLOW_EVENTS_KEEP, stream=None):
+        self.threshold = threshold_ms / 1000
+        self.enabled = False
+        self.events = deque(maxlen=keep)
+        self.plans = OrderedDict()
+        self.traced = 0
+        self.slow = 0
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def enable(self, threshold_ms=None):
+        """Включение трассировки во всех подключениях пула"""
+        if threshold_ms is not None:
+            self.set_threshold(threshold_ms)
+        self.enabled = True
+        PooledConnection.query_tracer = self
+
+    def set_threshold(self, threshold_ms):
+        self.threshold = threshold_ms / 1000
+
+    def disable(self):
+        self.enabled = False
+        PooledConnection.query_tracer = None
+
+    def reset(self):
+        with self.lock:
+            self.events.clear()
+            self.plans.clear()
+            self.traced = 0
+            self.slow = 0
+
+    def execute(self, conn, sql, parameters):
+        """execute подключения пула с трассировкой (вызывается из PooledConnection.execute)"""
+        cursor = conn.cursor(TracedCursor)
+        try:
+            cursor.start(self, sql, parameters)
+        finally:
+            if conn.query_timer is not None and cursor.trace is not None:
+                conn.query_timer(sql, cursor.trace[3])
+
+        if cursor.description is None:
+            # Запрос без строк результата (запись, BEGIN, PRAGMA) уже выполнен целиком
+            cursor.finish()
+            return cursor
+
+        # Курсоры, которые не дочитали до конца, завершаются при возврате подключения в пул
+        open_cursors = conn.__dict__.setdefault('traced_cursors', [])
+        open_cursors.append(cursor)
+        if len(open_cursors) > OPEN_CURSORS_KEEP:
+            open_cursors.pop(0).finish()
+        return cursor
+
+    def observe(self, conn, sql, parameters, elapsed, rows):
+        with self.lock:
+            self.traced += 1
+        if elapsed < self.threshold:
+            return
+
+        shape = query_shape(sql)
+        event = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'query': QUERY_LABELS.get(sql, OTHER_LABELS)[0],
+            'duration_ms': round(elapsed * 1000, 3),
+            'rows': rows,
+            'sql': shape,
+            'params': loggable(parameters),
+            'plan': self.plan(conn, shape, sql, parameters),
+        }
+        with self.lock:
+            self.slow += 1
+            self.events.append(event)
+        (self.stream or sys.stderr).write(json.dumps(dict(event, event='slow_query'), ensure_ascii=False,
+                                                     default=str) + '\n')
+
+    def plan(self, conn, shape, sql, parameters):
+        """План формы запроса: снимается на том же подключении при первом медленном выполнении"""
+        with self.lock:
+            if shape in self.plans:
+                self.plans.move_to_end(shape)
+                return self.plans[shape]
+        try:
+            # Мимо PooledConnection.execute: план не трассируется
+            plan = [row[3] for row in sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters)]
+        except sqlite3.Error as e:
+            plan = [f'EXPLAIN failed: {e}']
+        with self.lock:
+            self.plans[shape] = plan
+            while len(self.plans) > PLAN_CACHE_SIZE:
+                self.plans.popitem(last=False)
+        return plan
+
+    def top(self, limit=DEFAULT_TOP):
+        """Худшие формы запросов среди последних медленных по суммарному времени"""
+        with self.lock:
+            events = list(self.events)
+        shapes = {}
+        for event in events:
+            entry = shapes.get(event['sql'])
+            if entry is None:
+                entry = shapes[event['sql']] = {
+                    'sql': event['sql'], 'query': event['query'], 'count': 0, 'total_ms': 0.0,
+                    'max_ms': 0.0, 'plan': event['plan'],
+                }
+            entry['count'] += 1
+            entry['total_ms'] += event['duration_ms']
+            entry['last_seen'] = event['time']
+            if event['duration_ms'] >= entry['max_ms']:
+                # Параметры и число строк самого долгого выполнения
+                entry.update(max_ms=event['duration_ms'], rows=event['rows'], params=event['params'])
+        worst = sorted(shapes.values(), key=lambda entry: entry['total_ms'], reverse=True)[:limit]
+        for entry in worst:
+            entry['total_ms'] = round(entry['total_ms'], 3)
+            entry['avg_ms'] = round(entry['total_ms'] / entry['count'], 3)
+        return worst
+
+    def stats(self, limit=DEFAULT_TOP):
+        with self.lock:
+            summary = {
+                'enabled': self.enabled,
+                'threshold_ms': round(self.threshold * 1000, 3),
+                'traced': self.traced,
+                'slow': self.slow,
+                'kept': len(self.events),
+            }
+        summary['top'] = self.top(limit)
+        return summary
+
+slow_query_log = SlowQueryLog()
+
+def handle_debug(request):
+    """/api/debug/slow-queries: GET ?top=N - сводка, POST - включение, порог и сброс"""
+    if request.method == 'POST':
+        data = request.json() or {}
+        if not isinstance(data, dict):
+            raise ValueError('expected a JSON object')
+        threshold_ms = data.get('threshold_ms')
+        if threshold_ms is not None:
+            if isinstance(threshold_ms, bool) or not isinstance(threshold_ms, (int, float)) or threshold_ms < 0:
+                raise ValueError('threshold_ms must be a non-negative number')
+            slow_query_log.set_threshold(threshold_ms)
+        if data.get('reset'):
+            slow_query_log.reset()
+        if data.get('enabled') is True:
+            slow_query_log.enable()
+        elif data.get('enabled') is False:
+            slow_query_log.disable()
+
+    top = request.param('top', str(DEFAULT_TOP))
+    if not top.isdigit():
+        raise ValueError('top must be a non-negative integer')
+    return slow_query_log.stats(int(top))
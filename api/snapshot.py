@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""Компактный снимок деревьев в памяти
+
+Карте нужны несколько столбцов trees: id, координаты, порода и текущее
+состояние. Снимок хранит их в массивах array по id дерева: порода - номер
+в списке названий, состояние - номер в STATUSES, без словаря на каждое
+дерево. Для запросов по области id деревьев отсортированы по ячейкам сетки
+CELL_DEGREES x CELL_DEGREES: ячейки одной строки сетки - непрерывный отрезок
+массива. Адреса и прочий текст остаются в базе.
+
+Снимок строится при запуске сервера и перед чтением догоняет базу по
+счетчикам data_version и status_version, которые увеличивают триггеры
+при любой записи (см. api/projections.py): новые деревья и осмотры
+дочитываются по id, после изменения или удаления деревьев и истории
+снимок строится заново в фоне и подменяет прежний, когда готов.
+
+Из снимка всегда отвечает /api/trees/nearby, а при запуске сервера с
+--snapshot (DENDRO_SNAPSHOT=1) также /api/trees?fields=compact и /api/stats.
+Размер и время загрузки:
+    python -m api.snapshot
+"""
+import argparse
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+
+if __package__ in (None, ''):
+    # Запуск как скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import STATUSES
+from api.db import get_db_connection
+from api.projections import STATS_NO_STATUS
+
+# Ячейка около 111 x 64 м в широтах Москвы
+CELL_DEGREES = 0.001
+CELLS_PER_DEGREE = int(round(1 / CELL_DEGREES))
+CELLS_PER_ROW = 360 * CELLS_PER_DEGREE + 1
+
+# Деревья, добавленные после сортировки, хранятся в словаре ячеек; когда их
+# больше RECENT_MAX (или 1/64 снимка), id сортируются заново
+RECENT_MAX = 4096
+
+# Строк за одно чтение из курсора при загрузке
+FETCH_SIZE = 10000
+
+# Состояние в снимке: номер в STATUSES, UNKNOWN_STATUS - без осмотров
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+UNKNOWN_STATUS = -1
+
+# Версия данных и счетчик перестроений истории одним запросом
+SNAPSHOT_VERSION_SQL = '''
+    SELECT (SELECT version FROM data_version WHERE id = 1),
+           (SELECT rewrites FROM status_version WHERE id = 1)
+'''
+
+LAST_IDS_SQL = '''
+    SELECT (SELECT MAX(id) FROM tree_status), (SELECT MAX(id) FROM trees)
+'''
+
+# Деревья в диапазоне id с текущим состоянием
+SNAPSHOT_TREES_SQL = '''
+    SELECT t.id, t.latitude, t.longitude, t.species, cs.status
+    FROM trees t
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    WHERE t.id > ? AND t.id <= ?
+    ORDER BY t.id
+'''
+
+# Текущее состояние деревьев, у которых появились новые осмотры
+CHANGED_STATUSES_SQL = '''
+    SELECT DISTINCT ts.tree_id, cs.status
+    FROM tree_status ts
+    JOIN tree_current_status cs ON cs.tree_id = ts.tree_id
+    WHERE ts.id > ? AND ts.id <= ?
+'''
+
+def cell_of(latitude, longitude):
+    """Номера столбца и строки ячейки точки"""
+    return int((longitude + 180) * CELLS_PER_DEGREE), int((latitude + 90) * CELLS_PER_DEGREE)
+
+def cell_key(latitude, longitude):
+    """Номер ячейки: ячейки одной строки сетки идут подряд"""
+    cell_x, cell_y = cell_of(latitude, longitude)
+    return cell_y * CELLS_PER_ROW + cell_x
+
+def status_code(status):
+    return STATUS_CODES.get(status, UNKNOWN_STATUS)
+
+def snapshot_enabled():
+    """Отвечать ли списку и статистике из снимка (--snapshot, DENDRO_SNAPSHOT=1)"""
+    return os.environ.get('DENDRO_SNAPSHOT') == '1'
+
+class SnapshotColumns:
+    """Столбцы деревьев в массивах по id и id деревьев по ячейкам
+
+    Дочитывание новых деревьев и осмотров только удлиняет массивы и меняет
+    состояния на месте, а перестроение собирает новый объект: выдача,
+    начатая до перестроения, дочитывает прежний.
+    """
+
+    def __init__(self):
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.species = array('H')
+        self.status = array('b')
+        self.species_names = []
+        self.species_codes = {}
+        # Число деревьев по (код породы, код состояния) для /api/stats
+        self.counts = {}
+        # id деревьев по возрастанию ячейки; деревья ячейки cell_keys[i] -
+        # order[cell_starts[i]:cell_starts[i + 1]]
+        self.order = array('i')
+        self.cell_keys = array('q')
+        self.cell_starts = array('i', [0])
+        # Ячейки деревьев, добавленных после сортировки: номер -> array id
+        self.recent = {}
+        self.recent_size = 0
+        self.size = 0
+        self.data_version = None
+        self.rewrites = None
+        self.last_tree_id = 0
+        self.last_status_id = 0
+
+    def species_code(self, species):
+        code = self.species_codes.get(species)
+        if code is None:
+            code = self.species_codes[species] = len(self.species_names)
+            self.species_names.append(species)
+        return code
+
+    def count(self, species, status, delta):
+        key = (species, status)
+        self.counts[key] = self.counts.get(key, 0) + delta
+
+    def add(self, tree_id, latitude, longitude, species, status, sorted_later=False):
+        """Добавление дерева (id растут, поэтому массивы только удлиняются)
+
+        sorted_later: дерево попадет в ячейки при следующей сортировке.
+        """
+        missing = tree_id + 1 - len(self.latitude)
+        if missing > 0:
+            self.latitude.extend([math.nan] * missing)
+            self.longitude.extend([math.nan] * missing)
+            self.species.extend([0] * missing)
+            self.status.extend([UNKNOWN_STATUS] * missing)
+
+        species = self.species_code(species)
+        status = status_code(status)
+        self.latitude[tree_id] = latitude
+        self.longitude[tree_id] = longitude
+        self.species[tree_id] = species
+        self.status[tree_id] = status
+        self.count(species, status, 1)
+        self.size += 1
+
+        if not sorted_later:
+            key = cell_key(latitude, longitude)
+            cell = self.recent.get(key)
+            if cell is None:
+                cell = self.recent[key] = array('i')
+            cell.append(tree_id)
+            self.recent_size += 1
+
+    def add_many(self, rows, sorted_later=False):
+        """Добавление пачки деревьев (id, широта, долгота, порода, состояние) по возрастанию id"""
+        start = len(self.latitude)
+        if not sorted_later or rows[0][0] != start or rows[-1][0] != start + len(rows) - 1:
+            for row in rows:
+                self.add(*row, sorted_later=sorted_later)
+            return
+
+        # id идут подряд с конца массивов: столбцы удлиняются целиком
+        _, latitudes, longitudes, species, statuses = zip(*rows)
+        species_code = self.species_code
+        species = [species_code(name) for name in species]
+        statuses = [STATUS_CODES.get(status, UNKNOWN_STATUS) for status in statuses]
+        self.latitude.extend(latitudes)
+        self.longitude.extend(longitudes)
+        self.species.extend(species)
+        self.status.extend(statuses)
+        for key, count in Counter(zip(species, statuses)).items():
+            self.count(*key, count)
+        self.size += len(rows)
+
+    def sort_cells(self):
+        """Сортировка id всех деревьев по ячейкам"""
+        # То же, что cell_key, без вызова функции на каждое дерево; NaN - пропуск в id
+        keys = array('q', (int((latitude + 90) * CELLS_PER_DEGREE) * CELLS_PER_ROW + int((longitude + 180) * CELLS_PER_DEGREE)
+                           if latitude == latitude else -1
+                           for latitude, longitude in zip(self.latitude, self.longitude)))
+        order = sorted((tree_id for tree_id, key in enumerate(keys) if key >= 0), key=keys.__getitem__)
+
+        cell_keys = array('q')
+        cell_starts = array('i')
+        previous = None
+        for position, tree_id in enumerate(order):
+            key = keys[tree_id]
+            if key != previous:
+                cell_keys.append(key)
+                cell_starts.append(position)
+                previous = key
+        cell_starts.append(len(order))
+
+        self.order = array('i', order)
+        self.cell_keys = cell_keys
+        self.cell_starts = cell_starts
+        self.recent = {}
+        self.recent_size = 0
+
+    def set_status(self, tree_id, status):
+        """Новое текущее состояние дерева"""
+        if tree_id >= len(self.status) or math.isnan(self.latitude[tree_id]):
+            return
+        old = self.status[tree_id]
+        new = status_code(status)
+        if old != new:
+            self.count(self.species[tree_id], old, -1)
+            self.count(self.species[tree_id], new, 1)
+            self.status[tree_id] = new
+
+    def sync(self, conn, data_version, rewrites, rebuild=False):
+        """Дочитать новые деревья и осмотры (rebuild - загрузка пустых столбцов целиком)"""
+        # Сначала граница осмотров, затем деревьев: деревья всех прочитанных осмотров уже есть
+        last_status_id, last_tree_id = conn.execute(LAST_IDS_SQL).fetchone()
+        last_status_id = last_status_id or 0
+        last_tree_id = last_tree_id or 0
+
+        # Кортежи вместо sqlite3.Row: при загрузке всей таблицы это заметно быстрее
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(SNAPSHOT_TREES_SQL, (self.last_tree_id, last_tree_id))
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            self.add_many(rows, rebuild)
+        if not rebuild:
+            for tree_id, status in cursor.execute(CHANGED_STATUSES_SQL, (self.last_status_id, last_status_id)):
+                self.set_status(tree_id, status)
+        if rebuild or self.recent_size > max(RECENT_MAX, self.size // 64):
+            self.sort_cells()
+
+        self.data_version = data_version
+        self.rewrites = rewrites
+        self.last_tree_id = max(self.last_tree_id, last_tree_id)
+        self.last_status_id = max(self.last_status_id, last_status_id)
+
+    def row_trees(self, cell_y, min_x, max_x):
+        """id деревьев в ячейках min_x..max_x строки cell_y"""
+        base = cell_y * CELLS_PER_ROW
+        first = bisect.bisect_left(self.cell_keys, base + min_x)
+        last = bisect.bisect_right(self.cell_keys, base + max_x)
+        trees = self.order[self.cell_starts[first]:self.cell_starts[last]]
+        if self.recent:
+            if max_x - min_x + 1 > len(self.recent):
+                keys = [key for key in self.recent if base + min_x <= key <= base + max_x]
+            else:
+                keys = range(base + min_x, base + max_x + 1)
+            for key in keys:
+                cell = self.recent.get(key)
+                if cell is not None:
+                    trees.extend(cell)
+        return trees
+
+    def cell_trees(self, cell_x, cell_y, statuses=None):
+        """id деревьев ячейки, при statuses - только в этих состояниях"""
+        trees = self.row_trees(cell_y, cell_x, cell_x)
+        if statuses is None:
+            return trees
+        status = self.status
+        return [tree_id for tree_id in trees if status[tree_id] in statuses]
+
+    def bbox_ids(self, bbox, limit=None):
+        """id деревьев в прямоугольной области (границы включаются)"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        min_x, min_y = cell_of(min_lat, min_lon)
+        max_x, max_y = cell_of(max_lat, max_lon)
+        # Строки сетки вне заполненной части пропускаются
+        if self.cell_keys:
+            min_y = max(min_y, self.cell_keys[0] // CELLS_PER_ROW)
+            max_y = min(max_y, self.cell_keys[-1] // CELLS_PER_ROW)
+        if self.recent:
+            min_y = min(min_y, min(self.recent) // CELLS_PER_ROW)
+            max_y = max(max_y, max(self.recent) // CELLS_PER_ROW)
+        latitude = self.latitude
+        longitude = self.longitude
+
+        found = []
+        for cell_y in range(min_y, max_y + 1):
+            for tree_id in self.row_trees(cell_y, min_x, max_x):
+                if min_lat <= latitude[tree_id] <= max_lat and min_lon <= longitude[tree_id] <= max_lon:
+                    found.append(tree_id)
+                    if limit is not None and len(found) >= limit:
+                        return found
+        return found
+
+    def row(self, tree_id):
+        """Дерево в виде словаря ответа: id, координаты, порода, состояние"""
+        status = self.status[tree_id]
+        return {
+            'id': tree_id,
+            'latitude': self.latitude[tree_id],
+            'longitude': self.longitude[tree_id],
+            'species': self.species_names[self.species[tree_id]],
+            'status': STATUSES[status] if status != UNKNOWN_STATUS else None,
+        }
+
+    def memory(self):
+        """Занятая столбцами память в байтах: столбцы и сетка ячеек"""
+        columns = sum(sys.getsizeof(column) for column in (self.latitude, self.longitude, self.species, self.status))
+        cells = sum(sys.getsizeof(column) for column in (self.order, self.cell_keys, self.cell_starts))
+        cells += sys.getsizeof(self.recent) + sum(sys.getsizeof(key) + sys.getsizeof(cell)
+                                                  for key, cell in self.recent.items())
+        names = sys.getsizeof(self.species_names) + sum(sys.getsizeof(name) for name in self.species_names)
+        return {'columns': columns, 'cells': cells, 'species_names': names}
+
+class TreeSnapshot:
+    """Текущие столбцы снимка, их перестроение и учет чтений
+
+    Новые деревья и осмотры дочитываются в текущие столбцы под блокировкой.
+    Перестроение (после изменения или удаления деревьев и истории) идет в
+    фоновом потоке без блокировки, готовые столбцы подменяют текущие одним
+    присваиванием. Пока оно идет, current_snapshot() возвращает None и
+    список со статистикой читаются из базы, а /api/trees/nearby отвечает из
+    прежних столбцов.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = SnapshotColumns()
+        self.builder = None
+        self.builds = 0
+        self.updates = 0
+        self.build_time = 0.0
+        self.reads = {}
+
+    @property
+    def ready(self):
+        """Снимок загружен хотя бы один раз"""
+        return self.data.data_version is not None
+
+    def refresh(self, wait=False):
+        """Догнать базу перед чтением: True, если столбцы соответствуют базе
+
+        Если нужно перестроение, оно запускается в фоне (wait - дождаться его).
+        """
+        conn = get_db_connection()
+        try:
+            data_version, rewrites = conn.execute(SNAPSHOT_VERSION_SQL).fetchone()
+            with self.lock:
+                data = self.data
+                if data.data_version == data_version:
+                    return True
+                if data.data_version is not None and data.rewrites == rewrites:
+                    data.sync(conn, data_version, rewrites)
+                    self.updates += 1
+                    return True
+                builder = self.builder
+                if builder is None:
+                    builder = self.builder = threading.Thread(target=self.rebuild, name='dendro-snapshot-build',
+                                                              daemon=True)
+                    builder.start()
+        finally:
+            conn.close()
+
+        if wait:
+            builder.join()
+        return False
+
+    def rebuild(self):
+        """Загрузка новых столбцов без блокировки и подмена текущих"""
+        try:
+            started = time.perf_counter()
+            conn = get_db_connection()
+            try:
+                data_version, rewrites = conn.execute(SNAPSHOT_VERSION_SQL).fetchone()
+                data = SnapshotColumns()
+                data.sync(conn, data_version, rewrites, rebuild=True)
+            finally:
+                conn.close()
+            with self.lock:
+                self.data = data
+                self.builds += 1
+                self.build_time = time.perf_counter() - started
+        finally:
+            with self.lock:
+                self.builder = None
+
+    def start(self):
+        """Загрузка снимка в фоне при запуске сервера"""
+        self.refresh()
+
+    def record_read(self, kind, seconds):
+        """Учет чтения из снимка для /api/debug/snapshot"""
+        reads, total = self.reads.get(kind, (0, 0.0))
+        self.reads[kind] = (reads + 1, total + seconds)
+
+    def iter_rows(self, bbox=None, limit=None):
+        """Деревья по одному, как /api/trees?fields=compact
+
+        Весь список выдается без блокировки из столбцов, взятых в начале
+        выдачи: дочитывание их только удлиняет, перестроение заменяет
+        другими, поэтому строки не смешиваются.
+        """
+        started = time.perf_counter()
+        if bbox:
+            with self.lock:
+                rows = [self.data.row(tree_id) for tree_id in self.data.bbox_ids(bbox, limit)]
+                self.record_read('bbox', time.perf_counter() - started)
+            yield from rows
+            return
+
+        with self.lock:
+            data = self.data
+            latitude, longitude, species, status, species_names = (
+                data.latitude, data.longitude, data.species, data.status, data.species_names)
+            end = min(data.last_tree_id + 1, len(latitude))
+        produced = 0
+        for tree_id in range(1, end):
+            if limit is not None and produced >= limit:
+                break
+            if not math.isnan(latitude[tree_id]):
+                produced += 1
+                code = status[tree_id]
+                yield {
+                    'id': tree_id,
+                    'latitude': latitude[tree_id],
+                    'longitude': longitude[tree_id],
+                    'species': species_names[species[tree_id]],
+                    'status': STATUSES[code] if code != UNKNOWN_STATUS else None,
+                }
+        with self.lock:
+            self.record_read('list', time.perf_counter() - started)
+
+    def stats_counts(self):
+        """Ненулевые счетчики как строки tree_stats: (порода, состояние, число)"""
+        started = time.perf_counter()
+        with self.lock:
+            data = self.data
+            rows = [
+                (data.species_names[species], STATUSES[status] if status != UNKNOWN_STATUS else STATS_NO_STATUS, count)
+                for (species, status), count in data.counts.items() if count
+            ]
+            self.record_read('stats', time.perf_counter() - started)
+        return rows
+
+    def memory(self):
+        """Занятая снимком память в байтах: столбцы и сетка ячеек"""
+        with self.lock:
+            return self.data.memory()
+
+    def stats(self):
+        """Размер снимка, время загрузки и чтения"""
+        memory = self.memory()
+        total = sum(memory.values())
+        with self.lock:
+            data = self.data
+            return {
+                'enabled': snapshot_enabled(),
+                'trees': data.size,
+                'cells': len(data.cell_keys),
+                'recent_trees': data.recent_size,
+                'cell_degrees': CELL_DEGREES,
+                'species': len(data.species_names),
+                'memory_bytes': dict(memory, total=total),
+                'bytes_per_tree': round(total / data.size, 1) if data.size else None,
+                'data_version': data.data_version,
+                'rebuilding': self.builder is not None,
+                'builds': self.builds,
+                'updates': self.updates,
+                'last_build_ms': round(self.build_time * 1000, 1),
+                'reads': {
+                    kind: {'count': reads, 'avg_ms': round(total_time / reads * 1000, 3)}
+                    for kind, (reads, total_time) in self.reads.items()
+                },
+            }
+
+tree_snapshot = TreeSnapshot()
+
+def current_snapshot():
+    """Снимок для ответа из памяти или None, если он выключен или еще загружается"""
+    if not snapshot_enabled() or not tree_snapshot.ready or not tree_snapshot.refresh():
+        return None
+    return tree_snapshot
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Загрузка снимка деревьев: время и занятая память')
+    parser.parse_args(argv)
+
+    tree_snapshot.refresh(wait=True)
+    stats = tree_snapshot.stats()
+    memory = stats['memory_bytes']
+    print(f"✅ Деревьев: {stats['trees']}, ячеек: {stats['cells']}, пород: {stats['species']}")
+    print(f"⏱️  Загрузка: {stats['last_build_ms'] / 1000:.2f} с")
+    print(f"💾 Память: {memory['total'] / 2**20:.1f} МБ "
+          f"(столбцы {memory['columns'] / 2**20:.1f} МБ, сетка {memory['cells'] / 2**20:.1f} МБ), "
+          f"{stats['bytes_per_tree']} байт на дерево")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Статистика деревьев: /api/stats
+
+Числа берутся из счетчиков tree_stats, которые триггеры обновляют при
+добавлении деревьев и записи осмотров (см. api/projections.py), поэтому
+запрос не пересчитывает деревья. При включенном снимке в памяти (см.
+api/snapshot.py) те же счетчики ведет снимок. Проверка и пересборка счетчиков:
+    python -m api.projections --check-stats
+    python -m api.projections --rebuild
+"""
+import os
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.db import get_db_connection
+from api.request import Response, run_cgi
+from api.snapshot import current_snapshot
+
+# Ненулевые счетчики: строк не больше, чем пар порода/состояние
+STATS_SQL = '''
+    SELECT species, status, tree_count FROM tree_stats
+    WHERE tree_count != 0
+'''
+
+def get_stats():
+    """Число деревьев всего, по состоянию, по породе и по породе и состоянию"""
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        rows = snapshot.stats_counts()
+    else:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(STATS_SQL).fetchall()
+        finally:
+            conn.close()
+
+    by_status = {}
+    by_species = {}
+    by_species_status = {}
+    for species, status, count in rows:
+        by_status[status] = by_status.get(status, 0) + count
+        by_species[species] = by_species.get(species, 0) + count
+        by_species_status.setdefault(species, {})[status] = count
+
+    return {
+        'total': sum(by_status.values()),
+        'by_status': by_status,
+        'by_species': by_species,
+        'by_species_status': by_species_status,
+    }
+
+def handle(request):
+    """Обработка запроса статистики: /api/stats"""
+    return Response(get_stats())
+
+if __name__ == '__main__':
+    run_cgi(handle)
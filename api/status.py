@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+from datetime import date
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import STATUSES
+from api.db import get_db_connection
+from api.request import Response, run_cgi
+from api.tiles import invalidate_point, invalidate_points
+
+# Текущее состояние дерева после записи
+CURRENT_STATUS_SQL = '''
+    SELECT tree_id, status_id, status, notes, date_recorded
+    FROM tree_current_status
+    WHERE tree_id = ?
+'''
+
+# Существующие деревья из списка id (JSON-массив) и их координаты для сброса тайлов
+EXISTING_TREES_SQL = '''
+    SELECT id, latitude, longitude FROM trees
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+# Текущие состояния деревьев из списка id (JSON-массив)
+CURRENT_STATUSES_SQL = '''
+    SELECT tree_id, status_id, status, notes, date_recorded
+    FROM tree_current_status
+    WHERE tree_id IN (SELECT value FROM json_each(?))
+'''
+
+INSERT_STATUS_SQL = '''
+    INSERT INTO tree_status (tree_id, status, notes, date_recorded, is_future_plan)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Больше записей за один запрос не принимаем
+MAX_BATCH_SIZE = 5000
+
+def add_status(status_data):
+    """Добавление записи осмотра в историю состояний дерева
+
+    Проверки те же, что у записей пачки (status_values).
+    """
+    try:
+        values = status_values(status_data)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+    tree_id = values[0]
+
+    conn = get_db_connection()
+    
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        tree = conn.execute(EXISTING_TREES_SQL, (json.dumps([tree_id]),)).fetchone()
+        if tree is None:
+            conn.rollback()
+            return {'success': False, 'error': 'Tree not found'}
+        status_id = conn.execute(INSERT_STATUS_SQL, values).lastrowid
+        conn.commit()
+        
+        # Текущее состояние обновлено триггером (см. api/projections.py)
+        current = conn.execute(CURRENT_STATUS_SQL, (tree_id,)).fetchone()
+        
+    except Exception as e:
+        conn.rollback()
+        return {'success': False, 'error': str(e)}
+        
+    finally:
+        conn.close()
+    
+    # Осмотр сохранен: сброс тайлов не меняет ответ (ошибки файлов пишутся в журнал)
+    invalidate_point(tree['latitude'], tree['longitude'])
+    
+    return {
+        'success': True,
+        'status_id': status_id,
+        'current_status': dict(current) if current else None
+    }
+
+def status_values(status_data):
+    """Значения записи осмотра для INSERT; ValueError с причиной"""
+    if not isinstance(status_data, dict):
+        raise ValueError('Entry must be an object')
+    if status_data.get('status') not in STATUSES:
+        raise ValueError(f"Unknown status: {status_data.get('status')}")
+    try:
+        tree_id = int(status_data['tree_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('tree_id must be an integer')
+
+    date_recorded = status_data.get('date_recorded') or date.today().isoformat()
+    try:
+        # Дата хранится как YYYY-MM-DD: иначе сортировка истории по строке неверна
+        date_recorded = date.fromisoformat(date_recorded).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError('date_recorded must be YYYY-MM-DD')
+
+    notes = status_data.get('notes', '')
+    if notes is not None and not isinstance(notes, str):
+        raise ValueError('notes must be a string')
+
+    return (
+        tree_id,
+        status_data['status'],
+        notes,
+        date_recorded,
+        1 if status_data.get('is_future_plan') else 0
+    )
+
+def add_statuses(entries):
+    """Запись осмотров пачкой в одной транзакции
+
+    Ошибочные записи пропускаются, остальные сохраняются; результат по
+    каждой записи возвращается в порядке запроса. Текущие состояния
+    затронутых деревьев читаются одним запросом после фиксации.
+    """
+    results = []
+    valid = []
+    for index, entry in enumerate(entries):
+        try:
+            valid.append((index, status_values(entry)))
+            results.append(None)
+        except ValueError as e:
+            results.append({'index': index, 'success': False, 'error': str(e)})
+
+    tree_ids = sorted({values[0] for _, values in valid})
+
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = {row['id']: (row['latitude'], row['longitude'])
+                        for row in conn.execute(EXISTING_TREES_SQL, (json.dumps(tree_ids),))}
+            for index, values in valid:
+                if values[0] not in existing:
+                    results[index] = {'index': index, 'success': False, 'error': 'Tree not found'}
+                    continue
+                cursor = conn.execute(INSERT_STATUS_SQL, values)
+                results[index] = {'index': index, 'success': True, 'status_id': cursor.lastrowid}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        current = conn.execute(CURRENT_STATUSES_SQL, (json.dumps(list(existing)),)).fetchall()
+    finally:
+        conn.close()
+
+    # Осмотры сохранены: сброс тайлов не меняет ответ
+    invalidate_points(list(existing.values()))
+
+    return {
+        'success': True,
+        'saved': sum(1 for result in results if result['success']),
+        'failed': sum(1 for result in results if not result['success']),
+        'results': results,
+        'current_statuses': [dict(row) for row in current],
+    }
+
+def handle(request):
+    """Обработка запроса на обновление состояния дерева
+
+    POST /api/status - одна запись осмотра,
+    POST /api/status/batch - список записей {"entries": [...]} или массив.
+    """
+    if request.method != 'POST':
+        return Response({'error': 'Only POST method allowed'})
+
+    data = request.json()
+    if not data:
+        return Response({'success': False, 'error': 'No data received'})
+
+    if request.path.rstrip('/').endswith('/batch'):
+        entries = data.get('entries') if isinstance(data, dict) else data
+        if not isinstance(entries, list):
+            return Response({'success': False, 'error': 'entries must be a list'}, status=400)
+        if len(entries) > MAX_BATCH_SIZE:
+            return Response({'success': False, 'error': f'At most {MAX_BATCH_SIZE} entries per batch'}, status=400)
+        try:
+            return Response(add_statuses(entries))
+        except Exception as e:
+            return Response({'success': False, 'error': str(e)})
+
+    return Response(add_status(data))
+
+if __name__ == '__main__':
+    run_cgi(handle)
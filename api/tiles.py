@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Тайлы z/x/y с деревьями для карт и экранов мониторинга
+
+Тайл - GeoJSON FeatureCollection: на крупных масштабах отдельные деревья
+с текущим состоянием, на мелких - кластеры из tree_clusters. Тайлы
+строятся по первому запросу и кэшируются в памяти (LRU) и на диске.
+Запись дерева или его состояния удаляет только тайлы, в которые попадает
+это дерево, на каждом масштабе. Файл на диске - источник истины: запись
+в памяти действительна, пока существует ее файл, поэтому удаление файла
+видно всем процессам сервера. Тайл, во время построения которого
+изменилась версия данных, не кэшируется.
+"""
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.cache import get_data_version
+from api.db import get_db_connection
+from api.clusters import CLUSTERS_SQL
+from api.projections import CLUSTER_MAX_ZOOM, CLUSTER_STATUS_COLUMNS, cluster_cell, cluster_scale
+from api.request import Response, run_cgi
+from api.trees import TREE_BBOX_SQL
+
+TILE_MAX_ZOOM = 18
+# С этого масштаба тайл содержит отдельные деревья, до него - кластеры
+TILE_POINTS_MIN_ZOOM = 14
+
+TILE_CACHE_DIR = os.environ.get(
+    'DENDRO_TILE_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'tiles')
+)
+TILE_MEMORY_ENTRIES = 2048
+
+# С этого числа измененных точек кэш тайлов сбрасывается целиком
+BULK_INVALIDATE_POINTS = 500
+
+TILE_CONTENT_TYPE = 'application/geo+json; charset=utf-8'
+# Внешний HTTP кэш может держать тайл не дольше минуты после изменения
+TILE_CACHE_CONTROL = 'public, max-age=60'
+
+def tile_bounds(z, x, y):
+    """Границы тайла (minLon, minLat, maxLon, maxLat) в проекции Web Mercator"""
+    n = 2 ** z
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return (x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y))
+
+def point_tile(z, latitude, longitude):
+    """Тайл, в который попадает точка"""
+    n = 2 ** z
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def contains(bounds, latitude, longitude):
+    """Точка внутри тайла: левая и верхняя граница включены, правая и нижняя нет"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return min_lon <= longitude < max_lon and min_lat < latitude <= max_lat
+
+def build_tile(z, x, y):
+    """Построение тайла из базы, возвращает закодированный GeoJSON"""
+    bounds = tile_bounds(z, x, y)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    features = []
+
+    conn = get_db_connection()
+    
+    try:
+        if z >= TILE_POINTS_MIN_ZOOM:
+            trees = conn.execute(TREE_BBOX_SQL, {
+                'min_lon': min_lon, 'min_lat': min_lat,
+                'max_lon': max_lon, 'max_lat': max_lat,
+                'limit': -1,
+            }).fetchall()
+            for tree in trees:
+                if not contains(bounds, tree['latitude'], tree['longitude']):
+                    continue
+                features.append({
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'Point',
+                        'coordinates': [round(tree['longitude'], 6), round(tree['latitude'], 6)]
+                    },
+                    'properties': {'id': tree['id'], 'species': tree['species'], 'status': tree['status']}
+                })
+        else:
+            # Ячейка кластера относится к тайлу, в котором лежит ее центр
+            cluster_zoom = min(z, CLUSTER_MAX_ZOOM)
+            min_x, min_y = cluster_cell(cluster_zoom, min_lat, min_lon)
+            max_x, max_y = cluster_cell(cluster_zoom, max_lat, max_lon)
+            cells = conn.execute(CLUSTERS_SQL, (cluster_zoom, min_x - 1, max_x + 1, min_y - 1, max_y + 1)).fetchall()
+            for cell in cells:
+                latitude = cell['lat_sum'] / cell['tree_count']
+                longitude = cell['lon_sum'] / cell['tree_count']
+                if not contains(bounds, latitude, longitude):
+                    continue
+                properties = {'count': cell['tree_count']}
+                properties.update({status: cell[status] for status in CLUSTER_STATUS_COLUMNS if cell[status]})
+                features.append({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [round(longitude, 6), round(latitude, 6)]},
+                    'properties': properties
+                })
+    finally:
+        conn.close()
+    
+    collection = {'type': 'FeatureCollection', 'features': features}
+    return json.dumps(collection, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class TileCache:
+    """Кэш тайлов: LRU в памяти поверх файлов на диске"""
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(x), f'{y}.json')
+
+    def get(self, z, x, y):
+        """Тайл из кэша или построенный заново"""
+        key = (z, x, y)
+        path = self.path(z, x, y)
+
+        with self.lock:
+            body = self.memory.get(key)
+            if body is not None and os.path.exists(path):
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return body
+
+        try:
+            with open(path, 'rb') as tile_file:
+                body = tile_file.read()
+            with self.lock:
+                self.disk_hits += 1
+        except FileNotFoundError:
+            # Запись, зафиксированная во время построения, могла удалить тайл раньше, чем
+            # он записан: такой тайл не кэшируется (версия данных меняется в той же транзакции)
+            version = get_data_version()
+            body = build_tile(z, x, y)
+            self.write_file(path, body)
+            with self.lock:
+                self.misses += 1
+            if get_data_version() != version:
+                self.discard_file(path)
+                return body
+
+        with self.lock:
+            self.memory[key] = body
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        return body
+
+    def write_file(self, path, body):
+        """Атомарная запись: читатели не увидят недописанный файл"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as tile_file:
+            tile_file.write(body)
+        os.replace(tmp_path, path)
+
+    def discard_file(self, path):
+        """Удаление файла тайла; ошибка файловой системы не прерывает записавший запрос"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"⚠️  Кэш тайлов: не удалось удалить {path}: {e}", file=sys.stderr)
+
+    def invalidate(self, z, x, y):
+        with self.lock:
+            self.memory.pop((z, x, y), None)
+        self.discard_file(self.path(z, x, y))
+
+    def clear(self):
+        """Сброс всего кэша"""
+        with self.lock:
+            self.memory.clear()
+        if os.path.isdir(self.directory):
+            # Переименование атомарно: новые запросы сразу строят тайлы заново
+            stale = f'{self.directory}.{os.getpid()}.{threading.get_ident()}.stale'
+            try:
+                os.replace(self.directory, stale)
+            except FileNotFoundError:
+                # Каталог уже переименовал параллельный сброс
+                return
+            except OSError as e:
+                print(f"⚠️  Кэш тайлов: не удалось сбросить {self.directory}: {e}", file=sys.stderr)
+                return
+            shutil.rmtree(stale, ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'memory_entries': len(self.memory),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+tile_cache = TileCache(TILE_CACHE_DIR, TILE_MEMORY_ENTRIES)
+
+def affected_tiles(latitude, longitude):
+    """Тайлы всех масштабов, содержимое которых зависит от дерева в этой точке"""
+    for z in range(TILE_MAX_ZOOM + 1):
+        if z >= TILE_POINTS_MIN_ZOOM:
+            yield (z,) + point_tile(z, latitude, longitude)
+            continue
+
+        # Центр ячейки кластера может оказаться в соседнем тайле: берем все тайлы ячейки
+        cluster_zoom = min(z, CLUSTER_MAX_ZOOM)
+        scale = cluster_scale(cluster_zoom)
+        cell_x, cell_y = cluster_cell(cluster_zoom, latitude, longitude)
+        min_x, max_y = point_tile(z, cell_y / scale - 90, cell_x / scale - 180)
+        max_x, min_y = point_tile(z, (cell_y + 1) / scale - 90, (cell_x + 1) / scale - 180)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                yield z, x, y
+
+def invalidate_point(latitude, longitude):
+    """Сброс тайлов, затронутых изменением дерева в точке"""
+    for z, x, y in affected_tiles(latitude, longitude):
+        tile_cache.invalidate(z, x, y)
+
+def invalidate_points(points):
+    """Сброс тайлов для множества точек (массовый импорт): каждый тайл один раз
+
+    Для больших пачек дешевле сбросить весь кэш, чем перебирать тайлы точек.
+    """
+    if len(points) > BULK_INVALIDATE_POINTS:
+        tile_cache.clear()
+        return
+
+    tiles = set()
+    for latitude, longitude in points:
+        tiles.update(affected_tiles(latitude, longitude))
+    for z, x, y in tiles:
+        tile_cache.invalidate(z, x, y)
+
+def handle(request):
+    """Обработка запроса тайла: /api/tiles/{z}/{x}/{y}"""
+    try:
+        z, x, y = (int(part) for part in request.path.rstrip('/').split('/')[-3:])
+    except ValueError:
+        return Response({'error': 'Tile path must be /api/tiles/{z}/{x}/{y}'}, status=400)
+
+    if not (0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return Response({'error': 'Tile out of range'}, status=404)
+
+    return Response(
+        raw=tile_cache.get(z, x, y),
+        content_type=TILE_CONTENT_TYPE,
+        headers={'Cache-Control': TILE_CACHE_CONTROL}
+    )
+
+if __name__ == '__main__':
+    run_cgi(handle)
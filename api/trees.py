@@ -1,140 +1,147 @@
 #!/usr/bin/env python3
-import sqlite3
-import json
 import os
-from http import cookies
-import cgi
-
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'database.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_database():
-    """Инициализация базы данных"""
+import sys
+
+if __package__ in (None, ''):
+    # Запуск как CGI-скрипт: делаем доступным пакет api
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.cache import get_data_comment_version, get_data_version
+from api.comments import COMMENTS_SQL
+from api.db import get_db_connection
+from api.migrations import init_database
+from api.pagination import DEFAULT_PAGE_SIZE, decode_cursor, is_paginated, page, parse_page_size
+from api.request import Response, json_array_stream, parse_bbox, run_cgi
+from api.snapshot import current_snapshot
+
+# Список деревьев с последним состоянием каждого (см. api/projections.py)
+TREE_LIST_SQL = '''
+    SELECT t.*, cs.status, cs.notes as status_notes
+    FROM trees t
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+'''
+
+# Деревья в прямоугольной области карты через R*Tree (LIMIT -1 - без ограничения).
+# R*Tree хранит координаты с округлением наружу, поэтому точная проверка повторяется.
+TREE_BBOX_SQL = '''
+    SELECT t.*, cs.status, cs.notes as status_notes
+    FROM trees_rtree r
+    JOIN trees t ON t.id = r.id
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    WHERE r.min_lon <= :max_lon AND r.max_lon >= :min_lon
+      AND r.min_lat <= :max_lat AND r.max_lat >= :min_lat
+      AND t.longitude BETWEEN :min_lon AND :max_lon
+      AND t.latitude BETWEEN :min_lat AND :max_lat
+    LIMIT :limit
+'''
+
+# Только столбцы снимка в памяти (fields=compact, см. api/snapshot.py)
+TREE_COMPACT_LIST_SQL = '''
+    SELECT t.id, t.latitude, t.longitude, t.species, cs.status
+    FROM trees t
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+'''
+
+TREE_COMPACT_BBOX_SQL = '''
+    SELECT t.id, t.latitude, t.longitude, t.species, cs.status
+    FROM trees_rtree r
+    JOIN trees t ON t.id = r.id
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    WHERE r.min_lon <= :max_lon AND r.max_lon >= :min_lon
+      AND r.min_lat <= :max_lat AND r.max_lat >= :min_lat
+      AND t.longitude BETWEEN :min_lon AND :max_lon
+      AND t.latitude BETWEEN :min_lat AND :max_lat
+    LIMIT :limit
+'''
+
+# Страница списка по возрастанию id после курсора (id последнего дерева)
+TREE_PAGE_SQL = '''
+    SELECT t.*, cs.status, cs.notes as status_notes
+    FROM trees t
+    LEFT JOIN tree_current_status cs ON cs.tree_id = t.id
+    WHERE t.id > ?
+    ORDER BY t.id
+    LIMIT ?
+'''
+
+TREE_SQL = '''
+    SELECT * FROM trees WHERE id = ?
+'''
+
+STATUS_HISTORY_SQL = '''
+    SELECT * FROM tree_status 
+    WHERE tree_id = ? 
+    ORDER BY date_recorded DESC
+'''
+
+# Строк за одно чтение из курсора при потоковой выдаче
+FETCH_SIZE = 1000
+
+def iter_trees(bbox=None, limit=None, compact=False):
+    """Деревья с текущим статусом по одному, без загрузки всего результата в память
+
+    compact: только id, координаты, порода и состояние; при включенном
+    снимке в памяти они читаются из него, а не из базы.
+    Подключение занято, пока генератор не исчерпан или не закрыт.
+    """
+    snapshot = current_snapshot() if compact else None
+    if snapshot is not None:
+        yield from snapshot.iter_rows(bbox, limit)
+        return
+
     conn = get_db_connection()
-    
-    # Создание таблиц
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS trees (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            species TEXT NOT NULL,
-            address TEXT,
-            diameter REAL,
-            height REAL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS tree_status (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tree_id INTEGER,
-            status TEXT NOT NULL,
-            notes TEXT,
-            date_recorded DATE DEFAULT CURRENT_DATE,
-            is_future_plan BOOLEAN DEFAULT 0,
-            FOREIGN KEY (tree_id) REFERENCES trees (id)
-        )
-    ''')
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tree_id INTEGER,
-            user_name TEXT,
-            text TEXT NOT NULL,
-            contact_email TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            is_reviewed BOOLEAN DEFAULT 0,
-            FOREIGN KEY (tree_id) REFERENCES trees (id)
-        )
-    ''')
-    
-    # Добавление тестовых данных, если таблицы пустые
-    cursor = conn.execute('SELECT COUNT(*) as count FROM trees')
-    if cursor.fetchone()['count'] == 0:
-        # Тестовые деревья
-        test_trees = [
-            (55.7558, 37.6176, 'Дуб', 'Красная площадь, 1', 85.5, 25.0),
-            (55.7520, 37.6175, 'Береза', 'ул. Тверская, 10', 45.2, 18.5),
-            (55.7500, 37.6200, 'Сосна', 'Парк Горького, центральная аллея', 92.1, 30.2),
-            (55.7490, 37.6150, 'Клен', 'ул. Большая Дмитровка, 15', 32.8, 12.3),
-            (55.7475, 37.6225, 'Липа', 'Чистопрудный бульвар', 68.7, 22.1)
-        ]
-        
-        for tree in test_trees:
-            conn.execute(
-                'INSERT INTO trees (latitude, longitude, species, address, diameter, height) VALUES (?, ?, ?, ?, ?, ?)',
-                tree
-            )
-        
-        # Тестовые статусы
-        test_statuses = [
-            (1, 'excellent', 'Дерево в отличном состоянии'),
-            (2, 'good', 'Небольшие повреждения коры'),
-            (3, 'satisfactory', 'Требуется санитарная обрезка'),
-            (4, 'poor', 'Признаки заболевания'),
-            (5, 'critical', 'Сильное повреждение ствола')
-        ]
-        
-        for status in test_statuses:
-            conn.execute(
-                'INSERT INTO tree_status (tree_id, status, notes) VALUES (?, ?, ?)',
-                status
-            )
-    
-    conn.commit()
-    conn.close()
+    try:
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            cursor = conn.execute(TREE_COMPACT_BBOX_SQL if compact else TREE_BBOX_SQL, {
+                'min_lon': min_lon, 'min_lat': min_lat,
+                'max_lon': max_lon, 'max_lat': max_lat,
+                'limit': limit if limit is not None else -1,
+            })
+        elif limit is not None:
+            cursor = conn.execute((TREE_COMPACT_LIST_SQL if compact else TREE_LIST_SQL) + ' LIMIT ?', (limit,))
+        else:
+            cursor = conn.execute(TREE_COMPACT_LIST_SQL if compact else TREE_LIST_SQL)
+
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        conn.close()
+
+def get_trees(bbox=None, limit=None, compact=False):
+    """Получение списка деревьев с их текущим статусом, всех или в области bbox"""
+    return list(iter_trees(bbox, limit, compact))
+
+def get_trees_page(cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Страница списка деревьев и курсор следующей"""
+    after_id = decode_cursor(cursor, 1)[0] if cursor else 0
 
-def get_trees():
-    """Получение списка всех деревьев с их текущим статусом"""
     conn = get_db_connection()
-    
-    trees = conn.execute('''
-        SELECT t.*, ts.status, ts.notes as status_notes
-        FROM trees t
-        LEFT JOIN tree_status ts ON t.id = ts.tree_id
-        WHERE ts.id = (
-            SELECT id FROM tree_status 
-            WHERE tree_id = t.id 
-            ORDER BY date_recorded DESC, id DESC 
-            LIMIT 1
-        )
-        OR ts.id IS NULL
-    ''').fetchall()
-    
-    conn.close()
-    
-    return [dict(tree) for tree in trees]
+    try:
+        rows = conn.execute(TREE_PAGE_SQL, (after_id, page_size + 1)).fetchall()
+    finally:
+        conn.close()
+
+    trees, next_cursor = page(rows, page_size, lambda tree: [tree['id']])
+    return {'trees': trees, 'next': next_cursor}
 
 def get_tree(tree_id):
     """Получение информации о конкретном дереве"""
     conn = get_db_connection()
     
-    tree = conn.execute('''
-        SELECT * FROM trees WHERE id = ?
-    ''', (tree_id,)).fetchone()
+    tree = conn.execute(TREE_SQL, (tree_id,)).fetchone()
     
     if not tree:
         conn.close()
         return None
     
-    status_history = conn.execute('''
-        SELECT * FROM tree_status 
-        WHERE tree_id = ? 
-        ORDER BY date_recorded DESC
-    ''', (tree_id,)).fetchall()
+    status_history = conn.execute(STATUS_HISTORY_SQL, (tree_id,)).fetchall()
     
-    comments = conn.execute('''
-        SELECT * FROM comments 
-        WHERE tree_id = ? AND is_reviewed = 1
-        ORDER BY created_at DESC
-    ''', (tree_id,)).fetchall()
+    comments = conn.execute(COMMENTS_SQL, (tree_id,)).fetchall()
     
     conn.close()
     
@@ -144,38 +151,66 @@ def get_tree(tree_id):
         'comments': [dict(comment) for comment in comments]
     }
 
-def main():
-    """Основная функция обработки запросов"""
-    # Инициализация базы данных
-    init_database()
-    
-    # Получение параметров запроса
-    import cgi
-    field_storage = cgi.FieldStorage()
-    tree_id = field_storage.getvalue('id')
-    
-    # Установка заголовков для CORS и JSON
-    print("Content-Type: application/json; charset=utf-8")
-    print("Access-Control-Allow-Origin: *")
-    print("Access-Control-Allow-Methods: GET, POST, OPTIONS")
-    print("Access-Control-Allow-Headers: Content-Type")
-    print()
-    
+def cache_version(request):
+    """Версия для кэша ответов: карточка дерева включает его комментарии"""
+    tree_id = request.param('id')
+    if tree_id and tree_id.isdigit():
+        return get_data_comment_version(int(tree_id))
+    return get_data_version()
+
+def metrics_route(request):
+    """Маршрут в метриках: карточка дерева отдельно от списка"""
+    return '/api/trees?id=' if request.param('id') else '/api/trees'
+
+def handle(request):
+    """Обработка запроса к деревьям"""
+    tree_id = request.param('id')
+
     try:
         if tree_id:
             # Запрос конкретного дерева
             tree_data = get_tree(int(tree_id))
             if tree_data:
-                print(json.dumps(tree_data, ensure_ascii=False))
-            else:
-                print(json.dumps({'error': 'Tree not found'}, ensure_ascii=False))
-        else:
-            # Запрос всех деревьев
-            trees = get_trees()
-            print(json.dumps(trees, ensure_ascii=False))
-            
+                return Response(tree_data)
+            return Response({'error': 'Tree not found'})
+
+        # fields=compact: только id, координаты, порода и состояние (для карты)
+        fields = request.param('fields')
+        if fields not in (None, 'compact'):
+            return Response({'error': 'fields must be compact'}, status=400)
+        compact = fields == 'compact'
+
+        # Постраничный список: ?page_size=...&cursor=...
+        if is_paginated(request):
+            if request.param('bbox'):
+                return Response({'error': 'cursor pagination is not supported with bbox'}, status=400)
+            if compact:
+                return Response({'error': 'cursor pagination is not supported with fields=compact'}, status=400)
+            try:
+                return Response(get_trees_page(request.param('cursor'), parse_page_size(request)))
+            except ValueError as e:
+                return Response({'error': str(e)}, status=400)
+
+        # Запрос деревьев: всех или в видимой области карты
+        try:
+            bbox = parse_bbox(request.param('bbox')) if request.param('bbox') else None
+            limit = int(request.param('limit')) if request.param('limit') else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        
+        if limit is None:
+            # Весь список: кодируется и отправляется по мере чтения из базы
+            return Response(stream=json_array_stream(iter_trees(bbox, compact=compact)))
+        return Response(get_trees(bbox, limit, compact))
+
     except Exception as e:
-        print(json.dumps({'error': str(e)}, ensure_ascii=False))
+        return Response({'error': str(e)})
+
+def main():
+    """Основная функция обработки запросов"""
+    # Инициализация базы данных
+    init_database()
+    run_cgi(handle)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
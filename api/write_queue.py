@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Очередь записи с групповой фиксацией (group commit)
+
+Запросы не пишут в базу сами: они ставят вставку в очередь и ждут.
+Единственный поток-писатель собирает вставки в пачку, пока не наберется
+max_batch записей или не пройдет max_delay с первой, и фиксирует всю
+пачку одной транзакцией (один fsync на пачку). После фиксации каждый
+отправитель получает id своей строки.
+
+Ответ отправителю совпадает с базой: по истечении ожидания вставка
+отменяется, если писатель еще не взял ее в пачку, а если пачка уже
+фиксируется - отправитель дожидается ее результата.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from api.db import get_pool
+
+WRITE_BATCH_SIZE = int(os.environ.get('DENDRO_WRITE_BATCH', 256))
+WRITE_DELAY = float(os.environ.get('DENDRO_WRITE_DELAY_MS', 2)) / 1000
+
+# Очередь ограничена: при перегрузке отправитель получает ошибку, а не ждет бесконечно
+WRITE_QUEUE_SIZE = 10000
+WRITE_TIMEOUT = 10.0
+
+class PendingWrite:
+    """Вставка в очереди: SQL, параметры и результат после фиксации"""
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.queued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.rowid = None
+        self.error = None
+        # Под блокировкой очереди: писатель взял вставку в пачку / отправитель отказался ждать
+        self.claimed = False
+        self.cancelled = False
+
+class GroupCommitQueue:
+    """Очередь вставок с одним потоком-писателем"""
+
+    def __init__(self, name, max_batch=WRITE_BATCH_SIZE, max_delay=WRITE_DELAY, max_pending=WRITE_QUEUE_SIZE):
+        self.name = name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.writer = None
+
+        # Счетчики для /api/debug/writes
+        self.submitted = 0
+        self.committed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.commit_time = 0.0
+        self.max_commit_time = 0.0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def start(self):
+        """Запуск потока-писателя при первой записи или вместо завершившегося с ошибкой"""
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self.writer_loop, name=f'dendro-writer-{self.name}',
+                                               daemon=True)
+                self.writer.start()
+
+    def submit(self, sql, params, timeout=WRITE_TIMEOUT):
+        """Вставка через очередь; возвращает rowid после фиксации пачки"""
+        self.start()
+        item = PendingWrite(sql, params)
+        try:
+            self.pending.put(item, timeout=timeout)
+        except queue.Full:
+            raise sqlite3.OperationalError('write queue is full')
+        with self.lock:
+            self.submitted += 1
+
+        if not item.done.wait(timeout):
+            with self.lock:
+                if not item.claimed:
+                    # Писатель пропустит отмененную вставку: ошибка означает, что строки нет
+                    item.cancelled = True
+                    self.cancelled += 1
+                    raise sqlite3.OperationalError('write queue timeout')
+            # Пачка уже фиксируется: ждем ее результата, чтобы ответ совпал с базой
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.rowid
+
+    def writer_loop(self):
+        """Поток-писатель: собирает пачки и фиксирует их, пока не получит None"""
+        conn = get_pool().connect()
+        # Подтверждение означает, что запись на диске: fsync на каждую фиксацию,
+        # который делится на всю пачку
+        conn.execute('PRAGMA synchronous = FULL')
+        try:
+            stopping = False
+            while not stopping:
+                item = self.pending.get()
+                if item is None:
+                    break
+
+                batch = [item]
+                deadline = time.perf_counter() + self.max_delay
+                while len(batch) < self.max_batch:
+                    # После истечения задержки забираем только то, что уже в очереди
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        if remaining > 0:
+                            item = self.pending.get(timeout=remaining)
+                        else:
+                            item = self.pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                try:
+                    self.commit_batch(conn, batch)
+                except Exception as e:
+                    # Непредвиденная ошибка не останавливает писателя и не оставляет отправителей ждать
+                    if conn.in_transaction:
+                        conn.rollback()
+                    for item in batch:
+                        item.rowid = None
+                        item.error = e
+                        item.done.set()
+        finally:
+            conn.dispose()
+
+    def commit_batch(self, conn, batch):
+        """Фиксация пачки одной транзакцией; ошибка строки не отменяет остальные"""
+        with self.lock:
+            batch = [item for item in batch if not item.cancelled]
+            for item in batch:
+                item.claimed = True
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for item in batch:
+                conn.execute('SAVEPOINT pending_write')
+                try:
+                    item.rowid = conn.execute(item.sql, item.params).lastrowid
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO pending_write')
+                    item.error = e
+                conn.execute('RELEASE pending_write')
+            conn.commit()
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for item in batch:
+                item.rowid = None
+                item.error = e
+
+        finished = time.perf_counter()
+        elapsed = finished - started
+        failed = sum(1 for item in batch if item.error is not None)
+        with self.lock:
+            self.batches += 1
+            self.committed += len(batch) - failed
+            self.failed += failed
+            self.last_batch_size = len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.commit_time += elapsed
+            self.max_commit_time = max(self.max_commit_time, elapsed)
+            for item in batch:
+                waited = finished - item.queued_at
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+        for item in batch:
+            item.done.set()
+
+    def stop(self, timeout=WRITE_TIMEOUT):
+        """Фиксация оставшихся в очереди записей и остановка писателя"""
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer is not None:
+            self.pending.put(None)
+            writer.join(timeout)
+
+    def stats(self):
+        """Глубина очереди, размер пачек и время фиксации"""
+        with self.lock:
+            done = self.committed + self.failed
+            return {
+                'queue_depth': self.pending.qsize(),
+                'max_batch': self.max_batch,
+                'max_delay_ms': round(self.max_delay * 1000, 3),
+                'submitted': self.submitted,
+                'committed': self.committed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'batches': self.batches,
+                'avg_batch_size': round(done / self.batches, 2) if self.batches else None,
+                'last_batch_size': self.last_batch_size,
+                'max_batch_size': self.max_batch_size,
+                'avg_commit_ms': round(self.commit_time / self.batches * 1000, 3) if self.batches else None,
+                'max_commit_ms': round(self.max_commit_time * 1000, 3),
+                'avg_ack_ms': round(self.wait_time / done * 1000, 3) if done else None,
+                'max_ack_ms': round(self.max_wait_time * 1000, 3),
+            }
+
+comment_writes = GroupCommitQueue('comments')
+
+# Все очереди процесса: для статистики и остановки сервера
+WRITE_QUEUES = {
+    'comments': comment_writes,
+}
+
+def stop_write_queues():
+    """Фиксация всех очередей перед завершением процесса"""
+    for write_queue in WRITE_QUEUES.values():
+        write_queue.stop()
+
+def write_queue_stats():
+    """Статистика всех очередей записи"""
+    return {name: write_queue.stats() for name, write_queue in WRITE_QUEUES.items()}
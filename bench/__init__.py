@@ -0,0 +1 @@
+"""Бенчмарки сервера ДендроМонитор"""
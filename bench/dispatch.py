@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Сравнение пропускной способности API: вызов в процессе против CGI-subprocess
+
+Запуск из корня проекта:
+    python -m bench.dispatch --requests 200
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def prepare_database():
+    """Копия базы данных во временную папку, чтобы не портить рабочую"""
+    tmp_dir = tempfile.mkdtemp(prefix='dendro-bench-')
+    db_path = os.path.join(tmp_dir, 'database.db')
+    shutil.copy(os.path.join(ROOT, 'data', 'database.db'), db_path)
+    os.environ['DENDRO_DB'] = db_path
+    return tmp_dir
+
+def start_server(use_cgi):
+    """Запуск сервера в отдельном потоке на свободном порту"""
+    import socketserver
+    import server
+
+    server.DendroMonitorHTTPRequestHandler.use_cgi = use_cgi
+    httpd = socketserver.TCPServer(('127.0.0.1', 0), server.DendroMonitorHTTPRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+def run_scenario(port, method, path, body, requests):
+    """Последовательная отправка запросов, возвращает число запросов в секунду"""
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8') if body else None
+    headers = {'Content-Type': 'application/json'} if payload else {}
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request(method, path, body=payload, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f'{method} {path}: HTTP {response.status}')
+        conn.close()
+    elapsed = time.perf_counter() - started
+    return requests / elapsed
+
+SCENARIOS = [
+    ('GET', '/api/trees.py', None),
+    ('GET', '/api/comments.py?tree_id=1', None),
+    ('POST', '/api/add_tree.py', {
+        'latitude': 55.75, 'longitude': 37.62, 'species': 'Липа',
+        'address': 'Бенчмарк', 'status': 'good', 'notes': '',
+    }),
+    ('POST', '/api/comments.py', {
+        'tree_id': 1, 'user_name': 'bench', 'text': 'Проверка', 'contact_email': '',
+    }),
+]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк диспетчеризации API')
+    parser.add_argument('--requests', type=int, default=100, help='запросов на сценарий')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    tmp_dir = prepare_database()
+
+    try:
+        from api import trees
+        trees.init_database()
+
+        results = {}
+        for mode, use_cgi in (('cgi', True), ('inprocess', False)):
+            httpd = start_server(use_cgi)
+            port = httpd.server_address[1]
+            try:
+                for method, path, body in SCENARIOS:
+                    rps = run_scenario(port, method, path, body, args.requests)
+                    results.setdefault(f'{method} {path}', {})[mode] = rps
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+
+        print(f"{'Сценарий':<36} {'CGI, req/s':>12} {'в процессе, req/s':>18} {'ускорение':>10}")
+        for name, row in results.items():
+            print(f"{name:<36} {row['cgi']:>12.1f} {row['inprocess']:>18.1f} "
+                  f"{row['inprocess'] / row['cgi']:>9.1f}x")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
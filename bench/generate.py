@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""Синтетическая база города для нагрузочных тестов
+
+Запуск из корня проекта:
+    python -m bench.generate --trees 1000000 --statuses 10000000 --comments 2000000 --output data/bench.db
+
+Деревья стоят рядами вдоль улиц (с обеих сторон, с разбросом в
+несколько метров) и группами в парках; улицы и парки гуще к центру
+города. У каждого дерева своя глубина истории осмотров: состояние
+меняется по цепочке (чаще остается прежним, иногда ухудшается, реже
+улучшается после ухода). Комментарии распределены неравномерно: у
+немногих деревьев их много; часть комментариев ждет модерации.
+
+Строки вставляются пачками без триггеров, затем триггеры создаются
+заново, а производные данные (текущее состояние, R*Tree, кластеры,
+статистика, поиск) пересобираются функциями api/projections.py.
+Один и тот же --seed дает одну и ту же базу.
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api import STATUSES
+from api.migrations import migrate
+from api.projections import (rebuild_current_status, rebuild_search_index, rebuild_tree_clusters,
+                             rebuild_tree_rtree, rebuild_tree_stats)
+
+# Строк в одной пачке executemany
+INSERT_BATCH = 50000
+
+METERS_PER_DEGREE = 111320.0
+
+# Порода: (доля, средний диаметр в см, средняя высота в м)
+SPECIES = {
+    'Липа': (0.24, 38, 16),
+    'Клен': (0.16, 32, 13),
+    'Береза': (0.14, 30, 18),
+    'Тополь': (0.12, 55, 22),
+    'Ясень': (0.08, 34, 17),
+    'Дуб': (0.06, 48, 19),
+    'Вяз': (0.05, 36, 15),
+    'Каштан': (0.04, 40, 14),
+    'Рябина': (0.04, 16, 7),
+    'Ель': (0.04, 28, 20),
+    'Сосна': (0.03, 30, 21),
+}
+
+STREET_NAMES = ('Тверская', 'Садовая', 'Лесная', 'Парковая', 'Школьная', 'Садово-Кудринская', 'Мира',
+                'Гагарина', 'Пушкинская', 'Советская', 'Набережная', 'Заводская', 'Речная', 'Полевая',
+                'Северная', 'Южная', 'Весенняя', 'Молодежная', 'Вокзальная', 'Озерная', 'Липовая',
+                'Кленовая', 'Березовая', 'Солнечная', 'Центральная', 'Новая', 'Луговая', 'Цветочная')
+STREET_TYPES = ('ул.', 'ул.', 'ул.', 'просп.', 'бул.', 'пер.', 'ш.')
+PARK_NAMES = ('Парк Победы', 'Городской сад', 'Сквер у фонтана', 'Парк Дружбы', 'Березовая роща',
+              'Сквер Строителей', 'Парк Культуры', 'Лесопарк', 'Сквер Памяти', 'Ботанический сад')
+
+# Доли начального состояния при первом осмотре
+INITIAL_STATUS_WEIGHTS = (0.25, 0.45, 0.2, 0.08, 0.02)
+# Переход между осмотрами: без изменений, на ступень хуже, на ступень лучше
+STATUS_STEPS = (0, 1, -1)
+STATUS_STEP_WEIGHTS = (0.78, 0.12, 0.1)
+
+STATUS_NOTES = ('Сухие ветви в кроне', 'Повреждение коры', 'Наклон ствола', 'Дупло у основания',
+                'Проведена обрезка', 'Обработка от вредителей', 'Трещина в стволе', 'Опасное дерево',
+                'Рекомендован осмотр арбориста', 'Прикорневая поросль', 'Грибы на стволе')
+NOTES_SHARE = 0.12
+
+COMMENT_TEXTS = ('Красивое дерево, спасибо за уход', 'Ветка висит над тротуаром', 'Дерево засыхает',
+                 'Около дерева появились грибы', 'Кору повредили при парковке', 'Просим обрезать крону',
+                 'Дерево наклонилось после урагана', 'Листья желтеют раньше времени',
+                 'Под деревом свалка мусора', 'Спасибо за новые посадки', 'Дупло в стволе',
+                 'Корни поднимают асфальт')
+USER_NAMES = ('Анна', 'Иван', 'Мария', 'Сергей', 'Ольга', 'Дмитрий', 'Елена', 'Аноним', 'Житель',
+              'Татьяна', 'Алексей', 'Наталья')
+# Доля комментариев, еще не прошедших модерацию
+PENDING_SHARE = 0.1
+
+def cumulative(weights):
+    return list(itertools.accumulate(weights))
+
+def pick(rng, items, cum_weights):
+    """Выбор по накопленным весам (быстрее random.choices для одного элемента)"""
+    return items[bisect.bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+class City:
+    """Улицы и парки вокруг центра: отрезки и круги в метрах от центра"""
+
+    def __init__(self, rng, latitude, longitude, radius_km, tree_count):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.lon_meters = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+        radius = radius_km * 1000
+
+        # Около 150 деревьев на улицу; районы ближе к центру плотнее (нормальное распределение)
+        street_count = max(1, tree_count // 150)
+        self.streets = []
+        for index in range(street_count):
+            x, y = (rng.gauss(0, radius / 2.5) for _ in range(2))
+            angle = rng.uniform(0, math.pi)
+            length = rng.uniform(300, 3000)
+            name = STREET_NAMES[index % len(STREET_NAMES)]
+            kind = STREET_TYPES[(index // len(STREET_NAMES)) % len(STREET_TYPES)]
+            number = index // (len(STREET_NAMES) * len(STREET_TYPES))
+            title = f'{kind} {name}' if number == 0 else f'{kind} {number + 1}-я {name}'
+            self.streets.append((x, y, math.cos(angle) * length, math.sin(angle) * length, length, title))
+        self.street_weights = cumulative(street[4] for street in self.streets)
+
+        park_count = max(1, street_count // 20)
+        self.parks = []
+        for index in range(park_count):
+            name = PARK_NAMES[index % len(PARK_NAMES)]
+            number = index // len(PARK_NAMES)
+            self.parks.append((rng.gauss(0, radius / 2), rng.gauss(0, radius / 2), rng.uniform(80, 400),
+                               name if number == 0 else f'{name} №{number + 1}'))
+
+    def place(self, rng):
+        """Координаты и адрес очередного дерева: 80% вдоль улиц, 20% в парках"""
+        if rng.random() < 0.8:
+            x, y, dx, dy, length, title = pick(rng, self.streets, self.street_weights)
+            position = rng.random()
+            # Ряд по одной из сторон улицы, 8-12 м от оси
+            side = (1 if rng.random() < 0.5 else -1) * rng.uniform(8, 12)
+            x += dx * position - dy / length * side
+            y += dy * position + dx / length * side
+            address = f'{title}, {int(position * length / 40) * 2 + (1 if side > 0 else 2)}'
+        else:
+            x, y, radius, address = rng.choice(self.parks)
+            x += rng.gauss(0, radius / 2)
+            y += rng.gauss(0, radius / 2)
+        return self.latitude + y / METERS_PER_DEGREE, self.longitude + x / self.lon_meters, address
+
+def history_lengths(rng, tree_count, status_count):
+    """Число осмотров каждого дерева: в среднем status_count / tree_count, с большим разбросом"""
+    mean = status_count / tree_count
+    lengths = [min(int(rng.expovariate(1 / mean) + 0.5), int(mean * 6) + 1) for _ in range(tree_count)]
+    # Подгонка суммы к status_count: недостающие и лишние осмотры распределяются случайно
+    difference = status_count - sum(lengths)
+    while difference:
+        tree = rng.randrange(tree_count)
+        if difference > 0:
+            lengths[tree] += 1
+            difference -= 1
+        elif lengths[tree] > 0:
+            lengths[tree] -= 1
+            difference += 1
+    return lengths
+
+def insert_batches(conn, sql, rows):
+    """Вставка строк пачками, возвращает число строк"""
+    count = 0
+    while True:
+        batch = list(itertools.islice(rows, INSERT_BATCH))
+        if not batch:
+            return count
+        conn.executemany(sql, batch)
+        count += len(batch)
+
+def generate(conn, trees, statuses, comments, years, latitude, longitude, radius_km, seed, progress=print):
+    """Заполнение пустой базы: деревья, история осмотров и комментарии"""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    first_day = today.toordinal() - int(years * 365)
+    days = today.toordinal() - first_day
+    dates = [datetime.date.fromordinal(first_day + day).isoformat() for day in range(days + 1)]
+
+    city = City(rng, latitude, longitude, radius_km, trees)
+    species_names = list(SPECIES)
+    species_weights = cumulative(SPECIES[name][0] for name in species_names)
+    statuses_weights = cumulative(INITIAL_STATUS_WEIGHTS)
+    step_weights = cumulative(STATUS_STEP_WEIGHTS)
+    lengths = history_lengths(rng, trees, statuses)
+    # День появления дерева в реестре: раньше - для деревьев с длинной историей
+    registered = [rng.randrange(0, max(1, days - length * 30)) if length else rng.randrange(days)
+                  for length in lengths]
+
+    def tree_rows():
+        for tree_id in range(1, trees + 1):
+            tree_latitude, tree_longitude, address = city.place(rng)
+            species = pick(rng, species_names, species_weights)
+            _, diameter, height = SPECIES[species]
+            size = rng.uniform(0.5, 1.5)
+            yield (tree_id, round(tree_latitude, 7), round(tree_longitude, 7), species, address,
+                   round(diameter * size, 1), round(height * size, 1), dates[registered[tree_id - 1]] + ' 09:00:00')
+
+    def status_rows():
+        for tree_id in range(1, trees + 1):
+            length = lengths[tree_id - 1]
+            if not length:
+                continue
+            day = registered[tree_id - 1]
+            # Осмотры от регистрации до сегодня через случайные промежутки
+            gap = max(1, (days - day) // length)
+            level = bisect.bisect(statuses_weights, rng.random())
+            for _ in range(length):
+                notes = rng.choice(STATUS_NOTES) if rng.random() < NOTES_SHARE else ''
+                yield tree_id, STATUSES[level], notes, dates[min(day, days)]
+                day += rng.randint(1, 2 * gap - 1) if gap > 1 else 1
+                level = min(max(level + pick(rng, STATUS_STEPS, step_weights), 0), len(STATUSES) - 1)
+
+    def comment_rows():
+        # Популярность дерева: у немногих деревьев большая часть комментариев (распределение Парето)
+        popular = [rng.randint(1, trees) for _ in range(max(1, trees // 50))]
+        for _ in range(comments):
+            tree_id = popular[int(len(popular) * rng.random() ** 1.5)] if rng.random() < 0.5 \
+                else rng.randint(1, trees)
+            day = rng.randint(registered[tree_id - 1], days)
+            created_at = f'{dates[day]} {rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}'
+            reviewed = 0 if rng.random() < PENDING_SHARE else 1
+            yield (tree_id, rng.choice(USER_NAMES), rng.choice(COMMENT_TEXTS), '', created_at, reviewed)
+
+    started = time.perf_counter()
+    count = insert_batches(conn, '''
+        INSERT INTO trees (id, latitude, longitude, species, address, diameter, height, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', tree_rows())
+    progress(f"🌳 Деревьев: {count} ({time.perf_counter() - started:.1f} с)")
+
+    started = time.perf_counter()
+    count = insert_batches(conn, '''
+        INSERT INTO tree_status (tree_id, status, notes, date_recorded) VALUES (?, ?, ?, ?)
+    ''', status_rows())
+    progress(f"🩺 Осмотров: {count} ({time.perf_counter() - started:.1f} с)")
+
+    started = time.perf_counter()
+    count = insert_batches(conn, '''
+        INSERT INTO comments (tree_id, user_name, text, contact_email, created_at, is_reviewed)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', comment_rows())
+    progress(f"💬 Комментариев: {count} ({time.perf_counter() - started:.1f} с)")
+
+def drop_triggers(conn):
+    """Удаление триггеров на время загрузки, возвращает их SQL для восстановления"""
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    return [sql for _, sql in triggers]
+
+def rebuild_projections(conn, progress=print):
+    """Пересборка производных данных после загрузки без триггеров"""
+    for title, rebuild in (('текущее состояние', rebuild_current_status), ('R*Tree', rebuild_tree_rtree),
+                           ('кластеры', rebuild_tree_clusters), ('статистика', rebuild_tree_stats),
+                           ('поисковый индекс', rebuild_search_index)):
+        started = time.perf_counter()
+        count = rebuild(conn)
+        progress(f"🔧 {title}: {count} ({time.perf_counter() - started:.1f} с)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Синтетическая база города для бенчмарков')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'data', 'bench.db'), help='файл новой базы')
+    parser.add_argument('--force', action='store_true', help='перезаписать существующий файл')
+    parser.add_argument('--trees', type=int, default=100000, help='число деревьев')
+    parser.add_argument('--statuses', type=int, default=None, help='число осмотров (по умолчанию 10 на дерево)')
+    parser.add_argument('--comments', type=int, default=None,
+                        help='число комментариев (по умолчанию 2 на дерево)')
+    parser.add_argument('--years', type=float, default=10, help='глубина истории в годах')
+    parser.add_argument('--center', default='55.7558,37.6173', help='центр города: широта,долгота')
+    parser.add_argument('--radius-km', type=float, default=15, help='радиус города в км')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора случайных чисел')
+    args = parser.parse_args(argv)
+
+    if args.trees < 1:
+        parser.error('--trees must be positive')
+    statuses = args.trees * 10 if args.statuses is None else args.statuses
+    comments = args.trees * 2 if args.comments is None else args.comments
+    latitude, longitude = (float(value) for value in args.center.split(','))
+
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"❌ Файл {args.output} уже существует (--force для перезаписи)")
+            sys.exit(1)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.output)
+    try:
+        migrate(conn)
+        # Файл создается заново: при сбое загрузку проще повторить, чем вести журнал
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = -262144')
+
+        conn.execute('BEGIN')
+        triggers = drop_triggers(conn)
+        generate(conn, args.trees, statuses, comments, args.years, latitude, longitude, args.radius_km, args.seed)
+        for sql in triggers:
+            conn.execute(sql)
+        rebuild_projections(conn)
+        conn.commit()
+
+        conn.execute('PRAGMA journal_mode = WAL')
+    finally:
+        conn.close()
+
+    size_mb = os.path.getsize(args.output) / 1024 / 1024
+    print(f"✅ База {args.output}: {size_mb:.0f} МБ за {time.perf_counter() - started:.1f} с")
+    print(f"   сервер: DENDRO_DB={args.output} python server.py")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""Нагрузочный тест API: пропускная способность и задержки при постоянной конкурентности
+
+Запуск из корня проекта на синтетической базе (см. bench/generate.py):
+    python -m bench.load --db data/bench.db --concurrency 1,8,32 --duration 10
+
+Без --url сервер server.py запускается отдельным процессом на свободном
+порту с базой --db; с --url нагружается уже запущенный сервер. Каждый
+сценарий выполняется отдельно: concurrency потоков отправляют запросы
+без пауз, первые --warmup секунд не учитываются. Результат - JSON с
+коммитом, параметрами и для каждого сценария и конкурентности: запросы в
+секунду, задержки p50/p95/p99/max, ошибки и байты. --compare сравнивает
+с прошлым JSON.
+
+Сценарии записи (add_comment, add_status) меняют базу, поэтому
+по умолчанию не выполняются.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+METERS_PER_DEGREE = 111320.0
+
+class Target:
+    """Параметры данных для построения запросов: центр города и диапазон id деревьев"""
+
+    def __init__(self, latitude, longitude, radius_km, max_tree_id):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_km = radius_km
+        self.max_tree_id = max_tree_id
+
+    def point(self, rng):
+        """Случайная точка города, ближе к центру чаще (как деревья в bench/generate.py)"""
+        sigma = self.radius_km * 1000 / 2.5
+        latitude = self.latitude + rng.gauss(0, sigma) / METERS_PER_DEGREE
+        longitude = self.longitude + rng.gauss(0, sigma) / (METERS_PER_DEGREE * math.cos(math.radians(self.latitude)))
+        return latitude, longitude
+
+    def bbox(self, rng, size_m):
+        """Область карты size_m x size_m вокруг случайной точки"""
+        latitude, longitude = self.point(rng)
+        lat_span = size_m / 2 / METERS_PER_DEGREE
+        lon_span = lat_span / math.cos(math.radians(latitude))
+        return f'{longitude - lon_span:.6f},{latitude - lat_span:.6f},{longitude + lon_span:.6f},{latitude + lat_span:.6f}'
+
+    def tile(self, rng, zoom):
+        latitude, longitude = self.point(rng)
+        n = 2 ** zoom
+        x = int((longitude + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+        return zoom, x, y
+
+    def tree_id(self, rng):
+        return rng.randint(1, self.max_tree_id)
+
+def get(path, params=None):
+    return 'GET', path + ('?' + urlencode(params) if params else ''), None
+
+# Сценарий: функция (target, rng) -> (метод, путь, тело)
+SCENARIOS = {
+    'tree_detail': lambda target, rng: get('/api/trees', {'id': target.tree_id(rng)}),
+    'trees_bbox': lambda target, rng: get('/api/trees', {'bbox': target.bbox(rng, 1000), 'limit': 5000,
+                                                         'fields': 'compact'}),
+    'trees_page': lambda target, rng: get('/api/trees', {'page_size': 100}),
+    'clusters': lambda target, rng: get('/api/trees/clusters', {'bbox': target.bbox(rng, 20000), 'zoom': 12}),
+    'tile': lambda target, rng: get('/api/tiles/%d/%d/%d' % target.tile(rng, 15)),
+    'nearby': lambda target, rng: get('/api/trees/nearby', dict(zip(('lat', 'lon'), target.point(rng)), k=10)),
+    'comments': lambda target, rng: get('/api/comments', {'tree_id': target.tree_id(rng), 'page_size': 20}),
+    'search': lambda target, rng: get('/api/search', {'q': rng.choice(('Липа', 'Садовая', 'Тверская', 'дупло',
+                                                                        'обрезка', 'грибы', 'Парк'))}),
+    'stats': lambda target, rng: get('/api/stats'),
+    'moderation': lambda target, rng: get('/api/moderation/pending', {'page_size': 50}),
+    'add_comment': lambda target, rng: ('POST', '/api/comments', {
+        'tree_id': target.tree_id(rng), 'user_name': 'bench', 'text': 'Нагрузочный тест', 'contact_email': '',
+    }),
+    'add_status': lambda target, rng: ('POST', '/api/status', {
+        'tree_id': target.tree_id(rng), 'status': rng.choice(('good', 'satisfactory', 'poor')), 'notes': '',
+    }),
+}
+
+WRITE_SCENARIOS = ('add_comment', 'add_status')
+DEFAULT_SCENARIOS = [name for name in SCENARIOS if name not in WRITE_SCENARIOS]
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+def send(host, port, method, path, body):
+    """Один запрос на новом соединении (сервер закрывает соединение после ответа)"""
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else None
+    headers = {'Content-Type': 'application/json'} if payload else {}
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        conn.request(method, path, body=payload, headers=headers)
+        response = conn.getresponse()
+        return response.status, len(response.read())
+    finally:
+        conn.close()
+
+def run_scenario(host, port, scenario, target, concurrency, duration, warmup, seed):
+    """Запросы сценария из concurrency потоков в течение warmup + duration секунд"""
+    build = SCENARIOS[scenario]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    sizes = [0] * concurrency
+    statuses = [{} for _ in range(concurrency)]
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        while True:
+            method, path, body = build(target, rng)
+            started = time.perf_counter()
+            if started >= stop_at:
+                return
+            try:
+                status, size = send(host, port, method, path, body)
+            except (OSError, http.client.HTTPException):
+                status, size = 'error', 0
+            finished = time.perf_counter()
+            if started < measure_from:
+                continue
+            latencies[index].append(finished - started)
+            sizes[index] += size
+            statuses[index][status] = statuses[index].get(status, 0) + 1
+            if status == 'error' or status >= 400:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    values = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+    status_counts = {}
+    for worker_statuses in statuses:
+        for status, count in worker_statuses.items():
+            status_counts[str(status)] = status_counts.get(str(status), 0) + count
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(values),
+        'rps': round(len(values) / duration, 1),
+        'p50_ms': ms(percentile(values, 0.5)),
+        'p95_ms': ms(percentile(values, 0.95)),
+        'p99_ms': ms(percentile(values, 0.99)),
+        'max_ms': ms(values[-1] if values else None),
+        'errors': sum(errors),
+        'statuses': status_counts,
+        'bytes': sum(sizes),
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(db_path, workers, extra_args):
+    """Запуск server.py отдельным процессом, ожидание готовности"""
+    port = free_port()
+    env = dict(os.environ, DENDRO_DB=os.path.abspath(db_path))
+    process = subprocess.Popen(
+        [sys.executable, 'server.py', '--port', str(port), '--workers', str(workers), '--access-log', 'off']
+        + extra_args,
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server.py exited with code {process.returncode}')
+        try:
+            if send('127.0.0.1', port, 'GET', '/api/stats', None)[0] == 200:
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('server.py did not start in 120 s')
+
+def stop_server(process):
+    # SIGTERM: сервер дообрабатывает принятые запросы и фиксирует очереди записи
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def git_revision():
+    """Коммит и признак незафиксированных изменений (None вне git)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+def compare(results, baseline_path):
+    """Печать изменения rps и p95 относительно прошлого запуска"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(row['scenario'], row['concurrency']): row for row in baseline['results']}
+    print(f"\nСравнение с {baseline_path} (коммит {baseline.get('commit')}):")
+    print(f"{'Сценарий':<14} {'потоки':>6} {'rps было':>10} {'стало':>10} {'p95 было':>10} {'стало':>10}")
+    matched = [(row, previous[(row['scenario'], row['concurrency'])]) for row in results
+               if (row['scenario'], row['concurrency']) in previous]
+    if not matched:
+        print("   нет общих сценариев с той же конкурентностью")
+    for row, old in matched:
+        print(f"{row['scenario']:<14} {row['concurrency']:>6} {old['rps']:>10.1f} {row['rps']:>10.1f} "
+              f"{old['p95_ms'] or 0:>10.2f} {row['p95_ms'] or 0:>10.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест API ДендроМонитор')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'data', 'bench.db'),
+                        help='база для сервера, запускаемого тестом (bench/generate.py)')
+    parser.add_argument('--url', help='адрес уже запущенного сервера вместо запуска своего')
+    parser.add_argument('--workers', type=int, default=8, help='рабочих потоков запускаемого сервера')
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help='дополнительный параметр server.py, например --server-arg=--snapshot')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"сценарии через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help='числа одновременных клиентов через запятую')
+    parser.add_argument('--duration', type=float, default=10, help='секунд измерения на сценарий')
+    parser.add_argument('--warmup', type=float, default=2, help='секунд прогрева перед измерением')
+    parser.add_argument('--center', default='55.7558,37.6173', help='центр города: широта,долгота')
+    parser.add_argument('--radius-km', type=float, default=15, help='радиус города в км')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора запросов')
+    parser.add_argument('--output', help='файл результатов (по умолчанию bench/results/<время>-<коммит>.json)')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения')
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    concurrency_levels = [int(value) for value in args.concurrency.split(',')]
+    latitude, longitude = (float(value) for value in args.center.split(','))
+
+    process = None
+    if args.url:
+        parsed = urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        if not os.path.exists(args.db):
+            print(f"❌ Нет базы {args.db}: создайте ее командой python -m bench.generate")
+            sys.exit(1)
+        print(f"🚀 Запуск server.py с базой {args.db}...")
+        process, port = start_server(args.db, args.workers, args.server_arg)
+        host = '127.0.0.1'
+
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        conn.request('GET', '/api/stats')
+        stats = json.loads(conn.getresponse().read())
+        conn.close()
+        target = Target(latitude, longitude, args.radius_km, max(stats['total'], 1))
+        print(f"🌳 Деревьев в базе: {stats['total']}")
+
+        results = []
+        print(f"{'Сценарий':<14} {'потоки':>6} {'rps':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'ошибки':>7}")
+        for scenario in scenarios:
+            for concurrency in concurrency_levels:
+                row = run_scenario(host, port, scenario, target, concurrency, args.duration, args.warmup, args.seed)
+                results.append(row)
+                print(f"{scenario:<14} {concurrency:>6} {row['rps']:>9.1f} {row['p50_ms'] or 0:>9.2f} "
+                      f"{row['p95_ms'] or 0:>9.2f} {row['p99_ms'] or 0:>9.2f} {row['errors']:>7}")
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    commit, dirty = git_revision()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'started_at': datetime.datetime.now().astimezone().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'server': args.url or {'db': os.path.abspath(args.db), 'workers': args.workers,
+                               'args': args.server_arg},
+        'trees': stats['total'],
+        'duration_s': args.duration,
+        'warmup_s': args.warmup,
+        'seed': args.seed,
+        'results': results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{commit or 'nogit'}{'-dirty' if dirty else ''}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
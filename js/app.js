@@ -302,10 +302,13 @@ class AuthManager {
                     window.addTreeToMap(result.tree);
                 }
                 
-                // Обновляем статистику
+                // Обновляем деревья и статистику
                 if (window.loadTrees) {
                     window.loadTrees();
                 }
+                if (window.loadStatistics) {
+                    window.loadStatistics();
+                }
             } else {
                 throw new Error(result.error || 'Ошибка добавления');
             }
@@ -395,10 +398,13 @@ async function handleAddTree(e) {
                 window.addTreeToMap(result.tree);
             }
             
-            // Обновляем статистику
+            // Обновляем деревья и статистику
             if (window.loadTrees) {
                 window.loadTrees();
             }
+            if (window.loadStatistics) {
+                window.loadStatistics();
+            }
         } else {
             throw new Error(result.error || 'Ошибка добавления');
         }
@@ -429,6 +435,168 @@ DendroMonitor.prototype.addTree = async function(treeData) {
     }
 };
 
+DendroMonitor.prototype.updateTreeStatus = async function(statusData) {
+    try {
+        const response = await fetch('/api/status', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(statusData)
+        });
+        return await response.json();
+    } catch (error) {
+        console.error('Ошибка обновления состояния:', error);
+        return { success: false, error: 'Ошибка соединения: ' + error.message };
+    }
+};
+
+// Запись списка осмотров одним запросом: entries - [{tree_id, status, notes, date_recorded, is_future_plan}]
+DendroMonitor.prototype.updateTreeStatuses = async function(entries) {
+    try {
+        const response = await fetch('/api/status/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ entries })
+        });
+        return await response.json();
+    } catch (error) {
+        console.error('Ошибка обновления состояний:', error);
+        return { success: false, error: 'Ошибка соединения: ' + error.message };
+    }
+};
+
+// Число деревьев всего и по состояниям: {total, by_status, by_species, by_species_status}
+DendroMonitor.prototype.getStats = async function() {
+    const response = await fetch('/api/stats');
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return await response.json();
+};
+
+// Постраничная загрузка: cursor из поля next предыдущей страницы, null - первая страница
+DendroMonitor.prototype.getTreesPage = async function(cursor = null, pageSize = 100) {
+    const params = new URLSearchParams({ page_size: pageSize });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`/api/trees?${params}`);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return await response.json();
+};
+
+DendroMonitor.prototype.getCommentsPage = async function(treeId, cursor = null, pageSize = 20) {
+    const params = new URLSearchParams({ tree_id: treeId, page_size: pageSize });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`/api/comments?${params}`);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return await response.json();
+};
+
+// Текущая версия журнала изменений: запрашивается до загрузки данных,
+// чтобы изменения, сделанные во время загрузки, пришли в подписке
+DendroMonitor.prototype.getChangesVersion = async function() {
+    const response = await fetch('/api/changes');
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return (await response.json()).version;
+};
+
+// Подписка на изменения после версии since (Server-Sent Events):
+// onChanges({trees, statuses, comments, deleted, version}) - измененные строки и удаления,
+// onReset() - журнал уже не покрывает версию, данные нужно загрузить заново
+DendroMonitor.prototype.subscribeChanges = function(since, onChanges, onReset) {
+    const source = new EventSource(`/api/changes/stream?since=${since}`);
+    source.addEventListener('changes', event => onChanges(JSON.parse(event.data)));
+    source.addEventListener('reset', () => {
+        source.close();
+        onReset();
+    });
+    return source;
+};
+
+// Опрос журнала изменений для публичной карты: запрос короткий и не держит
+// рабочий поток сервера, как поток событий. Аргументы те же, что у subscribeChanges;
+// возвращает {stop()}
+DendroMonitor.prototype.pollChanges = function(since, onChanges, onReset, intervalMs = 30000) {
+    let timer = null;
+    let stopped = false;
+    const poll = async () => {
+        let delay = intervalMs;
+        try {
+            const response = await fetch(`/api/changes?since=${since}`);
+            if (response.status === 410) {
+                stopped = true;
+                onReset();
+                return;
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const changes = await response.json();
+            since = changes.version;
+            const deleted = Object.values(changes.deleted).some(ids => ids.length);
+            if (changes.trees.length || changes.statuses.length || changes.comments.length || deleted) {
+                onChanges(changes);
+            }
+            // Страница журнала не последняя: дочитываем сразу
+            if (changes.more) {
+                delay = 0;
+            }
+        } catch (error) {
+            console.error('Ошибка опроса изменений:', error);
+        }
+        if (!stopped) {
+            timer = setTimeout(poll, delay);
+        }
+    };
+    timer = setTimeout(poll, intervalMs);
+    return {
+        stop() {
+            stopped = true;
+            clearTimeout(timer);
+        }
+    };
+};
+
+// Очередь модерации: {comments, next, total}, самые старые непроверенные комментарии первыми
+DendroMonitor.prototype.getPendingComments = async function(cursor = null, pageSize = 50) {
+    const params = new URLSearchParams({ page_size: pageSize });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`/api/moderation/pending?${params}`);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    return await response.json();
+};
+
+// Одобрение (action = 'approve') или отклонение ('reject') комментариев одним запросом
+DendroMonitor.prototype.moderateComments = async function(action, ids) {
+    try {
+        const response = await fetch(`/api/moderation/${action}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ids })
+        });
+        return await response.json();
+    } catch (error) {
+        console.error('Ошибка модерации комментариев:', error);
+        return { success: false, error: 'Ошибка соединения: ' + error.message };
+    }
+};
+
 // Добавьте в конец файла js/app.js
 console.log('app.js загружен');
 
@@ -1,5 +1,18 @@
 // Инициализация карты
 let map;
+let treesLayer;
+
+// Максимум деревьев, запрашиваемых для видимой области
+const TREES_LIMIT = 5000;
+let treesRequestId = 0;
+// Маркеры деревьев видимой области по id (пусто, когда показаны кластеры)
+const treeMarkers = new Map();
+let showingClusters = false;
+
+// Кластеры считаются на сервере до этого масштаба включительно
+const CLUSTER_MAX_ZOOM = 15;
+// Если в области больше деревьев, вместо отдельных маркеров рисуются кластеры
+const MARKERS_THRESHOLD = 2000;
 
 function initMap() {
     // Создаем карту с центром в Москве
@@ -14,8 +27,16 @@ function initMap() {
     // Делаем карту глобально доступной
     window.map = map;
     
-    // Загружаем деревья
+    // Слой маркеров деревьев, перерисовывается при перемещении карты
+    treesLayer = L.layerGroup().addTo(map);
+    map.on('moveend', loadTrees);
+    
+    // Загружаем деревья и статистику
     loadTrees();
+    loadStatistics();
+    
+    // Изменения деревьев приходят опросом журнала, без повторной загрузки области
+    subscribeToChanges();
     
     // Настраиваем обработчик кликов если пользователь уже авторизован
     if (window.authManager && window.authManager.isAuthenticated) {
@@ -61,17 +82,49 @@ window.setupMapClickHandler = function() {
     console.log('Обработчик клика на карту установлен');
 };
 
-// Загрузка деревьев с сервера
+// Загрузка деревьев видимой области карты с сервера
 async function loadTrees() {
+    const requestId = ++treesRequestId;
+    const bounds = map.getBounds();
+    const bbox = [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+        .map(value => value.toFixed(6))
+        .join(',');
+    
     try {
-        const response = await fetch('/.netlify/functions/trees');
+        // На мелком масштабе сначала смотрим, сколько деревьев в области
+        if (map.getZoom() <= CLUSTER_MAX_ZOOM) {
+            const response = await fetch(`/api/trees/clusters?bbox=${bbox}&zoom=${map.getZoom()}`);
+            const clusters = await response.json();
+            
+            if (requestId !== treesRequestId) {
+                return;
+            }
+            
+            if (clusters.total > MARKERS_THRESHOLD) {
+                treesLayer.clearLayers();
+                treeMarkers.clear();
+                showingClusters = true;
+                clusters.clusters.forEach(cluster => addClusterToMap(cluster));
+                return;
+            }
+        }
+        
+        // Для маркеров хватает координат, породы и состояния; адрес и размеры подгружаются в попапе
+        const response = await fetch(`/api/trees?bbox=${bbox}&limit=${TREES_LIMIT}&fields=compact`);
         const trees = await response.json();
         
+        // Пока ждали ответ, карту успели сдвинуть еще раз
+        if (requestId !== treesRequestId) {
+            return;
+        }
+        
+        treesLayer.clearLayers();
+        treeMarkers.clear();
+        showingClusters = false;
         trees.forEach(tree => {
             addTreeToMap(tree);
         });
         
-        updateStatistics(trees);
     } catch (error) {
         console.error('Ошибка загрузки деревьев:', error);
         loadSampleTrees();
@@ -103,33 +156,154 @@ function addTreeToMap(tree) {
         weight: 2,
         opacity: 1,
         fillOpacity: 0.8
-    }).addTo(map);
+    }).addTo(treesLayer || map);
+    treeMarkers.set(tree.id, marker);
     
-    const popupContent = `
+    const popupContent = details => `
         <div class="tree-popup">
             <h3>${tree.species}</h3>
             <p><strong>Состояние:</strong> ${statusNames[tree.status]}</p>
-            <p><strong>Адрес:</strong> ${tree.address}</p>
-            ${tree.diameter ? `<p><strong>Диаметр:</strong> ${tree.diameter} см</p>` : ''}
-            ${tree.height ? `<p><strong>Высота:</strong> ${tree.height} м</p>` : ''}
+            <p><strong>Адрес:</strong> ${details.address ?? '…'}</p>
+            ${details.diameter ? `<p><strong>Диаметр:</strong> ${details.diameter} см</p>` : ''}
+            ${details.height ? `<p><strong>Высота:</strong> ${details.height} м</p>` : ''}
             <a href="tree_detail.html?id=${tree.id}" class="btn" onclick="event.stopPropagation();">Подробнее</a>
         </div>
         `;
     
-    marker.bindPopup(popupContent);
+    marker.bindPopup(popupContent(tree));
+    
+    // Деревья из fields=compact приходят без адреса: дочитываем его при открытии попапа
+    if (!('address' in tree)) {
+        marker.on('popupopen', async () => {
+            try {
+                const response = await fetch(`/api/trees?id=${tree.id}`);
+                const data = await response.json();
+                if (data.tree) {
+                    Object.assign(tree, data.tree);
+                    marker.setPopupContent(popupContent(tree));
+                }
+            } catch (error) {
+                console.error('Ошибка загрузки дерева:', error);
+            }
+        });
+    }
 }
 
-// Обновление статистики
-function updateStatistics(trees) {
-    document.getElementById('total-trees').textContent = trees.length;
+// Подписка на журнал изменений (версия берется до первой загрузки деревьев).
+// Карту смотрят все посетители, поэтому она опрашивает журнал, а поток
+// событий остается панели специалиста
+async function subscribeToChanges() {
+    try {
+        const version = await app.getChangesVersion();
+        app.pollChanges(version, applyChanges, () => {
+            // Отстали больше, чем хранит журнал: перезагружаем область
+            loadTrees();
+            loadStatistics();
+            subscribeToChanges();
+        });
+    } catch (error) {
+        console.error('Ошибка подписки на изменения:', error);
+    }
+}
+
+// Применение изменений к маркерам видимой области
+function applyChanges(changes) {
+    if (!changes.trees.length && !changes.deleted.trees.length) {
+        return;
+    }
+    loadStatistics();
     
-    const excellentCount = trees.filter(tree => tree.status === 'excellent').length;
-    const needCareCount = trees.filter(tree => 
-        ['poor', 'critical'].includes(tree.status)
-    ).length;
+    // Кластеры пересчитываются на сервере
+    if (showingClusters) {
+        loadTrees();
+        return;
+    }
     
-    document.getElementById('excellent-trees').textContent = excellentCount;
-    document.getElementById('need-care').textContent = needCareCount;
+    const bounds = map.getBounds();
+    changes.deleted.trees.forEach(id => {
+        const marker = treeMarkers.get(id);
+        if (marker) {
+            treesLayer.removeLayer(marker);
+            treeMarkers.delete(id);
+        }
+    });
+    changes.trees.forEach(tree => {
+        const marker = treeMarkers.get(tree.id);
+        if (marker) {
+            treesLayer.removeLayer(marker);
+            treeMarkers.delete(tree.id);
+        }
+        if (bounds.contains([tree.latitude, tree.longitude])) {
+            addTreeToMap(tree);
+        }
+    });
+}
+
+// Добавление кластера деревьев на карту
+function addClusterToMap(cluster) {
+    const statusColors = {
+        'excellent': '#4caf50',
+        'good': '#8bc34a',
+        'satisfactory': '#ffeb3b',
+        'poor': '#ff9800',
+        'critical': '#f44336'
+    };
+    
+    const statusNames = {
+        'excellent': 'Отличное',
+        'good': 'Хорошее',
+        'satisfactory': 'Удовлетворительное',
+        'poor': 'Плохое',
+        'critical': 'Критическое'
+    };
+    
+    // Цвет кластера - по преобладающему состоянию
+    const dominant = Object.keys(statusColors)
+        .reduce((best, status) => cluster.statuses[status] > cluster.statuses[best] ? status : best);
+    
+    const marker = L.circleMarker([cluster.latitude, cluster.longitude], {
+        radius: Math.min(10 + Math.log2(cluster.count) * 3, 40),
+        fillColor: statusColors[dominant],
+        color: '#fff',
+        weight: 2,
+        opacity: 1,
+        fillOpacity: 0.7
+    }).addTo(treesLayer);
+    
+    marker.bindTooltip(String(cluster.count), { permanent: true, direction: 'center', className: 'cluster-label' });
+    
+    const breakdown = Object.keys(statusNames)
+        .filter(status => cluster.statuses[status] > 0)
+        .map(status => `<p><strong>${statusNames[status]}:</strong> ${cluster.statuses[status]}</p>`)
+        .join('');
+    
+    marker.bindPopup(`
+        <div class="tree-popup">
+            <h3>Деревьев: ${cluster.count}</h3>
+            ${breakdown}
+        </div>
+    `);
+    
+    // Двойной клик по кластеру приближает карту
+    marker.on('dblclick', () => map.setView([cluster.latitude, cluster.longitude], map.getZoom() + 2));
+}
+
+// Обновление статистики
+// Статистика по всем деревьям считается на сервере
+async function loadStatistics() {
+    try {
+        const response = await fetch('/api/stats');
+        updateStatistics(await response.json());
+    } catch (error) {
+        console.error('Ошибка загрузки статистики:', error);
+    }
+}
+
+function updateStatistics(stats) {
+    const byStatus = stats.by_status;
+    document.getElementById('total-trees').textContent = stats.total;
+    document.getElementById('excellent-trees').textContent = byStatus.excellent || 0;
+    document.getElementById('need-care').textContent = (byStatus.poor || 0) + (byStatus.critical || 0);
 }
 
 // Загрузка тестовых данных (если API не работает)
@@ -168,7 +342,11 @@ function loadSampleTrees() {
     ];
     
     sampleTrees.forEach(tree => addTreeToMap(tree));
-    updateStatistics(sampleTrees);
+    const byStatus = {};
+    sampleTrees.forEach(tree => {
+        byStatus[tree.status] = (byStatus[tree.status] || 0) + 1;
+    });
+    updateStatistics({ total: sampleTrees.length, by_status: byStatus });
 }
 
 // Инициализация карты при загрузке страницы
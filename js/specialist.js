@@ -2,6 +2,8 @@
 class SpecialistPanel {
     constructor() {
         this.trees = [];
+        this.treesNext = null;
+        this.markers = new Map();
         this.init();
     }
     
@@ -11,15 +13,81 @@ class SpecialistPanel {
             return;
         }
         
+        // Версия журнала до загрузки: изменения во время загрузки придут в подписке
+        const version = await app.getChangesVersion().catch(() => null);
         await this.loadTrees();
         this.initMap();
         this.setupEventListeners();
         this.updateStatistics();
+        if (version !== null) {
+            this.subscribeToChanges(version);
+        }
+    }
+    
+    subscribeToChanges(version) {
+        app.subscribeChanges(version, changes => this.applyChanges(changes), async () => {
+            // Отстали больше, чем хранит журнал: загружаем список заново
+            const current = await app.getChangesVersion();
+            this.markers.forEach(marker => this.map.removeLayer(marker));
+            this.markers.clear();
+            await this.loadTrees();
+            this.trees.forEach(tree => this.addTreeToMap(tree));
+            this.updateStatistics();
+            this.subscribeToChanges(current);
+        });
+    }
+    
+    // Изменения других пользователей: обновляем загруженные деревья, новые добавляем в конец
+    applyChanges(changes) {
+        if (!changes.trees.length && !changes.deleted.trees.length) {
+            return;
+        }
+        
+        changes.deleted.trees.forEach(id => this.removeTree(id));
+        changes.trees.forEach(tree => {
+            const index = this.trees.findIndex(t => t.id === tree.id);
+            if (index >= 0) {
+                this.trees[index] = tree;
+            } else if (this.treesNext) {
+                // Дерево попадет в список со следующей страницей
+                return;
+            } else {
+                this.trees.push(tree);
+            }
+            this.addTreeToMap(tree);
+        });
+        this.renderTreesList();
+        this.updateStatistics();
+    }
+    
+    removeTree(id) {
+        this.trees = this.trees.filter(tree => tree.id !== id);
+        const marker = this.markers.get(id);
+        if (marker) {
+            this.map.removeLayer(marker);
+            this.markers.delete(id);
+        }
     }
     
     async loadTrees() {
         try {
-            this.trees = await app.getTrees();
+            const page = await app.getTreesPage();
+            this.trees = page.trees;
+            this.treesNext = page.next;
+            this.renderTreesList();
+        } catch (error) {
+            console.error('Ошибка загрузки деревьев:', error);
+        }
+    }
+    
+    async loadMoreTrees() {
+        if (!this.treesNext) return;
+        
+        try {
+            const page = await app.getTreesPage(this.treesNext);
+            this.trees = this.trees.concat(page.trees);
+            this.treesNext = page.next;
+            page.trees.forEach(tree => this.addTreeToMap(tree));
             this.renderTreesList();
         } catch (error) {
             console.error('Ошибка загрузки деревьев:', error);
@@ -65,6 +133,13 @@ class SpecialistPanel {
             fillOpacity: 0.8
         }).addTo(this.map);
         
+        // Повторное добавление дерева заменяет его маркер
+        const previous = this.markers.get(tree.id);
+        if (previous) {
+            this.map.removeLayer(previous);
+        }
+        this.markers.set(tree.id, marker);
+        
         marker.bindPopup(`
             <div class="tree-popup">
                 <h4>${tree.species}</h4>
@@ -169,8 +244,14 @@ class SpecialistPanel {
                 showNotification('✅ Состояние дерева обновлено!', 'success');
                 document.getElementById('status-modal').classList.add('hidden');
                 
-                // Обновляем дерево в списке
-                await this.loadTrees();
+                // Обновляем дерево в списке без повторной загрузки страниц
+                const tree = this.trees.find(t => t.id === statusData.tree_id);
+                if (tree && result.current_status) {
+                    tree.status = result.current_status.status;
+                    tree.status_notes = result.current_status.notes;
+                    this.addTreeToMap(tree);
+                    this.renderTreesList();
+                }
                 this.updateStatistics();
             } else {
                 throw new Error(result.error);
@@ -201,19 +282,29 @@ class SpecialistPanel {
                     </button>
                 </div>
             </div>
-        `).join('');
+        `).join('') + (this.treesNext ? `
+            <button onclick="specialistPanel.loadMoreTrees()" class="action-btn load-more-btn">
+                ⬇️ Показать еще
+            </button>
+        ` : '');
     }
     
-    updateStatistics() {
-        document.getElementById('total-trees').textContent = this.trees.length;
-        
-        const needCareCount = this.trees.filter(tree => 
-            ['poor', 'critical'].includes(tree.status)
-        ).length;
-        
-        document.getElementById('need-care').textContent = needCareCount;
-        // Здесь можно добавить подсчет новых комментариев
-        document.getElementById('new-comments').textContent = '0';
+    async updateStatistics() {
+        // Счетчики по всем деревьям, а не только по загруженным страницам
+        try {
+            const stats = await app.getStats();
+            document.getElementById('total-trees').textContent = stats.total;
+            document.getElementById('need-care').textContent =
+                (stats.by_status.poor || 0) + (stats.by_status.critical || 0);
+        } catch (error) {
+            console.error('Ошибка загрузки статистики:', error);
+        }
+        try {
+            const pending = await app.getPendingComments(null, 1);
+            document.getElementById('new-comments').textContent = pending.total;
+        } catch (error) {
+            console.error('Ошибка загрузки очереди модерации:', error);
+        }
     }
     
     getStatusText(status) {
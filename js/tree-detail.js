@@ -2,6 +2,7 @@ class TreeDetail {
     constructor() {
         this.treeId = this.getTreeIdFromUrl();
         this.treeData = null;
+        this.commentsNext = null;
         this.init();
     }
     
@@ -32,9 +33,35 @@ class TreeDetail {
             comments: this.getComments(treeId)
         };
         
+        await this.loadComments(treeId);
+        
         console.log('Loaded tree data:', this.treeData);
     }
     
+    async loadComments(treeId) {
+        // Первая страница комментариев с сервера; без сервера остаются демо-данные
+        try {
+            const page = await app.getCommentsPage(treeId);
+            this.treeData.comments = page.comments;
+            this.commentsNext = page.next;
+        } catch (error) {
+            console.warn('Комментарии с сервера недоступны, показаны демо-данные:', error);
+        }
+    }
+    
+    async loadMoreComments() {
+        if (!this.commentsNext) return;
+        
+        try {
+            const page = await app.getCommentsPage(parseInt(this.treeId), this.commentsNext);
+            this.treeData.comments = this.treeData.comments.concat(page.comments);
+            this.commentsNext = page.next;
+            this.renderComments();
+        } catch (error) {
+            console.error('Ошибка загрузки комментариев:', error);
+        }
+    }
+    
     getSampleTrees() {
         return [
             {
@@ -437,7 +464,11 @@ class TreeDetail {
                     <div class="comment-contact">📧 ${comment.contact_email}</div>
                 ` : ''}
             </div>
-        `).join('');
+        `).join('') + (this.commentsNext ? `
+            <button onclick="treeDetail.loadMoreComments()" class="load-more-btn">
+                ⬇️ Показать еще
+            </button>
+        ` : '');
     }
     
     setupEventListeners() {
@@ -529,6 +560,7 @@ class TreeDetail {
 }
 
 // Инициализация при загрузке страницы
+let treeDetail;
 document.addEventListener('DOMContentLoaded', () => {
-    new TreeDetail();
+    treeDetail = new TreeDetail();
 });
\ No newline at end of file
@@ -1,304 +1,775 @@
 #!/usr/bin/env python3
 import http.server
 import socketserver
-import sqlite3
-import os
+import argparse
+import datetime
 import json
+import os
+import random
+import select
+import socket
+import sys
+import queue
+import signal
+import threading
+import subprocess
+import time
 from urllib.parse import urlparse, parse_qs
-from datetime import date
+
+from api import (trees, add_tree, comments, status, clusters, tiles, debug, importer, search, stats, analytics,
+                 nearby, snapshot, changes, moderation, metrics)
+from api.cache import cached
+from api.content_encoding import MIN_COMPRESS_SIZE, choose_encoding, compress, compress_chunks, is_compressible
+from api.db import configure_pool, get_pool
+from api.migrations import init_database
+from api.query_plans import API_QUERIES
+from api.slow_queries import slow_query_log
+from api.request import Request, Response
+from api.write_queue import stop_write_queues
+
+# Реестр обработчиков API: модули импортируются один раз при запуске сервера
+API_ROUTES = {}
+# Обработчики путей с параметрами в самом пути (префикс -> обработчик)
+API_PREFIX_ROUTES = {}
+# Имя маршрута в метриках по пути: функция (request) -> имя
+ROUTE_NAMES = {}
+
+def register_api(module, *paths, cache=False):
+    """Регистрация обработчика модуля API по нескольким путям
+
+    cache=True: GET-ответы кэшируются до следующей записи в базу и
+    отдаются с ETag (повторный запрос с If-None-Match получает 304).
+    Функция module.cache_version(request), если есть, задает версию
+    данных ответа вместо общей (см. api/cache.py).
+
+    В метриках все пути учитываются под первым из них, если
+    module.metrics_route(request) не задает имя маршрута сам.
+    """
+    handler = cached(module.handle, getattr(module, 'cache_version', None)) if cache else module.handle
+    route_name = getattr(module, 'metrics_route', None) or (lambda request, name=paths[0]: name)
+    for path in paths:
+        API_ROUTES[path] = handler
+        ROUTE_NAMES[path] = route_name
+
+def register_api_prefix(module, prefix):
+    """Регистрация обработчика для всех путей, начинающихся с prefix"""
+    API_PREFIX_ROUTES[prefix] = module.handle
+    ROUTE_NAMES[prefix] = lambda request: prefix + '*'
+
+register_api(trees, '/api/trees', '/api/trees.py', cache=True)
+register_api(clusters, '/api/trees/clusters', '/api/clusters.py', cache=True)
+register_api(nearby, '/api/trees/nearby', '/api/nearby.py')
+register_api(add_tree, '/api/add_tree', '/api/add_tree.py', '/api/add-tree')
+register_api(comments, '/api/comments', '/api/comments.py', cache=True)
+register_api(status, '/api/status', '/api/status.py', '/api/status/batch')
+register_api(importer, '/api/import')
+register_api(search, '/api/search', '/api/search.py', cache=True)
+register_api(stats, '/api/stats', '/api/stats.py', cache=True)
+register_api(changes, '/api/changes', '/api/changes.py', cache=True)
+register_api(changes, '/api/changes/stream')
+register_api_prefix(debug, '/api/debug/')
+register_api_prefix(tiles, '/api/tiles/')
+register_api_prefix(analytics, '/api/analytics/')
+register_api_prefix(moderation, '/api/moderation/')
+
+# Запросы к SQLite в метриках называются так же, как в проверке планов
+metrics.name_queries(API_QUERIES)
+
+# Методы с отдельной меткой в метриках, остальные - other
+METRIC_METHODS = {'GET', 'POST', 'HEAD', 'OPTIONS'}
+
+# Режим нескольких процессов: ожидание готовности и остановки процесса, секунды
+WORKER_READY_SECONDS = 60
+WORKER_STOP_SECONDS = 30
+# Процесс, упавший раньше, перезапускается с растущей паузой (не больше WORKER_MAX_RESTART_DELAY)
+WORKER_MIN_UPTIME_SECONDS = 5
+WORKER_MAX_RESTART_DELAY = 30
+SUPERVISOR_POLL_SECONDS = 0.5
 
 class DendroMonitorHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Кастомный HTTP обработчик для API endpoints"""
+
+    # Запуск API-скриптов через subprocess (CGI) вместо вызова в процессе
+    use_cgi = False
+    
+    # HTTP/1.1 нужен для chunked-передачи потоковых ответов
+    protocol_version = 'HTTP/1.1'
+    
+    # Таймаут сокета: медленный клиент не должен надолго занимать рабочий поток
+    timeout = 30
+    
+    # Журнал запросов: text - строка на запрос, как у http.server, json - строка JSON, off - без журнала
+    access_log = 'text'
+    # Доля запросов, попадающих в журнал (ответы 5xx пишутся всегда)
+    access_log_sample = 1.0
+    
+    def parse_request(self):
+        # Время запроса отсчитывается от получения строки запроса, а не от открытия соединения
+        self.started = time.perf_counter()
+        self.route = None
+        self.bytes_sent = 0
+        return super().parse_request()
+    
+    def handle_one_request(self):
+        self.status_code = None
+        super().handle_one_request()
+        if self.status_code is not None:
+            self.record_request()
     
     def do_GET(self):
         # Обработка API запросов
         if self.path.startswith('/api/'):
             self.handle_api_request()
+        elif urlparse(self.path).path == '/metrics':
+            # Метрики собирает сам сервер, в том числе в режиме CGI
+            self.route = '/metrics'
+            self.send_api_response(metrics.handle(self.build_request(urlparse(self.path))))
         else:
             # Статические файлы
+            self.route = 'static'
             super().do_GET()
     
     def do_POST(self):
         # Обработка POST запросов к API
         if self.path.startswith('/api/'):
-            self.handle_api_post_request()
+            self.handle_api_request()
         else:
             self.send_error(404, "File not found")
     
     def handle_api_request(self):
-        """Обработка GET запросов к API"""
+        """Обработка запросов к API через реестр обработчиков"""
         try:
             parsed_path = urlparse(self.path)
-            query_params = parse_qs(parsed_path.query)
+            route = parsed_path.path.rstrip('/')
             
-            if self.path.startswith('/api/trees'):
-                self.handle_trees_api(query_params)
-            elif self.path.startswith('/api/comments'):
-                self.handle_comments_api(query_params)
-            else:
-                # Пробуем выполнить Python скрипт
-                self.handle_python_script()
-                
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
-    
-    def handle_api_post_request(self):
-        """Обработка POST запросов к API"""
-        try:
-            if self.path.startswith('/api/'):
-                # Для POST запросов тоже пробуем выполнить Python скрипт
-                self.handle_python_script()
-            else:
+            if self.use_cgi:
+                self.route = 'cgi'
+                self.handle_python_script(parsed_path)
+                return
+            
+            handler = API_ROUTES.get(route)
+            route_key = route
+            if handler is None:
+                route_key, handler = next(((prefix, prefix_handler) for prefix, prefix_handler in API_PREFIX_ROUTES.items()
+                                           if route.startswith(prefix)), (None, None))
+            if handler is None:
                 self.send_error(404, "API endpoint not found")
+                return
+            
+            request = self.build_request(parsed_path)
+            self.route = ROUTE_NAMES[route_key](request)
+            response = handler(request)
+            self.send_api_response(response)
                 
         except Exception as e:
             self.send_error(500, f"Internal server error: {str(e)}")
     
-    def handle_python_script(self):
-        """Выполнение Python скриптов"""
+    def build_request(self, parsed_path):
+        """Сборка объекта запроса для обработчика API"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length) if content_length > 0 else b''
+        
+        return Request(
+            method=self.command,
+            path=parsed_path.path,
+            query=parse_qs(parsed_path.query),
+            body=body,
+            headers=dict(self.headers.items()),
+        )
+    
+    def handle_python_script(self, parsed_path):
+        """Выполнение Python скриптов через subprocess (режим --cgi)"""
         try:
             # Получаем путь к скрипту
-            script_path = self.path[1:]  # Убираем первый слеш
+            script_path = parsed_path.path[1:]  # Убираем первый слеш
+            if not script_path.endswith('.py'):
+                script_path += '.py'
+            script_path = script_path.replace('-', '_')
             
             if not os.path.exists(script_path):
                 self.send_error(404, f"Script not found: {script_path}")
                 return
             
-            # Запускаем скрипт через subprocess
-            import subprocess
-            import sys
-            
             # Устанавливаем переменные окружения для CGI
             env = os.environ.copy()
             env['REQUEST_METHOD'] = self.command
+            env['QUERY_STRING'] = parsed_path.query
+            env['SCRIPT_NAME'] = parsed_path.path
             env['CONTENT_LENGTH'] = str(int(self.headers.get('Content-Length', 0)))
             env['CONTENT_TYPE'] = self.headers.get('Content-Type', '')
             
             # Если это POST запрос, передаем данные в stdin
+            post_data = b''
             if self.command == 'POST' and int(env['CONTENT_LENGTH']) > 0:
                 post_data = self.rfile.read(int(env['CONTENT_LENGTH']))
-                result = subprocess.run(
-                    [sys.executable, script_path],
-                    input=post_data,
-                    capture_output=True,
-                    text=False,
-                    env=env
-                )
-            else:
-                result = subprocess.run(
-                    [sys.executable, script_path],
-                    capture_output=True,
-                    text=False,
-                    env=env
-                )
             
-            if result.returncode == 0:
-                # Отправляем вывод скрипта как ответ
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(result.stdout)
-            else:
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, script_path],
+                input=post_data,
+                capture_output=True,
+                text=False,
+                env=env
+            )
+            metrics.registry.observe('dendro_subprocess_duration_seconds', (script_path,),
+                                    time.perf_counter() - started)
+            
+            if result.returncode != 0:
                 self.send_error(500, f"Script error: {result.stderr.decode()}")
+                return
+            
+            # Разбираем CGI-заголовки скрипта и отправляем тело ответа
+            head, _, body = result.stdout.replace(b'\r\n', b'\n').partition(b'\n\n')
+            status = 200
+            headers = {}
+            for line in head.decode('utf-8').splitlines():
+                name, _, value = line.partition(':')
+                if name.lower() == 'status':
+                    status = int(value.split()[0])
+                elif name.lower() != 'access-control-allow-origin':
+                    headers[name] = value.strip()
+            
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
                 
         except Exception as e:
             self.send_error(500, f"Script execution error: {str(e)}")
     
-    def handle_trees_api(self, query_params):
-        """Обработка запросов к деревьям через встроенный API"""
-        conn = self.get_db_connection()
-        
-        try:
-            if 'id' in query_params:
-                # Запрос конкретного дерева
-                tree_id = int(query_params['id'][0])
-                tree = conn.execute('SELECT * FROM trees WHERE id = ?', (tree_id,)).fetchone()
-                
-                if tree:
-                    status_history = conn.execute(
-                        'SELECT * FROM tree_status WHERE tree_id = ? ORDER BY date_recorded DESC',
-                        (tree_id,)
-                    ).fetchall()
-                    
-                    comments = conn.execute(
-                        '''SELECT * FROM comments 
-                           WHERE tree_id = ? AND is_reviewed = 1 
-                           ORDER BY created_at DESC''',
-                        (tree_id,)
-                    ).fetchall()
-                    
-                    response = {
-                        'tree': dict(tree),
-                        'status_history': [dict(status) for status in status_history],
-                        'comments': [dict(comment) for comment in comments]
-                    }
-                else:
-                    response = {'error': 'Tree not found'}
-            else:
-                # Запрос всех деревьев
-                trees = conn.execute('''
-                    SELECT t.*, ts.status, ts.notes as status_notes
-                    FROM trees t
-                    LEFT JOIN tree_status ts ON t.id = ts.tree_id
-                    WHERE ts.id = (
-                        SELECT id FROM tree_status 
-                        WHERE tree_id = t.id 
-                        ORDER BY date_recorded DESC, id DESC 
-                        LIMIT 1
-                    )
-                    OR ts.id IS NULL
-                ''').fetchall()
-                
-                response = [dict(tree) for tree in trees]
-            
-            self.send_json_response(response)
-            
-        finally:
-            conn.close()
+    def send_json_response(self, data, status=200, headers=None):
+        """Отправка JSON ответа"""
+        self.send_api_response(Response(data, status, headers))
     
-    def handle_comments_api(self, query_params):
-        """Обработка GET запросов к комментариям"""
-        conn = self.get_db_connection()
-        
-        try:
-            if 'tree_id' in query_params:
-                tree_id = int(query_params['tree_id'][0])
-                comments = conn.execute(
-                    '''SELECT * FROM comments 
-                       WHERE tree_id = ? AND is_reviewed = 1 
-                       ORDER BY created_at DESC''',
-                    (tree_id,)
-                ).fetchall()
-                
-                response = [dict(comment) for comment in comments]
-                self.send_json_response(response)
-            else:
-                self.send_error(400, "tree_id parameter required")
-                
-        finally:
-            conn.close()
-    
-    def get_db_connection(self):
-        """Создание подключения к базе данных"""
-        db_path = os.path.join(os.path.dirname(__file__), 'data', 'database.db')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+    def send_api_response(self, response):
+        """Отправка ответа обработчика API"""
+        self.send_response(response.status)
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
         
-        # Инициализация базы данных
-        self.init_database(conn)
+        if response.status == 304:
+            # Not Modified: только заголовки, тело у клиента уже есть
+            for name, value in response.headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
         
-        return conn
-    
-    def init_database(self, conn):
-        """Инициализация базы данных"""
-        # Создание таблиц
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS trees (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                latitude REAL NOT NULL,
-                longitude REAL NOT NULL,
-                species TEXT NOT NULL,
-                address TEXT,
-                diameter REAL,
-                height REAL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        encoding = None
+        if is_compressible(response.content_type):
+            self.send_header('Vary', 'Accept-Encoding')
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
         
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS tree_status (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tree_id INTEGER,
-                status TEXT NOT NULL,
-                notes TEXT,
-                date_recorded DATE DEFAULT CURRENT_DATE,
-                is_future_plan BOOLEAN DEFAULT 0,
-                FOREIGN KEY (tree_id) REFERENCES trees (id)
-            )
-        ''')
+        headers = dict(response.headers)
+        self.send_header('Content-Type', response.content_type)
         
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS comments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tree_id INTEGER,
-                user_name TEXT,
-                text TEXT NOT NULL,
-                contact_email TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                is_reviewed BOOLEAN DEFAULT 0,
-                FOREIGN KEY (tree_id) REFERENCES trees (id)
-            )
-        ''')
+        if response.stream is None:
+            response_body = response.body()
+            if encoding and len(response_body) >= MIN_COMPRESS_SIZE:
+                response_body = compress(response_body, encoding)
+                self.send_encoding_headers(encoding, headers)
+            self.send_header('Content-Length', str(len(response_body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(response_body)
+            return
         
-        # Добавляем тестовые данные если таблицы пустые
-        cursor = conn.execute('SELECT COUNT(*) as count FROM trees')
-        if cursor.fetchone()[0] == 0:
-            test_trees = [
-                (55.7558, 37.6176, 'Дуб', 'Красная площадь, 1', 85.5, 25.0),
-                (55.7520, 37.6175, 'Береза', 'ул. Тверская, 10', 45.2, 18.5),
-                (55.7500, 37.6200, 'Сосна', 'Парк Горького, центральная аллея', 92.1, 30.2),
-            ]
-            
-            for tree in test_trees:
-                conn.execute(
-                    'INSERT INTO trees (latitude, longitude, species, address, diameter, height) VALUES (?, ?, ?, ?, ?, ?)',
-                    tree
-                )
-            
-            test_statuses = [
-                (1, 'excellent', 'Дерево в отличном состоянии'),
-                (2, 'good', 'Небольшие повреждения коры'),
-                (3, 'satisfactory', 'Требуется санитарная обрезка'),
-            ]
-            
-            for status in test_statuses:
-                conn.execute(
-                    'INSERT INTO tree_status (tree_id, status, notes) VALUES (?, ?, ?)',
-                    status
-                )
+        # Потоковый ответ: длина заранее неизвестна
+        if encoding:
+            self.send_encoding_headers(encoding, headers)
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # HTTP/1.0: конец тела обозначается закрытием соединения
+            self.close_connection = True
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
         
-        conn.commit()
+        chunks = response.chunks()
+        try:
+            body_chunks = compress_chunks(chunks, encoding) if encoding else chunks
+            for chunk in body_chunks:
+                if chunked:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+                self.bytes_sent += len(chunk)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # Заголовки уже отправлены: обрываем соединение, клиент увидит неполное тело
+            self.close_connection = True
+            self.log_error('Stream aborted: %s', e)
+        finally:
+            chunks.close()
     
-    def send_json_response(self, data, status=200):
-        """Отправка JSON ответа"""
-        self.send_response(status)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    def send_encoding_headers(self, encoding, headers):
+        """Заголовки сжатого ответа"""
+        self.send_header('Content-Encoding', encoding)
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # Сжатое представление не совпадает побайтно: ETag становится слабым
+            headers['ETag'] = 'W/' + etag
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            # Размер тела для метрик и журнала (тело потокового ответа считается по частям)
+            self.bytes_sent = int(value)
+        super().send_header(keyword, value)
+    
+    def log_request(self, code='-', size='-'):
+        # Запрос попадает в журнал после отправки ответа, когда известны время и размер
+        self.status_code = int(code)
+    
+    def record_request(self):
+        """Учет запроса в метриках и журнале"""
+        elapsed = time.perf_counter() - self.started
+        route = self.route or 'other'
+        method = self.command if self.command in METRIC_METHODS else 'other'
+        metrics.registry.record_request(route, method, str(self.status_code), elapsed, self.bytes_sent)
         
-        response_json = json.dumps(data, ensure_ascii=False)
-        self.wfile.write(response_json.encode('utf-8'))
+        if self.access_log == 'off':
+            return
+        if self.status_code < 500 and random.random() >= self.access_log_sample:
+            return
+        if self.access_log == 'json':
+            sys.stderr.write(json.dumps({
+                'time': datetime.datetime.now().astimezone().isoformat(timespec='milliseconds'),
+                'client': self.client_address[0],
+                'method': self.command,
+                'path': self.path,
+                'route': route,
+                'status': self.status_code,
+                'bytes': self.bytes_sent,
+                'duration_ms': round(elapsed * 1000, 3),
+            }, ensure_ascii=False) + '\n')
+        else:
+            super().log_request(self.status_code, self.bytes_sent)
     
     def end_headers(self):
         """Добавляем CORS заголовки"""
         self.send_header('Access-Control-Allow-Origin', '*')
+        if not self.close_connection:
+            # Одно соединение - один запрос: ожидающий keep-alive занимал бы рабочий поток
+            self.send_header('Connection', 'close')
         super().end_headers()
 
-def main():
+class WorkerPoolHTTPServer(socketserver.TCPServer):
+    """HTTP сервер с ограниченным пулом рабочих потоков и очередью соединений"""
+    
+    allow_reuse_address = True
+    
+    def __init__(self, server_address, handler_class, workers=8, backlog=64, bind_and_activate=True):
+        self.request_queue_size = backlog
+        
+        # Принятые соединения ждут свободного потока в очереди ограниченной длины
+        self.pending = queue.Queue(maxsize=backlog)
+        self.workers = []
+        super().__init__(server_address, handler_class, bind_and_activate)
+        
+        self.workers = [
+            threading.Thread(target=self.worker_loop, name=f'dendro-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+    
+    def process_request(self, request, client_address):
+        """Передача соединения в очередь пула вместо обработки в цикле accept"""
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            metrics.registry.inc('dendro_http_rejected_total')
+            self.reject_request(request)
+    
+    def reject_request(self, request):
+        """Очередь переполнена: сразу отвечаем 503, не блокируя прием соединений"""
+        try:
+            request.sendall(
+                b'HTTP/1.0 503 Service Unavailable\r\n'
+                b'Retry-After: 1\r\n'
+                b'Content-Length: 0\r\n\r\n'
+            )
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def worker_loop(self):
+        """Рабочий поток: обрабатывает соединения из очереди до получения None"""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+    
+    def server_close(self):
+        """Закрытие сокета и ожидание обработки уже принятых запросов"""
+        super().server_close()
+        
+        # None встает в очередь после принятых соединений, поэтому они будут обработаны
+        for _ in self.workers:
+            self.pending.put(None)
+        for worker in self.workers:
+            worker.join()
+
+def create_server(port, workers, backlog, listen_fd=None):
+    """Создание HTTP сервера: с пулом потоков или однопоточного при workers=0
+
+    listen_fd - слушающий сокет, унаследованный от супервизора (режим нескольких процессов).
+    """
+    bind = listen_fd is None
+    if workers > 0:
+        httpd = WorkerPoolHTTPServer(("", port), DendroMonitorHTTPRequestHandler,
+                                     workers=workers, backlog=backlog, bind_and_activate=bind)
+    else:
+        httpd = socketserver.TCPServer(("", port), DendroMonitorHTTPRequestHandler, bind_and_activate=bind)
+    
+    if listen_fd is not None:
+        httpd.socket.close()
+        httpd.socket = socket.socket(fileno=listen_fd)
+        # Соединение будит все процессы, принимает одно: остальные получают EAGAIN и ждут дальше
+        httpd.socket.setblocking(False)
+        httpd.server_address = httpd.socket.getsockname()
+    return httpd
+
+class WorkerProcess:
+    """Процесс сервера под управлением супервизора"""
+    
+    def __init__(self, command, listen_fd):
+        ready_read, ready_write = os.pipe()
+        self.process = subprocess.Popen(command + ['--listen-fd', str(listen_fd), '--ready-fd', str(ready_write)],
+                                        pass_fds=(listen_fd, ready_write))
+        os.close(ready_write)
+        self.ready_fd = ready_read
+        self.started = time.monotonic()
+        self.terminated = False
+    
+    @property
+    def pid(self):
+        return self.process.pid
+    
+    def wait_ready(self, timeout):
+        """Ожидание готовности: процесс пишет байт в канал перед началом приема соединений"""
+        deadline = time.monotonic() + timeout
+        try:
+            while self.process.poll() is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                readable, _, _ = select.select([self.ready_fd], [], [], min(remaining, 0.5))
+                if readable:
+                    # Пустое чтение - процесс завершился, не успев стать готовым
+                    return os.read(self.ready_fd, 1) == b'1'
+            return False
+        finally:
+            self.close_ready()
+    
+    def close_ready(self):
+        if self.ready_fd is not None:
+            os.close(self.ready_fd)
+            self.ready_fd = None
+    
+    def terminate(self):
+        """SIGTERM (один раз): процесс перестает принимать соединения и дообрабатывает принятые"""
+        if not self.terminated and self.process.poll() is None:
+            self.terminated = True
+            self.process.terminate()
+    
+    def stop(self, timeout):
+        """Остановка с ожиданием; по истечении timeout - SIGKILL"""
+        self.close_ready()
+        self.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f"⚠️  Процесс {self.pid} не завершился за {timeout:g} с, SIGKILL")
+            self.process.kill()
+            self.process.wait()
+
+class PreforkSupervisor:
+    """Супервизор нескольких процессов сервера на одном слушающем сокете
+
+    Процессы - отдельные интерпретаторы server.py, сокет они наследуют как
+    открытый дескриптор. Упавший процесс перезапускается (повторные падения
+    сразу после запуска - с растущей паузой), SIGHUP - поочередный
+    перезапуск: новый процесс запускается, и только после его готовности
+    останавливается старый, поэтому соединения принимает прежнее число процессов.
+    """
+    
+    def __init__(self, command, processes, listen_socket):
+        self.command = command
+        self.count = processes
+        self.socket = listen_socket
+        self.workers = [None] * processes
+        # Пауза перед перезапуском и время перезапуска по слотам
+        self.delays = {}
+        self.restart_at = {}
+        self.reload_requested = False
+        self.stopping = False
+    
+    def spawn(self, slot):
+        worker = WorkerProcess(self.command, self.socket.fileno())
+        self.workers[slot] = worker
+        return worker
+    
+    def start(self):
+        """Запуск всех процессов и ожидание их готовности"""
+        for slot in range(self.count):
+            self.spawn(slot)
+        for worker in self.workers:
+            if not worker.wait_ready(WORKER_READY_SECONDS):
+                print(f"❌ Процесс {worker.pid} не запустился (код {worker.process.poll()})")
+                return False
+        print(f"👷 Процессов сервера: {self.count} ({', '.join(str(worker.pid) for worker in self.workers)})")
+        return True
+    
+    def reap(self):
+        """Учет завершившихся процессов и их перезапуск"""
+        now = time.monotonic()
+        for slot, worker in enumerate(self.workers):
+            if worker is not None and worker.process.poll() is not None:
+                worker.close_ready()
+                self.workers[slot] = None
+                # Падение сразу после запуска (ошибка в коде, нет базы): пауза удваивается
+                if now - worker.started < WORKER_MIN_UPTIME_SECONDS:
+                    self.delays[slot] = min(max(self.delays.get(slot, 0) * 2, 1), WORKER_MAX_RESTART_DELAY)
+                else:
+                    self.delays[slot] = 0
+                self.restart_at[slot] = now + self.delays[slot]
+                print(f"💥 Процесс {worker.pid} завершился с кодом {worker.process.returncode}, "
+                      f"перезапуск через {self.delays[slot]} с")
+            elif worker is None and self.restart_at.get(slot, now) <= now:
+                self.restart_at.pop(slot, None)
+                print(f"👷 Процесс {self.spawn(slot).pid} запущен вместо завершившегося")
+    
+    def rolling_restart(self):
+        """Поочередная замена процессов; если новый не запустился, старые продолжают работать"""
+        print("🔄 SIGHUP: поочередный перезапуск процессов")
+        for slot in range(self.count):
+            if self.stopping:
+                return
+            old = self.workers[slot]
+            new = WorkerProcess(self.command, self.socket.fileno())
+            if not new.wait_ready(WORKER_READY_SECONDS):
+                new.stop(WORKER_STOP_SECONDS)
+                print(f"❌ Новый процесс {new.pid} не запустился (код {new.process.returncode}), "
+                      f"перезапуск прерван")
+                return
+            self.workers[slot] = new
+            self.restart_at.pop(slot, None)
+            if old is not None:
+                old.stop(WORKER_STOP_SECONDS)
+                print(f"   процесс {old.pid} заменен на {new.pid}")
+        print("✅ Процессы перезапущены")
+    
+    def request_reload(self, signum, frame):
+        self.reload_requested = True
+    
+    def request_stop(self, signum, frame):
+        self.stopping = True
+    
+    def run(self):
+        """Цикл супервизора до SIGTERM или Ctrl+C; код завершения"""
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        try:
+            if not self.start():
+                return 1
+            while not self.stopping:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.rolling_restart()
+                self.reap()
+                time.sleep(SUPERVISOR_POLL_SECONDS)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        return 0
+    
+    def stop(self):
+        """Остановка всех процессов: каждый дообрабатывает принятые запросы"""
+        workers = [worker for worker in self.workers if worker is not None]
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.stop(WORKER_STOP_SECONDS)
+        self.socket.close()
+        print("\n🛑 Сервер остановлен")
+
+def parse_args(argv=None):
+    """Разбор параметров командной строки"""
+    parser = argparse.ArgumentParser(description='Сервер ДендроМонитор')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('DENDRO_PORT', 8000)),
+                        help='порт HTTP сервера (DENDRO_PORT)')
+    parser.add_argument('--cgi', action='store_true', default=os.environ.get('DENDRO_CGI') == '1',
+                        help='запускать API-скрипты через subprocess вместо вызова в процессе (DENDRO_CGI=1)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('DENDRO_WORKERS', 8)),
+                        help='число рабочих потоков, 0 - однопоточный режим (DENDRO_WORKERS)')
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('DENDRO_PROCESSES', 1)),
+                        help='число процессов сервера на одном порту, 0 - по числу ядер; SIGHUP - поочередный '
+                             'перезапуск (DENDRO_PROCESSES)')
+    parser.add_argument('--backlog', type=int, default=int(os.environ.get('DENDRO_BACKLOG', 64)),
+                        help='максимальная длина очереди соединений (DENDRO_BACKLOG)')
+    parser.add_argument('--access-log', choices=('text', 'json', 'off'),
+                        default=os.environ.get('DENDRO_ACCESS_LOG', 'text'),
+                        help='журнал запросов: строкой, строкой JSON или без журнала (DENDRO_ACCESS_LOG)')
+    parser.add_argument('--access-log-sample', type=float,
+                        default=float(os.environ.get('DENDRO_ACCESS_LOG_SAMPLE', 1.0)),
+                        help='доля запросов в журнале, ответы 5xx пишутся всегда (DENDRO_ACCESS_LOG_SAMPLE)')
+    slow_query_ms = os.environ.get('DENDRO_SLOW_QUERY_MS')
+    parser.add_argument('--slow-query-ms', type=float, default=float(slow_query_ms) if slow_query_ms else None,
+                        help='журнал запросов к базе дольше порога в мс с планами; включается и без перезапуска '
+                             'через POST /api/debug/slow-queries (DENDRO_SLOW_QUERY_MS)')
+    parser.add_argument('--snapshot', action='store_true', default=os.environ.get('DENDRO_SNAPSHOT') == '1',
+                        help='отвечать /api/trees?fields=compact и /api/stats из снимка в памяти (DENDRO_SNAPSHOT=1)')
+    # Процессу, запущенному супервизором: унаследованный сокет и канал сигнала готовности
+    parser.add_argument('--listen-fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def print_banner(args, processes=1):
+    """Параметры запуска и адреса API"""
+    print(f"🚀 Сервер запущен на http://localhost:{args.port}")
+    if processes > 1:
+        print(f"👥 Процессов сервера: {processes}, SIGHUP - поочередный перезапуск")
+    if args.workers > 0:
+        print(f"🧵 Рабочих потоков: {args.workers}{' в каждом процессе' if processes > 1 else ''}, "
+              f"очередь соединений: {args.backlog}")
+    if args.snapshot and not args.cgi:
+        print("🧊 Список деревьев (fields=compact) и статистика читаются из снимка в памяти")
+    if args.slow_query_ms is not None:
+        print(f"🔎 Журнал медленных запросов: дольше {args.slow_query_ms:g} мс")
+    if args.cgi:
+        print("🐢 Режим CGI: API-скрипты выполняются через subprocess")
+    print("📁 Статические файлы обслуживаются из текущей директории")
+    print("🔧 API доступно по адресам:")
+    print("   GET /api/trees.py - список всех деревьев")
+    print("   GET /api/trees.py?id=1 - информация о дереве")
+    print("   GET /api/trees?bbox=...&limit=5000&fields=compact - деревья области: id, координаты, порода, состояние")
+    print("   GET /api/stats - число деревьев по состоянию и породе")
+    print("   GET /api/changes?since=120 - изменения деревьев, осмотров и комментариев после версии")
+    print("   GET /api/changes/stream?since=120 - изменения потоком Server-Sent Events")
+    print("   GET /api/moderation/pending - очередь непроверенных комментариев (page_size, cursor)")
+    print("   POST /api/moderation/approve, /api/moderation/reject - одобрение и отклонение комментариев по списку id")
+    print("   GET /api/trees/clusters?bbox=...&zoom=12 - кластеры деревьев для масштаба карты")
+    print("   GET /api/trees/nearby?lat=55.75&lon=37.61&radius=50&k=10&status=poor,critical - ближайшие деревья")
+    print("   GET /api/tiles/{z}/{x}/{y} - тайл с деревьями (GeoJSON)")
+    print("   POST /api/add_tree.py - добавление дерева")
+    print("   GET /api/comments.py?tree_id=1 - комментарии к дереву")
+    print("   POST /api/comments.py - добавление комментария")
+    print("   POST /api/status - запись осмотра (нового состояния) дерева")
+    print("   POST /api/status/batch - запись списка осмотров одной транзакцией")
+    print("   POST /api/import?format=csv - массовый импорт деревьев (CSV, GeoJSON)")
+    print("   GET /api/import?job_id=1 - прогресс и ошибки задания импорта")
+    print("   GET /api/search?q=Тверская - полнотекстовый поиск по адресам, заметкам и комментариям")
+    print("   GET /api/analytics/degradation?group=species|district - скорость ухудшения состояния")
+    print("   GET /api/analytics/time-to-critical - время до критического состояния")
+    print("   GET /api/analytics/drops?levels=2&months=6 - деревья с резким ухудшением состояния")
+    print("   GET /metrics - метрики в формате Prometheus: запросы, время ответа, запросы к базе, кэши")
+    print("   GET /api/debug/pool - статистика пула подключений к базе")
+    print("   GET /api/debug/tiles - статистика кэша тайлов")
+    print("   GET /api/debug/cache - статистика кэша ответов")
+    print("   GET /api/debug/writes - очереди записи: глубина, размер пачек, время фиксации")
+    print("   GET /api/debug/snapshot - снимок деревьев в памяти: байт на дерево, время загрузки и чтения")
+    print("   GET /api/debug/slow-queries - худшие запросы к базе с планами; POST {\"enabled\": true, \"threshold_ms\": 50} - включение")
+    print("   GET /api/debug/analytics - загруженная история осмотров и кэш отчетов аналитики")
+    print("\n⏹️  Для остановки сервера нажмите Ctrl+C")
+
+def watch_supervisor(httpd):
+    """Процесс, оставшийся без супервизора (тот завершен аварийно), останавливается сам"""
+    supervisor = os.getppid()
+    
+    def watch():
+        while os.getppid() == supervisor:
+            time.sleep(1)
+        httpd.shutdown()
+    
+    threading.Thread(target=watch, name='dendro-supervisor-watch', daemon=True).start()
+
+def run_prefork(args, argv, processes):
+    """Режим нескольких процессов: сокет открывает супервизор, процессы его наследуют"""
+    if os.name != 'posix':
+        print("❌ Режим нескольких процессов доступен только в POSIX-системах")
+        return 1
+    
+    # Супервизор не обрабатывает запросы: подключение после миграций закрываем
+    get_pool().close_all()
+    listen_socket = socket.create_server(("", args.port), backlog=args.backlog)
+    command = [sys.executable, os.path.abspath(__file__)] + list(sys.argv[1:] if argv is None else argv)
+    print_banner(args, processes)
+    return PreforkSupervisor(command, processes, listen_socket).run()
+
+def main(argv=None):
     """Запуск сервера"""
+    args = parse_args(argv)
+    worker = args.listen_fd is not None
+    if worker:
+        # Ctrl+C и SIGHUP получает супервизор, он и останавливает процессы
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    
     # Создаем папки если их нет
     os.makedirs('data', exist_ok=True)
     os.makedirs('api', exist_ok=True)
     
-    PORT = 8000
-    
-    with socketserver.TCPServer(("", PORT), DendroMonitorHTTPRequestHandler) as httpd:
-        print(f"🚀 Сервер запущен на http://localhost:{PORT}")
-        print("📁 Статические файлы обслуживаются из текущей директории")
-        print("🔧 API доступно по адресам:")
-        print("   GET /api/trees.py - список всех деревьев")
-        print("   GET /api/trees.py?id=1 - информация о дереве")
-        print("   POST /api/add_tree.py - добавление дерева")
-        print("   GET /api/comments.py?tree_id=1 - комментарии к дереву")
-        print("   POST /api/comments.py - добавление комментария")
-        print("\n⏹️  Для остановки сервера нажмите Ctrl+C")
+    # Пул подключений к базе: по одному подключению на рабочий поток
+    configure_pool(max(args.workers, 1))
+    
+    # Миграции схемы выполняются один раз при запуске, а не в каждом запросе
+    # (в режиме нескольких процессов - в супервизоре до запуска процессов)
+    if not worker:
+        init_database()
+        processes = args.processes or os.cpu_count() or 1
+        if processes > 1:
+            return run_prefork(args, argv, processes)
+    
+    DendroMonitorHTTPRequestHandler.use_cgi = args.cgi
+    DendroMonitorHTTPRequestHandler.access_log = args.access_log
+    DendroMonitorHTTPRequestHandler.access_log_sample = args.access_log_sample
+    metrics.enable_query_timing()
+    if args.slow_query_ms is not None:
+        slow_query_log.enable(args.slow_query_ms)
+    
+    # Снимок деревьев загружается в фоне, до загрузки ответы читаются из базы
+    if args.snapshot:
+        os.environ['DENDRO_SNAPSHOT'] = '1'
+    if not args.cgi:
+        snapshot.tree_snapshot.start()
+    
+    with create_server(args.port, args.workers, args.backlog, args.listen_fd) as httpd:
+        # SIGTERM: прекращаем прием соединений, принятые запросы дообрабатываются
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+        
+        if worker:
+            watch_supervisor(httpd)
+            os.write(args.ready_fd, b'1')
+            os.close(args.ready_fd)
+        else:
+            print_banner(args)
         
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\n🛑 Сервер остановлен")
+        finally:
+            # Потоки событий занимают рабочие потоки: завершаем их до ожидания пула
+            changes.stop_streams()
+    
+    # Запросы дообработаны: фиксируем записи, оставшиеся в очередях
+    stop_write_queues()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file